@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2020 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Checkpoints of the enrichment.
+
+A checkpoint keeps the position (the sort values used by `search_after`)
+of the last raw item whose rich items were acknowledged by ElasticSearch,
+so an enrichment stopped in the middle is resumed from that item instead
+of starting again. The checkpoints are kept in a local JSON file, by the
+enriched index and the raw items read, and the one of an enrichment is
+removed once it finishes.
+"""
+
+import collections
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+
+from grimoirelab_toolkit.datetime import datetime_utcnow
+
+logger = logging.getLogger(__name__)
+
+
+class EnrichCheckpoints:
+    """Checkpoints stored in a JSON file. The file is locked while it
+    is read or written, so several processes can share it.
+
+    :param path: path of the file, created if it doesn't exist
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def get(self, key):
+        """Get the checkpoint saved with `key` or None if there isn't any"""
+
+        with self._locked():
+            return self._read().get(key)
+
+    def save(self, key, checkpoint):
+        """Save a checkpoint, replacing the one with the same key
+
+        :param key: key of the checkpoint
+        :param checkpoint: dict with the checkpoint
+        """
+        with self._locked():
+            checkpoints = self._read()
+            checkpoints[key] = checkpoint
+            self._write(checkpoints)
+
+    def remove(self, key):
+        """Remove the checkpoint saved with `key`, if any"""
+
+        with self._locked():
+            checkpoints = self._read()
+            if checkpoints.pop(key, None) is not None:
+                self._write(checkpoints)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self.path + '.lock', 'a') as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            with open(self.path) as fd:
+                return json.load(fd)
+        except FileNotFoundError:
+            return {}
+
+    def _write(self, checkpoints):
+        # The file is replaced at once, it is never left half written
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.checkpoints_', dir=dirname)
+        try:
+            with os.fdopen(fd, 'w') as tmp:
+                json.dump(checkpoints, tmp, indent=4, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+
+class CheckpointTracker:
+    """Track the raw items enriched and save a checkpoint when the packs with
+    their rich items are acknowledged by ElasticSearch.
+
+    A checkpoint is only taken between raw items, so the rich items of a raw
+    item are never split between two runs. The checkpoints of other versions
+    of the enricher are ignored.
+
+    :param checkpoints: `EnrichCheckpoints` where the checkpoint is saved
+    :param key: key of the checkpoint
+    :param version: version of the enricher
+    :param get_position: function returning the position of a raw item
+    :param interval: min seconds between two checkpoints saved
+    """
+    def __init__(self, checkpoints, key, version, get_position, interval=60):
+        self.checkpoints = checkpoints
+        self.key = key
+        self.version = version
+        self.get_position = get_position
+        self.interval = interval
+
+        self.position = None  # position of the last raw item acknowledged
+        self.items = 0  # raw items acknowledged, including the runs resumed
+        self.uploaded = 0  # rich items uploaded before this run
+
+        self._enriched = 0  # raw items fully added to the writer in this run
+        self._last = (None, 0)  # position and enriched items of the last raw item added
+        self._packs = 0  # packs sent by the writer
+        self._flushed = collections.deque()  # (pack, position, enriched items) of the packs not acknowledged
+        self._acknowledged = 0  # raw items acknowledged in this run
+        self._saved = time.time()
+
+        checkpoint = checkpoints.get(key)
+        if checkpoint and checkpoint.get('version') == version:
+            self.position = checkpoint['position']
+            self.items = checkpoint['items']
+            self.uploaded = checkpoint['uploaded']
+            logger.info("Resuming enrichment {} after {} items".format(key, self.items))
+        elif checkpoint:
+            logger.info("Checkpoint of {} ignored, saved by version {}".format(key, checkpoint.get('version')))
+
+    def item_done(self, item, writer):
+        """Track a raw item once all its rich items are added to the writer
+
+        :param item: raw item enriched
+        :param writer: `BulkWriter` where the rich items are added
+        """
+        previous = self._last
+        self._enriched += 1
+        self._last = (self.get_position(item), self._enriched)
+
+        if writer.packs > self._packs:
+            # The rich items left in the writer belong to this raw item
+            position, enriched = previous if len(writer) else self._last
+            if position is not None:
+                self._flushed.append((writer.packs, position, enriched))
+            self._packs = writer.packs
+
+        self.update(writer)
+
+    def update(self, writer):
+        """Move the position to the last raw item acknowledged and save it
+        when `interval` seconds passed since the last checkpoint"""
+
+        if self._acknowledge(writer) and time.time() - self._saved >= self.interval:
+            self.save(writer)
+
+    def save(self, writer):
+        """Save the checkpoint of the last raw item acknowledged"""
+
+        self._acknowledge(writer)
+        if self.position is None:
+            return
+
+        checkpoint = {
+            'position': self.position,
+            'items': self.items,
+            'uploaded': self.uploaded + writer.total,
+            'version': self.version,
+            'updated': datetime_utcnow().isoformat()
+        }
+        self.checkpoints.save(self.key, checkpoint)
+        self._saved = time.time()
+        logger.debug("Checkpoint of {} saved after {} items".format(self.key, self.items))
+
+    def finish(self):
+        """Remove the checkpoint once the enrichment finishes"""
+
+        self.checkpoints.remove(self.key)
+
+        total = self.items + self._enriched - self._acknowledged
+        logger.debug("Checkpoint of {} removed after {} items".format(self.key, total))
+
+    def _acknowledge(self, writer):
+        moved = False
+        while self._flushed and self._flushed[0][0] <= writer.acknowledged:
+            _, self.position, enriched = self._flushed.popleft()
+            self.items += enriched - self._acknowledged
+            self._acknowledged = enriched
+            moved = True
+
+        return moved
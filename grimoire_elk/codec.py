@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2020 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""JSON codec used to serialize the items uploaded to ElasticSearch and to
+deserialize the pages read from it.
+
+When `orjson` is installed it is used to encode and decode the documents,
+otherwise the standard `json` module is used. Values that `orjson` can't
+handle (i.e., integers bigger than 64 bits, lone surrogates, `NaN` literals)
+are processed again with the standard module, so both backends decode to the
+same objects. The encoded bytes may differ: `orjson` writes non-ASCII chars
+as UTF-8 while `json` escapes them, and non-finite floats are written as
+`null` instead of the `NaN` and `Infinity` literals that ElasticSearch rejects.
+
+`PageDecoder` decodes the hits of a search or scroll page one by one while
+the body is received, so a whole page is never kept in memory.
+"""
+
+import json
+import re
+
+try:
+    import orjson
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+except ImportError:
+    orjson = None
+
+# Runs of bytes without brackets, skipping the complete strings. The strings
+# are matched as unrolled loops, so an unterminated one at the end of a chunk
+# fails in linear time without nested quantifiers
+SKIP_PLAIN = re.compile(rb'(?:[^"{}\[\]]+|"[^"\\]*(?:\\.[^"\\]*)*")*', re.S)
+# Rest of a string, without the closing quote
+STRING_REST = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*', re.S)
+SCALAR_END = re.compile(rb'[\s,}\]]')
+WHITESPACE = b' \t\r\n'
+HITS_START = object()
+
+
+def dumps(obj):
+    """Serialize `obj` to a JSON str"""
+
+    if orjson:
+        try:
+            return orjson.dumps(obj, option=ORJSON_OPTIONS).decode('utf-8')
+        except TypeError:
+            pass
+
+    return json.dumps(obj)
+
+
+def dumpb(obj):
+    """Serialize `obj` to JSON encoded as UTF-8 bytes"""
+
+    if orjson:
+        try:
+            return orjson.dumps(obj, option=ORJSON_OPTIONS)
+        except TypeError:
+            pass
+
+    return json.dumps(obj).encode('utf-8')
+
+
+def dumpb_canonical(obj):
+    """Serialize `obj` to compact JSON with sorted keys, as UTF-8 bytes.
+    Equal objects are serialized to the same bytes (e.g., to hash them).
+    Lone surrogates, found in some raw items, are kept as they are."""
+
+    if orjson:
+        try:
+            return orjson.dumps(obj, option=ORJSON_OPTIONS | orjson.OPT_SORT_KEYS)
+        except TypeError:
+            pass
+
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8', 'surrogatepass')
+
+
+def loads(data):
+    """Deserialize a JSON document from str or bytes"""
+
+    if orjson:
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            pass
+
+    return json.loads(data)
+
+
+def get_backend():
+    """Name of the module used to encode and decode JSON"""
+
+    return 'orjson' if orjson else 'json'
+
+
+class PageDecoder:
+    """Decode incrementally the hits of a search or scroll page.
+
+    The body of the page is read chunk by chunk and each hit is decoded
+    as soon as it is complete, so only the chunk read and the hit being
+    decoded are kept in memory. The fields of the page other than the
+    hits (e.g., `_scroll_id`, `hits.total`) are decoded into `meta`;
+    the ones written after the hits are available once they are read.
+
+    :param chunks: iterable with the bytes of the body of the page
+    """
+    def __init__(self, chunks):
+        self.meta = {}
+        self.num_hits = 0
+        self.num_bytes = 0
+
+        self._chunks = iter(chunks)
+        self._buf = bytearray()
+        self._pos = 0
+        self._events = self._parse()
+        self._started = False
+
+    def start(self):
+        """Decode the fields of the page written before the hits"""
+
+        if self._started:
+            return
+        self._started = True
+
+        for event in self._events:
+            if event is HITS_START:
+                break
+
+    def hits(self):
+        """Generator of the hits of the page, decoded one by one"""
+
+        self.start()
+        for hit in self._events:
+            self.num_hits += 1
+            yield loads(hit)
+
+    def close(self):
+        """Stop decoding the page and close the chunks read"""
+
+        self._events.close()
+        if hasattr(self._chunks, 'close'):
+            self._chunks.close()
+
+    def _parse(self):
+        self._expect(b'{')
+        for key in self._keys():
+            if key == 'hits' and self._peek() == b'{':
+                self._pos += 1
+                hits_meta = self.meta[key] = {}
+                for hits_key in self._keys():
+                    if hits_key == 'hits' and self._peek() == b'[':
+                        self._pos += 1
+                        yield HITS_START
+                        yield from self._elements()
+                    else:
+                        hits_meta[hits_key] = loads(self._read_value())
+            else:
+                self.meta[key] = loads(self._read_value())
+
+    def _keys(self):
+        """Keys of the object being read, once its `{` is consumed. The
+        value of each key must be read before asking for the next one"""
+
+        if self._peek() == b'}':
+            self._pos += 1
+            return
+
+        while True:
+            key = loads(self._read_value())
+            self._expect(b':')
+            yield key
+            self._expect_any(b',}')
+            if self._buf[self._pos - 1:self._pos] == b'}':
+                return
+
+    def _elements(self):
+        """Raw elements of the array being read, once its `[` is consumed"""
+
+        if self._peek() == b']':
+            self._pos += 1
+            return
+
+        while True:
+            yield self._read_value()
+            self._expect_any(b',]')
+            if self._buf[self._pos - 1:self._pos] == b']':
+                return
+
+    def _fill(self):
+        """Read the next chunk dropping the bytes already decoded. Return
+        False when the body is over."""
+
+        for chunk in self._chunks:
+            if not chunk:
+                continue
+            if self._pos:
+                del self._buf[:self._pos]
+                self._pos = 0
+            self._buf += chunk
+            self.num_bytes += len(chunk)
+            return True
+
+        return False
+
+    def _peek(self):
+        """Skip the whitespace and return the next byte without consuming it"""
+
+        while True:
+            buf = self._buf
+            while self._pos < len(buf) and buf[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(buf):
+                return bytes(buf[self._pos:self._pos + 1])
+            if not self._fill():
+                raise ValueError("Unexpected end of the page")
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError("Expected {} at byte {} of the page".format(char, self.num_bytes))
+        self._pos += 1
+
+    def _expect_any(self, chars):
+        if self._peek() not in chars:
+            raise ValueError("Expected one of {} at byte {} of the page".format(chars, self.num_bytes))
+        self._pos += 1
+
+    def _read_value(self):
+        """Read the raw bytes of the next value"""
+
+        first = self._peek()
+        if first == b'"':
+            end = self._scan_string()
+        elif first in b'{[':
+            end = self._scan_nested()
+        else:
+            end = self._scan_scalar()
+        value = self._buf[self._pos:end]
+        self._pos = end
+
+        return value
+
+    def _scan_string(self):
+        """Find the end of the string at the current position"""
+
+        offset = 1
+        while True:
+            pos = STRING_REST.match(self._buf, self._pos + offset).end()
+            if pos < len(self._buf) and self._buf[pos] == 0x22:
+                return pos + 1
+            # The offset scanned is kept, the next chunks drop the bytes before the value
+            offset = pos - self._pos
+            if not self._fill():
+                raise ValueError("Unexpected end of the page")
+
+    def _scan_nested(self):
+        """Find the end of the object or array at the current position"""
+
+        depth = 0
+        in_string = False
+        offset = 0
+        while True:
+            buf = self._buf
+            pos = self._pos + offset
+            while pos < len(buf):
+                if in_string:
+                    pos = STRING_REST.match(buf, pos).end()
+                    if pos == len(buf) or buf[pos] != 0x22:
+                        # Not complete yet, or the escaped char is in the next chunk
+                        break
+                    pos += 1
+                    in_string = False
+
+                pos = SKIP_PLAIN.match(buf, pos).end()
+                if pos == len(buf):
+                    break
+
+                char = buf[pos]
+                pos += 1
+                if char == 0x22:  # '"', a string not complete in the buffer
+                    in_string = True
+                elif char in b'{[':
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        return pos
+
+            offset = pos - self._pos
+            if not self._fill():
+                raise ValueError("Unexpected end of the page")
+
+    def _scan_scalar(self):
+        """Find the end of the number, boolean or null at the current position"""
+
+        offset = 0
+        while True:
+            match = SCALAR_END.search(self._buf, self._pos + offset)
+            if match:
+                return match.start()
+            offset = len(self._buf) - self._pos
+            if not self._fill():
+                return len(self._buf)
@@ -19,18 +19,25 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
+import hashlib
 import json
 import logging
-import sys
-from time import time
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import DEFAULT_POOLSIZE
 
 from grimoirelab_toolkit.datetime import (str_to_datetime,
                                           unixtime_to_datetime,
                                           InvalidDateError)
 
-from grimoire_elk.errors import ELKError, ElasticError
+from grimoire_elk import codec
+from grimoire_elk import query as esq
+from grimoire_elk.errors import ElasticError
 from grimoire_elk.enriched.utils import (grimoire_con,
                                          get_diff_current_date,
                                          anonymize_url)
@@ -38,15 +45,306 @@ from grimoire_elk.enriched.utils import (grimoire_con,
 logger = logging.getLogger(__name__)
 
 HEADER_JSON = {"Content-Type": "application/json"}
+BULK_ACTION_INDEX = '{"index" : {"_id" : "%s" } }\n'
+
+# Refresh policies for the bulk requests
+REFRESH_NONE = 'false'  # never refresh, rely on the index refresh interval
+REFRESH_WAIT_FOR = 'wait_for'  # wait for the next scheduled refresh before answering
+REFRESH_TRUE = 'true'  # refresh the affected shards on every bulk request
+REFRESH_END = 'end'  # refresh the index once, when the run (feed, enrich, study) ends
+REFRESH_POLICIES = [REFRESH_NONE, REFRESH_WAIT_FOR, REFRESH_TRUE, REFRESH_END]
+
+# Status of the items rejected because the cluster is overloaded, they can be sent again
+RETRYABLE_BULK_STATUS = [429, 503]
+DEAD_LETTER_LOCK = threading.Lock()
+
+# Major versions of the ES instances, by url, and fingerprints of the
+# settings (analyzers, mappings and aliases) applied to each (url, index)
+ES_VERSION_CACHE = {}
+BOOTSTRAP_CACHE = {}
+BOOTSTRAP_LOCK = threading.Lock()
+
+# Indexes of the aliases, by (url, alias), with the time they were retrieved
+ALIAS_CACHE = {}
+ALIAS_LOCK = threading.Lock()
+
+# Settings of the indexes while they are filled in bulk-load mode
+BULK_LOAD_SETTINGS = {
+    "index.refresh_interval": "-1",
+    "index.number_of_replicas": 0
+}
+
+# Last dates/offsets prefetched for a list of origins (or tags), by
+# (index url, field, offset, filter name, other filters)
+LAST_ITEMS_CACHE = {}
+LAST_ITEMS_LOCK = threading.Lock()
+
+BulkResult = namedtuple('BulkResult', ['inserted', 'retried', 'dropped'])
+
+
+class BulkUploader:
+    """Upload bulk packs to ElasticSearch concurrently.
+
+    Packs are sent by a pool of `workers` threads sharing the HTTP session
+    of the ElasticSearch object. At most `max_pending` packs can be queued or
+    in flight, `submit` blocks when this limit is reached so the producer
+    can't get too far ahead of ElasticSearch.
+
+    :param elastic: ElasticSearch object where the items are uploaded
+    :param workers: number of concurrent bulk requests
+    :param max_pending: max number of packs queued or in flight, by default twice
+        the number of workers
+    """
+    def __init__(self, elastic, workers, max_pending=None):
+        self.elastic = elastic
+        self.workers = workers
+        self.max_pending = max_pending if max_pending else 2 * workers
+
+        self.inserted = 0
+        self.retried = 0
+        self.failed = 0
+        self.submitted = 0  # packs submitted
+        self.acknowledged = 0  # first packs submitted which are all uploaded
+
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pending = []
+        self._error_pack = None  # first pack which failed
+
+    def submit(self, url, bulk_json, num_items):
+        """Queue a pack to be uploaded, blocking while there are
+        `max_pending` packs waiting for a response.
+
+        :param url: target index where to bulk the items
+        :param bulk_json: str representation of the items to upload
+        :param num_items: number of items in the pack
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self.elastic.put_bulk_pack, url, bulk_json)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        self.submitted += 1
+        self._pending.append((self.submitted, future, num_items))
+        self._collect(wait=False)
+
+    def wait(self):
+        """Wait until all the packs submitted are uploaded.
+
+        :returns: number of items inserted so far
+        """
+        self._collect(wait=True)
+        return self.inserted
+
+    def close(self):
+        """Wait for the pending packs and stop the workers"""
+
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def _collect(self, wait):
+        """Update the counters with the results of the packs already uploaded.
+        The first error raised by a pack is raised again here."""
+
+        pending = []
+        error = None
+        for pack, future, num_items in self._pending:
+            if not wait and not future.done():
+                pending.append((pack, future, num_items))
+                continue
+            try:
+                result = future.result()
+                inserted = result.inserted
+                self.retried += result.retried
+            except Exception as ex:
+                inserted = 0
+                error = error if error else ex
+                self._error_pack = min(pack, self._error_pack) if self._error_pack else pack
+            self.inserted += inserted
+            self.failed += num_items - inserted
+
+        self._pending = pending
+        # The packs after a failed or pending one are not acknowledged yet
+        acknowledged = pending[0][0] - 1 if pending else self.submitted
+        if self._error_pack:
+            acknowledged = min(acknowledged, self._error_pack - 1)
+        self.acknowledged = acknowledged
+        if error:
+            raise error
+
+
+class BulkWriter:
+    """Build bulk NDJSON bodies and upload them to ElasticSearch in packs.
+
+    Documents are serialized to bytes once when added, using the codec in
+    `grimoire_elk.codec`, and kept in a list of chunks which are joined
+    only when the pack is sent. A pack is flushed when its
+    size reaches `max_bytes` or, if set, when it holds `max_items` documents.
+
+    The writer can be used as a context manager, remaining documents are
+    flushed when leaving the block without errors.
+
+    :param elastic: ElasticSearch object where the items are uploaded
+    :param url: bulk URL endpoint, by default the one of `elastic`
+    :param max_bytes: size (in bytes) of the packs, by default `elastic.max_bytes_bulk`
+    :param max_items: max number of items per pack, by default `elastic.max_items_bulk`.
+        If `0`, the packs are limited only by their size
+    :param workers: number of concurrent bulk requests, by default `elastic.bulk_workers`.
+        With more than one worker, the packs are uploaded by a `BulkUploader` and
+        the counters are accurate once the writer is closed
+    """
+    def __init__(self, elastic, url=None, max_bytes=None, max_items=None, workers=None):
+        self.elastic = elastic
+        self.url = url if url else elastic.get_bulk_url()
+        self.max_bytes = max_bytes if max_bytes is not None else elastic.max_bytes_bulk
+        self.max_items = max_items if max_items is not None else elastic.max_items_bulk
+        self.workers = workers if workers is not None else elastic.bulk_workers
+
+        self.total = 0  # total items uploaded
+        self.retried = 0  # total items sent again after being rejected
+        self.failed = 0  # total items not uploaded
+        self.packs = 0  # total packs sent
+        self.acknowledged = 0  # first packs sent which are all uploaded
+
+        self._chunks = []
+        self._size = 0
+        self._items = 0
+        self._uploader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._uploader:
+            # The counters are kept up to date with the packs uploaded before the error
+            try:
+                self._uploader.close()
+            finally:
+                self._update_counters()
+                self._uploader = None
+
+    def __len__(self):
+        return self._items
+
+    def add(self, _id, doc):
+        """Add a document to the current pack, the pack is flushed
+        if it exceeds the size or items limits.
+
+        :param _id: ID of the document in the index
+        :param doc: dict representation of the document
+        """
+        self.add_json(_id, codec.dumpb(doc))
+
+    def add_json(self, _id, doc_json):
+        """Add an already serialized document to the current pack.
+
+        :param _id: ID of the document in the index
+        :param doc_json: str or UTF-8 bytes representation of the document
+        """
+        action = (BULK_ACTION_INDEX % _id).encode('utf-8')
+        if isinstance(doc_json, str):
+            doc_json = doc_json.encode('utf-8')
+
+        self._chunks.append(action)
+        self._chunks.append(doc_json)
+        self._chunks.append(b"\n")
+        self._size += len(action) + len(doc_json) + 1
+        self._items += 1
+
+        if self._size >= self.max_bytes or (self.max_items and self._items >= self.max_items):
+            self.flush()
+
+    def flush(self):
+        """Upload the current pack to ElasticSearch. When using several
+        workers, the pack is queued and the call returns once it is accepted.
+
+        :returns: number of items inserted from the pack, `None` if
+            the pack was queued
+        """
+        if not self._items:
+            return 0
+
+        bulk_json = b"".join(self._chunks)
+        size = self._size
+        num_items = self._items
+        self._chunks = []
+        self._size = 0
+        self._items = 0
+        self.packs += 1
+
+        if self.workers > 1:
+            if not self._uploader:
+                self._uploader = BulkUploader(self.elastic, self.workers)
+                self._uploader.inserted = self.total
+                self._uploader.retried = self.retried
+                self._uploader.failed = self.failed
+                self._uploader.submitted = self.packs - 1
+                self._uploader.acknowledged = self.acknowledged
+            self._uploader.submit(self.url, bulk_json, num_items)
+            self._update_counters()
+            return None
+
+        task_init = time.time()
+        result = self.elastic.put_bulk_pack(self.url, bulk_json)
+        inserted = result.inserted
+
+        self.total += inserted
+        self.retried += result.retried
+        self.failed += num_items - inserted
+        self.acknowledged = self.packs
+        logger.debug("bulk packet sent ({:.2f} sec, {} total, {:.2f} MB)".format(
+                     time.time() - task_init, self.total, size / (1024 * 1024)))
+
+        return inserted
+
+    def close(self):
+        """Flush the current pack and wait for the pending ones.
+
+        :returns: total number of items inserted
+        """
+        self.flush()
+
+        if self._uploader:
+            try:
+                self._uploader.close()
+            finally:
+                self._update_counters()
+                self._uploader = None
+
+        return self.total
+
+    def _update_counters(self):
+        self.total = self._uploader.inserted
+        self.retried = self._uploader.retried
+        self.failed = self._uploader.failed
+        self.acknowledged = self._uploader.acknowledged
 
 
 class ElasticSearch(object):
 
     max_items_bulk = 1000
+    max_bytes_bulk = 10 * 1024 * 1024  # max size of a bulk request (10 MB)
+    refresh_policy = REFRESH_TRUE  # refresh policy of the bulk requests
+    bulk_workers = 1  # number of concurrent bulk requests
+    max_retries_bulk = 5  # max retries of the items rejected by an overloaded cluster
+    retry_backoff_bulk = 0.5  # base time (seconds) to wait before retrying rejected items
+    retry_backoff_max_bulk = 30  # max time (seconds) to wait before retrying rejected items
+    dead_letter_path = None  # file where the items that can't be inserted are stored
     max_items_clause = 1000  # max items in search clause (refresh identities)
+    alias_cache_ttl = 60  # time (seconds) the indexes of an alias are remembered
+    bulk_load = False  # fill the indexes created from scratch in bulk-load mode
+    bulk_load_force_merge = None  # max num of segments to merge the index into after a bulk load
+    bulk_load_timeout = '5m'  # max time to wait for the index to be green after a bulk load
 
     def __init__(self, url, index, mappings=None, clean=False,
-                 insecure=True, analyzers=None, aliases=None):
+                 insecure=True, analyzers=None, aliases=None, bootstrap_cache=False,
+                 bulk_load=None):
         """Class to handle the operations with the ElasticSearch database, such as
         creating indexes, mappings, setting up aliases and uploading documents.
 
@@ -57,11 +355,20 @@ class ElasticSearch(object):
         :param insecure: support https with invalid certificates
         :param analyzers: analyzers for ElasticSearch
         :param aliases: list of aliases, defined as strings, to be added to the index
+        :param bootstrap_cache: if True, the ES version and the setup of the index are
+            reused from previous objects of the same url and index in this process. The
+            index, mappings and aliases are set up again only when they change
+        :param bulk_load: if True, an index created from scratch is filled in bulk-load
+            mode until `end_bulk_load` is called. By default, `ElasticSearch.bulk_load`
         """
         # Get major version of Elasticsearch instance
-        self.major = self.check_instance(url, insecure)
-        logger.debug("Found version of ES instance at {}: {}.".format(
-                     anonymize_url(url), self.major))
+        if bootstrap_cache and url in ES_VERSION_CACHE:
+            self.major = ES_VERSION_CACHE[url]
+        else:
+            self.major = self.check_instance(url, insecure)
+            ES_VERSION_CACHE[url] = self.major
+            logger.debug("Found version of ES instance at {}: {}.".format(
+                         anonymize_url(url), self.major))
 
         self.url = url
 
@@ -71,12 +378,26 @@ class ElasticSearch(object):
 
         self.index_url = self.url + "/" + self.index
         self.wait_bulk_seconds = 2  # time to wait to complete a bulk operation
+        self.bulk_load_settings = None  # settings to restore at the end of the bulk load
+
+        self.requests = grimoire_con(insecure, pool_maxsize=max(self.bulk_workers, DEFAULT_POOLSIZE))
+
+        map_dict = mappings.get_elastic_mappings(es_major=self.major) if mappings else None
+        cache_key = (self.url, self.index)
+        fingerprint = self.get_bootstrap_fingerprint(analyzers, map_dict, aliases)
 
-        self.requests = grimoire_con(insecure)
+        if bootstrap_cache and not clean and BOOTSTRAP_CACHE.get(cache_key) == fingerprint:
+            # The index could have been deleted since it was set up
+            if self.requests.head(self.index_url).status_code == 200:
+                logger.debug("Index {} already set up, skipping mappings and aliases".format(
+                             anonymize_url(self.index_url)))
+                return
 
-        self.create_index(analyzers, clean)
-        if mappings:
-            map_dict = mappings.get_elastic_mappings(es_major=self.major)
+            logger.debug("Index {} not found, setting it up again".format(anonymize_url(self.index_url)))
+
+        bulk_load = bulk_load if bulk_load is not None else self.bulk_load
+        self.create_index(analyzers, clean, bulk_load=bulk_load)
+        if map_dict:
             self.create_mappings(map_dict)
 
         if aliases:
@@ -88,6 +409,42 @@ class ElasticSearch(object):
 
                 self.add_alias(alias)
 
+        with BOOTSTRAP_LOCK:
+            BOOTSTRAP_CACHE[cache_key] = fingerprint
+
+    @staticmethod
+    def get_bootstrap_fingerprint(analyzers, mappings, aliases):
+        """Get a fingerprint of the settings applied to an index
+
+        :param analyzers: analyzers of the index
+        :param mappings: dict with the mappings of the index, by type
+        :param aliases: list of aliases of the index
+        """
+        settings = json.dumps([analyzers, mappings, aliases], sort_keys=True)
+        return hashlib.sha1(settings.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def clear_bootstrap_cache(url=None, index=None):
+        """Forget the setup of the indexes, so it is done again the next time
+        they are used. It must be called when an index is deleted out of
+        this class.
+
+        :param url: ES url of the indexes to forget, all of them by default
+        :param index: index to forget, all the ones of `url` by default
+        """
+        ElasticSearch.clear_alias_cache(url)
+
+        with BOOTSTRAP_LOCK:
+            if not url and not index:
+                ES_VERSION_CACHE.clear()
+                BOOTSTRAP_CACHE.clear()
+                return
+
+            for cache_key in list(BOOTSTRAP_CACHE):
+                if (not url or cache_key[0] == url) and \
+                        (not index or cache_key[1] == ElasticSearch.safe_index(index)):
+                    del BOOTSTRAP_CACHE[cache_key]
+
     @classmethod
     def safe_index(cls, unique_id):
         """Return a valid elastic index generated from unique_id
@@ -131,11 +488,13 @@ class ElasticSearch(object):
                 logger.error(msg)
                 raise ElasticError(cause=msg)
 
-    def create_index(self, analyzers=None, clean=False):
+    def create_index(self, analyzers=None, clean=False, bulk_load=False):
         """Create an index. If clean is `True`, the target index will be deleted and recreated.
 
         :param analyzers: set index analyzers
         :param clean: if True, the index is deleted and recreated
+        :param bulk_load: if True and the index is created, it is filled in
+            bulk-load mode until `end_bulk_load` is called
         """
         res = self.requests.get(self.index_url)
 
@@ -151,54 +510,326 @@ class ElasticSearch(object):
             else:
                 logger.info("Created index {}".format(anonymize_url(self.index_url)))
         else:
-            if clean:
-                res = self.requests.delete(self.index_url)
-                res.raise_for_status()
-                res = self.requests.put(self.index_url, data=analyzers,
-                                        headers=headers)
-                res.raise_for_status()
-                logger.info("Deleted and created index {}".format(anonymize_url(self.index_url)))
+            if not clean:
+                return
+
+            res = self.requests.delete(self.index_url)
+            res.raise_for_status()
+            res = self.requests.put(self.index_url, data=analyzers,
+                                    headers=headers)
+            res.raise_for_status()
+            logger.info("Deleted and created index {}".format(anonymize_url(self.index_url)))
+
+        if bulk_load:
+            self.start_bulk_load()
+
+    def get_index_uuid(self):
+        """Get the UUID of the index, which changes when the index is created again.
+        For aliases, the UUIDs of their indexes.
+
+        :returns: the UUID or None if it can't be retrieved
+        """
+        url = self.index_url + "/_settings/index.uuid"
+        try:
+            res = self.requests.get(url, headers=HEADER_JSON, verify=False)
+            res.raise_for_status()
+        except requests.exceptions.RequestException:
+            logger.debug("UUID of index {} not found".format(anonymize_url(self.index_url)))
+            return None
+
+        uuids = sorted(settings['settings']['index']['uuid'] for settings in res.json().values())
+
+        return ",".join(uuids)
+
+    def start_bulk_load(self):
+        """Disable the refresh and the replicas of the index while it is filled.
+        The previous settings are restored by `end_bulk_load`.
+        """
+        if self.bulk_load_settings is not None:
+            return
+
+        r = self.requests.get(self.index_url + "/_settings?flat_settings=true", headers=HEADER_JSON, verify=False)
+        try:
+            r.raise_for_status()
+            current = list(r.json().values())[0]['settings']
+            r = self.requests.put(self.index_url + "/_settings", headers=HEADER_JSON, verify=False,
+                                  data=json.dumps(BULK_LOAD_SETTINGS))
+            r.raise_for_status()
+        except requests.exceptions.HTTPError as ex:
+            logger.warning("Bulk-load mode not set on {}, {}".format(anonymize_url(self.index_url), ex))
+            return
+
+        # Settings not defined in the index are restored to their default value (null)
+        self.bulk_load_settings = {setting: current.get(setting) for setting in BULK_LOAD_SETTINGS}
+
+        logger.info("Bulk-load mode set on {}".format(anonymize_url(self.index_url)))
+
+    def end_bulk_load(self, force_merge=None):
+        """Restore the settings of the index changed by `start_bulk_load`, refresh it and
+        wait until it is green. If the index is not in bulk-load mode, nothing is done.
+
+        :param force_merge: max number of segments to merge the index into, by
+            default `bulk_load_force_merge`. If `None`, the index is not merged
+        """
+        if self.bulk_load_settings is None:
+            return
+
+        force_merge = force_merge if force_merge is not None else self.bulk_load_force_merge
+        settings = self.bulk_load_settings
+        self.bulk_load_settings = None
+
+        r = self.requests.put(self.index_url + "/_settings", headers=HEADER_JSON, verify=False,
+                              data=json.dumps(settings))
+        try:
+            r.raise_for_status()
+        except requests.exceptions.HTTPError as ex:
+            logger.error("Settings of {} not restored after the bulk load, {}. Settings: {}".format(
+                         anonymize_url(self.index_url), ex, settings))
+            return
+
+        self.refresh_index()
+
+        if force_merge:
+            r = self.requests.post(self.index_url + "/_forcemerge?max_num_segments={}".format(force_merge),
+                                   headers=HEADER_JSON, verify=False)
+            try:
+                r.raise_for_status()
+            except requests.exceptions.HTTPError as ex:
+                logger.warning("Something went wrong when merging {}, {}".format(
+                               anonymize_url(self.index_url), ex))
+
+        health_url = self.url + "/_cluster/health/" + self.index
+        r = self.requests.get(health_url + "?wait_for_status=green&timeout=" + self.bulk_load_timeout,
+                              headers=HEADER_JSON, verify=False)
+        if r.status_code != 200 or r.json().get('timed_out'):
+            logger.warning("Index {} not green after the bulk load".format(anonymize_url(self.index_url)))
+
+        logger.info("Bulk-load mode ended on {}".format(anonymize_url(self.index_url)))
 
     def safe_put_bulk(self, url, bulk_json):
-        """Bulk items to a target index `url`. In case of UnicodeEncodeError,
-        the bulk is encoded with iso-8859-1.
+        """Bulk items to a target index `url`.
 
         :param url: target index where to bulk the items
-        :param bulk_json: str representation of the items to upload
+        :param bulk_json: str or UTF-8 bytes representation of the items to upload
         """
-        headers = {"Content-Type": "application/x-ndjson"}
+        return self.put_bulk(url, bulk_json).inserted
 
-        try:
-            res = self.requests.put(url + '?refresh=true', data=bulk_json, headers=headers)
-            res.raise_for_status()
-        except UnicodeEncodeError:
-            # Related to body.encode('iso-8859-1'). mbox data
-            logger.warning("Encondig error ... converting bulk to iso-8859-1")
-            bulk_json = bulk_json.encode('iso-8859-1', 'ignore')
-            res = self.requests.put(url, data=bulk_json, headers=headers)
-            res.raise_for_status()
+    def put_bulk(self, url, bulk_json):
+        """Bulk items to a target index `url`, handling the failures of every item.
 
-        result = res.json()
-        failed_items = []
-        error = ""
-        if result['errors']:
-            # Due to multiple errors that may be thrown when inserting bulk data, only the first error is returned
-            failed_items = [item['index'] for item in result['items'] if 'error' in item['index']]
-            error = str(failed_items[0]['error'])
+        Items rejected because the cluster is overloaded (HTTP 429 or 503) are sent
+        again, waiting between attempts with an exponential backoff plus jitter.
+        Items that can't be inserted are appended to the dead letter file, when
+        `dead_letter_path` is set.
+
+        :param url: target index where to bulk the items
+        :param bulk_json: str or UTF-8 bytes representation of the items to upload
 
+        :returns: a BulkResult with the number of items inserted, retried and dropped
+        """
+        inserted = 0
+        retried = 0
+        attempt = 0
+        failed = []
+        dead_letters = []
+
+        while True:
+            result = self._send_bulk(url, bulk_json)
+            retryable, permanent = self._classify_bulk_errors(result)
+            inserted += len(result['items']) - len(retryable) - len(permanent)
+
+            if retryable and attempt >= self.max_retries_bulk:
+                logger.error("Max retries exceeded, {} items rejected by ES: {}, {}".format(
+                             len(retryable), retryable[0][1]['error'], anonymize_url(url)))
+                permanent.extend(retryable)
+                retryable = []
+
+            if permanent:
+                failed.extend(permanent)
+                dead_letters.append(self._get_bulk_lines(bulk_json, [pos for pos, _ in permanent]))
+
+            if not retryable:
+                break
+
+            retried += len(retryable)
+            backoff = random.uniform(0, min(self.retry_backoff_max_bulk, self.retry_backoff_bulk * 2 ** attempt))
+            logger.warning("{} items rejected by ES, retrying in {:.2f} seconds ({})".format(
+                           len(retryable), backoff, anonymize_url(url)))
+            time.sleep(backoff)
+
+            bulk_json = self._get_bulk_lines(bulk_json, [pos for pos, _ in retryable])
+            attempt += 1
+
+        if failed:
+            # Due to multiple errors that may be thrown when inserting bulk data, only the first error is returned
+            error = str(failed[0][1]['error'])
             logger.error("Failed to insert data to ES: {}, {}".format(error, anonymize_url(url)))
 
-        inserted_items = len(result['items']) - len(failed_items)
+            if self.dead_letter_path:
+                for bulk_lines in dead_letters:
+                    self.write_dead_letters(bulk_lines)
+
+        logger.debug("{} items uploaded to ES ({})".format(inserted, anonymize_url(url)))
+        return BulkResult(inserted=inserted, retried=retried, dropped=len(failed))
+
+    def _send_bulk(self, url, bulk_json):
+        """Send a bulk request and return its JSON response"""
 
-        # The exception is currently not thrown to avoid stopping ocean uploading processes
+        headers = {"Content-Type": "application/x-ndjson"}
+        # The URL could have its own refresh param (e.g., the one of the replays)
+        if 'refresh=' not in url:
+            url += self.get_refresh_param()
+
+        # The str bodies would be encoded as iso-8859-1 by http.client
+        if isinstance(bulk_json, str):
+            bulk_json = bulk_json.encode('utf-8')
+
+        res = self.requests.put(url, data=bulk_json, headers=headers)
+        res.raise_for_status()
+
+        return codec.loads(res.content)
+
+    @staticmethod
+    def _classify_bulk_errors(result):
+        """Split the items of a bulk response that failed in retryable and permanent
+        failures. Each failure is a tuple with the position of the item in the
+        request and its result.
+
+        :param result: JSON response of a bulk request
+        """
+        retryable = []
+        failed = []
+
+        if not result['errors']:
+            return retryable, failed
+
+        for pos, item in enumerate(result['items']):
+            item_result = list(item.values())[0]
+            if 'error' not in item_result:
+                continue
+            if item_result.get('status') in RETRYABLE_BULK_STATUS:
+                retryable.append((pos, item_result))
+            else:
+                failed.append((pos, item_result))
+
+        return retryable, failed
+
+    @staticmethod
+    def _get_bulk_lines(bulk_json, positions):
+        """Get the bulk body with the action and document lines of the items
+        in `positions`.
+
+        :param bulk_json: str (or bytes) representation of the items uploaded
+        :param positions: positions of the items in the bulk
+        """
+        sep = b"\n" if isinstance(bulk_json, bytes) else "\n"
+        lines = bulk_json.split(sep)
+
+        selected = []
+        for pos in positions:
+            selected.append(lines[2 * pos])
+            selected.append(lines[2 * pos + 1])
+
+        return sep.join(selected) + sep
+
+    def write_dead_letters(self, bulk_json):
+        """Append items that couldn't be inserted to the dead letter file. The file
+        is in bulk format, including the index in each action, so it can be
+        replayed later with `replay_dead_letters`.
+
+        :param bulk_json: str (or bytes) representation of the items not inserted
+        """
+        if isinstance(bulk_json, bytes):
+            bulk_json = bulk_json.decode('utf-8', 'replace')
+
+        lines = bulk_json.rstrip("\n").split("\n")
+        dead_letters = []
+        for action_json, doc_json in zip(lines[0::2], lines[1::2]):
+            action = json.loads(action_json)
+            for op in action:
+                action[op]['_index'] = self.index
+            dead_letters.append(json.dumps(action))
+            dead_letters.append(doc_json)
+
+        with DEAD_LETTER_LOCK:
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as fd:
+                fd.write("\n".join(dead_letters) + "\n")
+
+        logger.warning("{} items written to dead letter file {}".format(
+                       len(dead_letters) // 2, self.dead_letter_path))
+
+    def replay_dead_letters(self, dead_letter_path=None):
+        """Upload again the items stored in a dead letter file. Only the items
+        of the index set in the elastic obj are uploaded.
+
+        :param dead_letter_path: path of the dead letter file, by default `dead_letter_path`
+
+        :returns: number of items inserted
+        """
+        dead_letter_path = dead_letter_path if dead_letter_path else self.dead_letter_path
+        writer = self.get_bulk_writer()
+
+        with open(dead_letter_path, 'r', encoding='utf-8') as fd:
+            with writer:
+                for action_json in fd:
+                    doc_json = next(fd).rstrip("\n")
+                    action = json.loads(action_json)['index']
+                    if action.get('_index') != self.index:
+                        continue
+                    writer.add_json(action['_id'], doc_json)
+
+        logger.info("{} items replayed from {} to {}".format(
+                    writer.total, dead_letter_path, anonymize_url(self.index_url)))
+        return writer.total
+
+    def put_bulk_pack(self, url, bulk_json):
+        """Upload a bulk pack built by a BulkWriter.
+
+        :param url: target index where to bulk the items
+        :param bulk_json: bytes representation of the items to upload
+
+        :returns: a BulkResult with the number of items inserted, retried and dropped
+        """
+        return self.put_bulk(url, bulk_json)
+
+    def get_refresh_param(self):
+        """Get the refresh param to append to the bulk URL according
+        to the refresh policy. In bulk-load mode, the index is not refreshed"""
+
+        if self.bulk_load_settings is None and self.refresh_policy in [REFRESH_TRUE, REFRESH_WAIT_FOR]:
+            return '?refresh=' + self.refresh_policy
+
+        return ''
+
+    def refresh_index(self):
+        """Refresh the index, making the documents uploaded so far visible to searches"""
+
+        r = self.requests.post(self.index_url + "/_refresh", headers=HEADER_JSON, verify=False)
         try:
-            if failed_items:
-                raise ELKError(cause=error)
-        except ELKError:
-            pass
+            r.raise_for_status()
+        except requests.exceptions.HTTPError as ex:
+            logger.warning("Something went wrong when refreshing {}, {}".format(
+                           anonymize_url(self.index_url), ex))
+            return
+
+        logger.debug("Index {} refreshed".format(anonymize_url(self.index_url)))
+
+    def refresh_if_needed(self, end_of_run=False):
+        """Refresh the index when the documents uploaded may not be visible yet
+        according to the refresh policy.
 
-        logger.debug("{} items uploaded to ES ({})".format(inserted_items, anonymize_url(url)))
-        return inserted_items
+        :param end_of_run: if True, the index is refreshed only when the policy is
+            to refresh at the end of the run. Otherwise, it is refreshed when the
+            policy doesn't refresh on each bulk request, which is needed before
+            reading the documents just uploaded
+        """
+        if end_of_run:
+            needed = self.refresh_policy == REFRESH_END
+        else:
+            needed = self.refresh_policy in [REFRESH_NONE, REFRESH_END] or self.bulk_load_settings is not None
+
+        if needed:
+            self.refresh_index()
 
     def all_es_aliases(self):
         """List all aliases used in ES"""
@@ -233,14 +864,60 @@ class ElasticSearch(object):
         aliases = r.json()[self.index]['aliases']
         return aliases
 
+    def get_alias_indexes(self, alias):
+        """List the indexes linked to an alias. The result is shared by all
+        the objects of the same ES url during `alias_cache_ttl` seconds.
+
+        :param alias: target alias
+        :returns: list of index names, `None` if they can't be retrieved
+        """
+        cache_key = (self.url, alias)
+
+        with ALIAS_LOCK:
+            cached = ALIAS_CACHE.get(cache_key)
+        if cached and time.time() - cached[0] < self.alias_cache_ttl:
+            return cached[1]
+
+        r = self.requests.get(self.url + "/_alias/" + alias, headers=HEADER_JSON, verify=False)
+        if r.status_code == 404:
+            indexes = []
+        else:
+            try:
+                r.raise_for_status()
+            except requests.exceptions.HTTPError as ex:
+                logger.warning("Something went wrong when retrieving alias {} on {}, {}".format(
+                               alias, anonymize_url(self.url), ex))
+                return None
+
+            indexes = list(r.json().keys())
+
+        with ALIAS_LOCK:
+            ALIAS_CACHE[cache_key] = (time.time(), indexes)
+
+        return indexes
+
+    @staticmethod
+    def clear_alias_cache(url=None, alias=None):
+        """Forget the indexes of the aliases retrieved with `get_alias_indexes`
+
+        :param url: ES url of the aliases to forget, all of them by default
+        :param alias: alias to forget, all the ones of `url` by default
+        """
+        with ALIAS_LOCK:
+            for cache_key in list(ALIAS_CACHE):
+                if (not url or cache_key[0] == url) and (not alias or cache_key[1] == alias):
+                    del ALIAS_CACHE[cache_key]
+
     def alias_in_use(self, alias):
         """Check that an alias is already used in the ElasticSearch database
 
         :param alias: target alias
         :return: bool
         """
-        aliases = self.all_es_aliases()
-        return alias in aliases
+        if isinstance(alias, dict):
+            alias = alias['alias']
+
+        return bool(self.get_alias_indexes(alias))
 
     def add_alias(self, alias):
         """Add an alias to the index set in the elastic obj
@@ -281,6 +958,7 @@ class ElasticSearch(object):
                            anonymize_url(self.index_url), ex))
             return
 
+        self.clear_alias_cache(self.url, alias_dict['alias'])
         logger.info("Alias {} created on {}.".format(alias, anonymize_url(self.index_url)))
 
     def get_bulk_url(self):
@@ -305,45 +983,32 @@ class ElasticSearch(object):
 
         return mapping_url
 
+    def get_bulk_writer(self, url=None):
+        """Get a BulkWriter to upload items to the index in packs
+
+        :param url: bulk URL endpoint, by default the one of the index
+        """
+        return BulkWriter(self, url=url)
+
     def bulk_upload(self, items, field_id):
         """Upload in controlled packs items to ES using bulk API
 
         :param items: list of items to be uploaded
         :param field_id: unique ID attribute used to differentiate the items
         """
-        current = 0
-        new_items = 0  # total items added with bulk
-        bulk_json = ""
-
         if not items:
-            return new_items
-
-        url = self.get_bulk_url()
-
-        logger.debug("Adding items to {} (in {} packs)".format(anonymize_url(url), self.max_items_bulk))
-        task_init = time()
-
-        for item in items:
-            if current >= self.max_items_bulk:
-                task_init = time()
-                new_items += self.safe_put_bulk(url, bulk_json)
-                current = 0
-                json_size = sys.getsizeof(bulk_json) / (1024 * 1024)
-                logger.debug("bulk packet sent ({:.2f} sec, {} total, {:.2f} MB)".format(
-                             time() - task_init, new_items, json_size))
-                bulk_json = ""
-            data_json = json.dumps(item)
-            bulk_json += '{{"index" : {{"_id" : "{}" }} }}\n'.format(item[field_id])
-            bulk_json += data_json + "\n"  # Bulk document
-            current += 1
-
-        if current > 0:
-            new_items += self.safe_put_bulk(url, bulk_json)
-            json_size = sys.getsizeof(bulk_json) / (1024 * 1024)
-            logger.debug("bulk packet sent ({:.2f} sec prev, {} total, {:.2f} MB)".format(
-                         time() - task_init, new_items, json_size))
-
-        return new_items
+            return 0
+
+        writer = self.get_bulk_writer()
+
+        logger.debug("Adding items to {} (in packs of {} items, {:.2f} MB)".format(
+                     anonymize_url(writer.url), writer.max_items, writer.max_bytes / (1024 * 1024)))
+
+        with writer:
+            for item in items:
+                writer.add(item[field_id], item)
+
+        return writer.total
 
     def create_mappings(self, mappings):
         """Create the mappings for a given index. It includes the index
@@ -430,55 +1095,149 @@ class ElasticSearch(object):
         if filters_ is None:
             filters_ = []
 
+        found, last_value = self._get_prefetched_last_item(field, filters_, offset)
+        if found:
+            return last_value
+
         terms = []
         for filter_ in filters_:
             if not filter_:
                 continue
-            term = '''{"term" : { "%s" : "%s"}}''' % (filter_['name'], filter_['value'])
-            terms.append(term)
+            terms.append(esq.term(filter_['name'], filter_['value']))
 
-        data_query = '''"query": {"bool": {"filter": [%s]}},''' % (','.join(terms))
+        query = esq.search(query=esq.bool_(filter=terms), size=0, aggs={"1": esq.max_(field)})
 
-        data_agg = '''
-            "aggs": {
-                "1": {
-                  "max": {
-                    "field": "%s"
-                  }
-                }
-            }
-        ''' % field
+        data_json = json.dumps(query)
+        logger.debug("{} {}".format(anonymize_url(url), data_json))
 
-        data_json = '''
-        { "size": 0, %s  %s
-        } ''' % (data_query, data_agg)
+        res = self.requests.post(url, data=data_json, headers=HEADER_JSON)
+        res.raise_for_status()
+        res_json = res.json()
 
-        logger.debug("{} {}".format(anonymize_url(url), data_json))
+        if 'aggregations' in res_json:
+            last_value = self._parse_last_value(res_json["aggregations"]["1"], offset)
 
-        headers = {"Content-Type": "application/json"}
+        return last_value
+
+    def get_last_items_field(self, field, filter_name, values, filters_=None, offset=False):
+        """Find the offset/date of the last item stored in the index for each
+        value of a filter (e.g., the origins of several repositories). All the
+        values are resolved with a single `terms` aggregation.
+
+        :param field: field with the data
+        :param filter_name: field to filter the items, usually `origin` or `tag`
+        :param values: values of `filter_name` to find the last offset/date for
+        :param filters_: additional filters shared by all the values
+        :param offset: if True, returns the offset field instead of date field
+
+        :returns: dict with the last offset/date by value, `None` for values
+            without items
+        """
+        values = list(set(values))
+        last_values = {value: None for value in values}
+        if not values:
+            return last_values
+
+        url = self.index_url + "/_search"
+
+        terms = []
+        for filter_ in filters_ or []:
+            if not filter_:
+                continue
+            terms.append(esq.term(filter_['name'], filter_['value']))
+        terms.append(esq.terms(filter_name, values))
 
-        res = self.requests.post(url, data=data_json, headers=headers)
+        aggs = {"values": esq.terms_agg(filter_name, size=len(values), aggs={"1": esq.max_(field)})}
+        query = esq.search(query=esq.bool_(filter=terms), size=0, aggs=aggs)
+
+        logger.debug("{} last {} of {} values of {}".format(anonymize_url(url), field, len(values), filter_name))
+
+        res = self.requests.post(url, data=json.dumps(query), headers=HEADER_JSON)
         res.raise_for_status()
         res_json = res.json()
 
         if 'aggregations' in res_json:
-            last_value = res_json["aggregations"]["1"]["value"]
+            for bucket in res_json['aggregations']['values']['buckets']:
+                last_values[bucket['key']] = self._parse_last_value(bucket["1"], offset)
+
+        return last_values
+
+    def prefetch_last_items(self, field, filter_name, values, filters_=None, offset=False):
+        """Find with `get_last_items_field` the offset/date of the last item for
+        several values of a filter, and keep them to answer the next calls to
+        `get_last_item_field` filtering by one of these values, until the
+        round of updates ends and `clear_last_items_cache` is called.
+
+        :param field: field with the data
+        :param filter_name: field to filter the items, usually `origin` or `tag`
+        :param values: values of `filter_name` to find the last offset/date for
+        :param filters_: additional filters shared by all the values
+        :param offset: if True, returns the offset field instead of date field
+
+        :returns: dict with the last offset/date by value
+        """
+        last_values = self.get_last_items_field(field, filter_name, values, filters_=filters_, offset=offset)
+        cache_key = self._get_last_items_key(field, filter_name, filters_, offset)
+
+        with LAST_ITEMS_LOCK:
+            LAST_ITEMS_CACHE.setdefault(cache_key, {}).update(last_values)
+
+        return last_values
+
+    @staticmethod
+    def clear_last_items_cache():
+        """Forget the offsets/dates prefetched, e.g., when a new round of
+        updates starts"""
+
+        with LAST_ITEMS_LOCK:
+            LAST_ITEMS_CACHE.clear()
 
-            if offset:
-                if last_value is not None:
-                    last_value = int(last_value)
+    def _get_last_items_key(self, field, filter_name, filters_, offset):
+        other_filters = sorted(json.dumps(filter_, sort_keys=True) for filter_ in filters_ or [] if filter_)
+        return self.index_url, field, offset, filter_name, tuple(other_filters)
+
+    def _get_prefetched_last_item(self, field, filters_, offset):
+        """Look for the offset/date of the last item in the values prefetched.
+
+        :returns: tuple with a bool, True if the value was prefetched, and the value
+        """
+        if not LAST_ITEMS_CACHE:
+            return False, None
+
+        filters_ = [filter_ for filter_ in filters_ if filter_]
+        for filter_ in filters_:
+            others = [other for other in filters_ if other is not filter_]
+            cache_key = self._get_last_items_key(field, filter_['name'], others, offset)
+
+            with LAST_ITEMS_LOCK:
+                last_values = LAST_ITEMS_CACHE.get(cache_key, {})
+                if filter_['value'] in last_values:
+                    return True, last_values[filter_['value']]
+
+        return False, None
+
+    @staticmethod
+    def _parse_last_value(agg, offset):
+        """Convert the value of a max aggregation to an offset or a date"""
+
+        last_value = agg["value"]
+
+        if offset:
+            if last_value is not None:
+                last_value = int(last_value)
+        else:
+            if "value_as_string" in agg:
+                last_value = agg["value_as_string"]
+                last_value = str_to_datetime(last_value)
             else:
-                if "value_as_string" in res_json["aggregations"]["1"]:
-                    last_value = res_json["aggregations"]["1"]["value_as_string"]
-                    last_value = str_to_datetime(last_value)
-                else:
-                    last_value = res_json["aggregations"]["1"]["value"]
-                    if last_value:
-                        try:
-                            last_value = unixtime_to_datetime(last_value)
-                        except InvalidDateError:
-                            # last_value is in microsecs
-                            last_value = unixtime_to_datetime(last_value / 1000)
+                last_value = agg["value"]
+                if last_value:
+                    try:
+                        last_value = unixtime_to_datetime(last_value)
+                    except InvalidDateError:
+                        # last_value is in microsecs
+                        last_value = unixtime_to_datetime(last_value / 1000)
+
         return last_value
 
     def delete_items(self, retention_time, time_field="metadata__updated_on"):
@@ -22,13 +22,26 @@
 """Generates items from ElasticSearch based on filters """
 
 
+import collections
 import json
 import logging
+import os
+import queue
 import re
+import socket
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
+from grimoirelab_toolkit.datetime import str_to_datetime
+
+from . import codec
+from . import query as esq
 from .enriched.utils import get_repository_filter, grimoire_con, anonymize_url
 from .elastic_mapping import Mapping
+from .errors import ElasticError
+from .snapshot import RawSnapshot
 
 HEADER_JSON = {"Content-Type": "application/json"}
 MAX_BULK_UPDATE_SIZE = 1000
@@ -37,9 +50,340 @@ FILTER_DATA_ATTR = 'data.'
 FILTER_SEPARATOR = r",\s*%s" % FILTER_DATA_ATTR
 PROJECTS_JSON_LABELS_PATTERN = r".*(--labels=\[(.*)\]).*"
 
+SCROLL_READER = 'scroll'
+SEARCH_AFTER_READER = 'search_after'
+READERS = [SCROLL_READER, SEARCH_AFTER_READER]
+
+SCROLL_SLOTS_INDEX = 'grimoirelab_scroll_slots'
+SCROLL_SLOT_LEASE = 1200  # seconds, twice the keep alive of the scrolls
+MAX_SCROLL_WAIT_STEP = 60  # max seconds between retries when waiting for scrolls
+STREAM_CHUNK_SIZE = 64 * 1024  # bytes read at once from the streamed pages
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+SCROLL_BUDGETS = {}
+SCROLL_BUDGETS_LOCK = threading.Lock()
+
 logger = logging.getLogger(__name__)
 
 
+class PageSizer:
+    """Adapt the number of items per page to the size and latency of the
+    pages read.
+
+    The size shrinks as soon as a page is bigger than `max_bytes` or takes
+    longer than `max_time` seconds to be read. It grows, at most doubling
+    each time, only after full pages below both limits. The size is always
+    between `min_size` and `max_size`.
+
+    :param min_size: min number of items per page
+    :param max_size: max number of items per page
+    :param max_bytes: max size in bytes of a page
+    :param max_time: max seconds to read a page
+    """
+    def __init__(self, min_size, max_size, max_bytes, max_time):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.max_time = max_time
+
+    def next_size(self, size, num_items, num_bytes, seconds):
+        """Get the size of the next page.
+
+        :param size: number of items requested in the last page
+        :param num_items: number of items received in the last page
+        :param num_bytes: size in bytes of the last page
+        :param seconds: time to read the last page
+        """
+        target = size
+        if num_items:
+            limits = [self.max_size]
+            if num_bytes:
+                limits.append(self.max_bytes * num_items / num_bytes)
+            if seconds > 0:
+                limits.append(self.max_time * num_items / seconds)
+            target = min(limits)
+
+            if target > size:
+                # A page not full says nothing about bigger pages
+                target = min(target, 2 * size) if num_items >= size else size
+
+        return max(self.min_size, min(self.max_size, int(target)))
+
+
+class ClusterScrollSlots:
+    """Slots of scrolls shared by all the processes reading from a cluster.
+
+    Each slot is a document of `index` which is created to take the slot
+    and deleted to release it. The slots are leased for `lease` seconds and
+    renewed while the scroll is read, so the slots of crashed processes are
+    taken again once their lease expires, clearing first the scroll they
+    left open.
+
+    The slots documents are only updated or deleted when they are still the
+    ones written by this process, so a slot taken again by other process
+    is not overwritten nor deleted. Sequence numbers are used to check it
+    in ES 7 and later versions, and the internal versions of the documents
+    in previous ones.
+
+    :param requests: HTTP session to the cluster
+    :param url: URL of the cluster
+    :param max_scrolls: max number of scrolls open in the cluster
+    :param es_major: major version of the cluster, as string
+    :param lease: seconds a slot is kept without being renewed
+    :param index: index of the slots documents
+    """
+    def __init__(self, requests, url, max_scrolls, es_major, lease=SCROLL_SLOT_LEASE, index=SCROLL_SLOTS_INDEX):
+        self.requests = requests
+        self.url = url
+        self.max_scrolls = max_scrolls
+        self.lease = lease
+        self.index_url = url + "/" + index
+        self.owner = "{}:{}".format(socket.gethostname(), os.getpid())
+        self.seq_no = int(es_major) >= 7
+        self._written = {}
+
+    def take(self, timeout=None):
+        """Take a free slot, waiting up to `timeout` seconds.
+
+        :returns: the id of the slot or None if no slot was free in time
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        wait = 1
+        while True:
+            for slot_id in range(self.max_scrolls):
+                if self._create(slot_id) or self._reclaim(slot_id):
+                    return slot_id
+
+            if deadline is not None and time.time() + wait > deadline:
+                return None
+
+            logger.debug("No scroll slots free in {}, waiting {} seconds".format(anonymize_url(self.url), wait))
+            time.sleep(wait)
+            wait = min(2 * wait, MAX_SCROLL_WAIT_STEP)
+
+    def renew(self, slot_id, scroll_id=None):
+        """Extend the lease of a slot, keeping the scroll read with it.
+
+        :raises ElasticError: if the slot was taken by other process
+        """
+        if not self._write(slot_id, self._condition(self._written[slot_id]), scroll_id):
+            msg = "Scroll slot {} of {} taken by other process".format(slot_id, anonymize_url(self.url))
+            logger.error(msg)
+            raise ElasticError(cause=msg)
+
+    def release(self, slot_id):
+        """Release a slot, unless it was taken by other process"""
+
+        written = self._written.pop(slot_id, None)
+        if written is None:
+            return
+
+        res = self.requests.delete(self._slot_url(slot_id) + "?" + self._condition(written))
+        if res.status_code == 409:
+            logger.debug("Scroll slot {} taken by other process, not released".format(slot_id))
+            return
+        if res.status_code != 404:
+            res.raise_for_status()
+
+    def _create(self, slot_id):
+        return self._write(slot_id, "op_type=create")
+
+    def _write(self, slot_id, params, scroll_id=None):
+        """Write the document of a slot owned by this process, if `params`
+        conditions are met. The response is kept to write it again."""
+
+        res = self.requests.put(self._slot_url(slot_id) + "?" + params, data=json.dumps(self._slot_doc(scroll_id)),
+                                headers=HEADER_JSON)
+        if res.status_code == 409:
+            return False
+        res.raise_for_status()
+
+        self._written[slot_id] = res.json()
+        return True
+
+    def _condition(self, doc):
+        """Params to write a slot only if it is still the given document"""
+
+        if self.seq_no:
+            return "if_seq_no={}&if_primary_term={}".format(doc['_seq_no'], doc['_primary_term'])
+        return "version={}".format(doc['_version'])
+
+    def _reclaim(self, slot_id):
+        """Take a slot whose lease expired, clearing its scroll"""
+
+        res = self.requests.get(self._slot_url(slot_id))
+        if res.status_code == 404:
+            return self._create(slot_id)
+        res.raise_for_status()
+
+        doc = res.json()
+        if doc['_source']['expires'] > time.time():
+            return False
+
+        logger.debug("Scroll slot {} of {} expired".format(slot_id, doc['_source']['owner']))
+        scroll_id = doc['_source'].get('scroll_id')
+        if scroll_id:
+            self.requests.delete(self.url + "/_search/scroll", data=json.dumps({"scroll_id": scroll_id}),
+                                 headers=HEADER_JSON)
+
+        # Only one process can replace the expired document
+        return self._write(slot_id, self._condition(doc))
+
+    def _slot_url(self, slot_id):
+        return self.index_url + "/_doc/slot-{}".format(slot_id)
+
+    def _slot_doc(self, scroll_id=None):
+        return {"owner": self.owner, "expires": time.time() + self.lease, "scroll_id": scroll_id}
+
+
+class ScrollBudget:
+    """Limit the number of scrolls open at the same time by the process
+    and, optionally, by all the processes reading from the cluster.
+
+    The readers waiting for a scroll get it in order of arrival.
+
+    :param max_scrolls: max number of scrolls open by the process, None for no limit
+    :param cluster_slots: `ClusterScrollSlots` shared with other processes, if any
+    """
+    def __init__(self, max_scrolls=None, cluster_slots=None):
+        self.max_scrolls = max_scrolls
+        self.cluster_slots = cluster_slots
+        self.open = 0
+
+        self._cond = threading.Condition()
+        self._waiters = collections.deque()
+
+    def acquire(self, timeout=None):
+        """Wait for a scroll, up to `timeout` seconds.
+
+        :returns: a `ScrollSlot` to be released once the scroll is freed,
+            None if no scroll was available in time
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        waiter = object()
+
+        with self._cond:
+            self._waiters.append(waiter)
+            try:
+                while self._waiters[0] is not waiter or (self.max_scrolls and self.open >= self.max_scrolls):
+                    remaining = deadline - time.time() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        return None
+                    self._cond.wait(remaining)
+                self.open += 1
+            finally:
+                self._waiters.remove(waiter)
+                self._cond.notify_all()
+
+        slot_id = None
+        if self.cluster_slots:
+            try:
+                remaining = max(deadline - time.time(), 0) if deadline is not None else None
+                slot_id = self.cluster_slots.take(remaining)
+            except Exception:
+                self._release()
+                raise
+            if slot_id is None:
+                self._release()
+                return None
+
+        return ScrollSlot(self, slot_id)
+
+    def _release(self):
+        with self._cond:
+            self.open -= 1
+            self._cond.notify_all()
+
+
+class ScrollSlot:
+    """Scroll acquired from a `ScrollBudget`"""
+
+    def __init__(self, budget, slot_id=None):
+        self.budget = budget
+        self.slot_id = slot_id
+        self.renewed = time.time()
+        self.released = False
+
+    def renew(self, scroll_id=None):
+        """Extend the lease of the cluster slot, if it is half expired"""
+
+        cluster_slots = self.budget.cluster_slots
+        if self.slot_id is None or time.time() - self.renewed < cluster_slots.lease / 2:
+            return
+
+        cluster_slots.renew(self.slot_id, scroll_id)
+        self.renewed = time.time()
+
+    def release(self):
+        """Release the scroll, it can be called several times"""
+
+        if self.released:
+            return
+        self.released = True
+
+        try:
+            if self.slot_id is not None:
+                self.budget.cluster_slots.release(self.slot_id)
+        except Exception:
+            logger.debug("Error releasing scroll slot {}".format(self.slot_id))
+        finally:
+            self.budget._release()
+
+
+def read_in_background(readers, max_pages):
+    """Consume page generators in background threads, one per generator,
+    and yield their pages as they are received.
+
+    At most `max_pages` pages are kept waiting to be yielded, so the readers
+    stop until they are consumed. When the returned generator is closed,
+    the readers are closed too, releasing their resources (e.g., scrolls).
+    Errors raised by a reader are raised again by the generator.
+
+    :param readers: list of generators of pages
+    :param max_pages: max number of pages read in advance
+    """
+    pages = queue.Queue(maxsize=max_pages)
+    stop = threading.Event()
+
+    def put(page):
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read(reader):
+        try:
+            for page in reader:
+                if not put(page):
+                    break
+        except Exception as ex:
+            put(ex)
+        finally:
+            reader.close()
+            put(None)
+
+    executor = ThreadPoolExecutor(max_workers=len(readers))
+    try:
+        for reader in readers:
+            executor.submit(read, reader)
+
+        done = 0
+        while done < len(readers):
+            page = pages.get()
+            if page is None:
+                done += 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield page
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
+
+
 class ElasticItems:
 
     mapping = Mapping
@@ -48,6 +392,33 @@ class ElasticItems:
     # Change it from p2o command line or mordred config
     scroll_size = 100
     scroll_wait = 900
+    # Max number of scrolls open at the same time by the process and by all
+    # the processes sharing the scroll slots of the cluster, None for no limit
+    max_scrolls = None
+    max_cluster_scrolls = None
+    # Adapt the scroll size to the size and latency of the pages read,
+    # between scroll_size_min and scroll_size_max
+    adaptive_scroll_size = False
+    scroll_size_min = 10
+    scroll_size_max = 1000
+    page_max_bytes = 10 * 1024 * 1024
+    page_max_time = 5
+    # Read the items with scroll contexts or paging with search_after,
+    # which doesn't keep contexts open between pages
+    reader = SCROLL_READER
+    # Number of slices of the index read concurrently
+    scroll_slices = 1
+    # Number of pages read in background while the previous ones are processed
+    prefetch_pages = 0
+    # Decode the hits of the scroll pages one by one while they are received,
+    # so the pages are never kept whole in memory. The pages read in
+    # background (i.e., slices and prefetched pages) are not streamed.
+    stream_pages = False
+    # Path of the local snapshot of the raw items written when they are
+    # collected, and whether the raw items are read from it instead of the index
+    raw_snapshot = None
+    read_raw_snapshot = False
+    pit_keep_alive = "10m"
 
     def __init__(self, perceval_backend, from_date=None, insecure=True, offset=None):
         """Class to perform operations over the items stored in a ES index.
@@ -70,6 +441,8 @@ class ElasticItems:
         self.elastic = None
         self.elastic_url = None
         self.cfg_section_name = None
+        self.search_after_position = None  # sort values of the last item read with search_after
+        self.source_fields = None  # `_source` filter of the items read (e.g., {"excludes": ["data.files"]})
 
     def get_repository_filter_raw(self, term=False):
         """Returns the filter to be used in queries in a repository items"""
@@ -83,6 +456,11 @@ class ElasticItems:
 
         return "metadata__updated_on"
 
+    def get_field_unique_id(self):
+        """Field with the unique id of the JSON items"""
+
+        return "uuid"
+
     def get_incremental_date(self):
         """Field with the date used for incremental analysis."""
 
@@ -168,6 +546,40 @@ class ElasticItems:
         """
         self.cfg_section_name = cfg_section_name
 
+    def get_page_sizer(self):
+        """Get the `PageSizer` of the scans of the indexes, None if the
+        scroll size is not adaptive"""
+
+        if not self.adaptive_scroll_size:
+            return None
+
+        return PageSizer(self.scroll_size_min, self.scroll_size_max, self.page_max_bytes, self.page_max_time)
+
+    def update_scroll_size(self, size, res, num_items):
+        """Adapt the scroll size to the last page read, if `adaptive_scroll_size`
+
+        :param size: number of items requested
+        :param res: response with the page
+        :param num_items: number of items in the page
+        """
+        page_sizer = self.get_page_sizer()
+        if not page_sizer:
+            return
+
+        scroll_size = page_sizer.next_size(size, num_items, len(res.content), res.elapsed.total_seconds())
+        if scroll_size != self.scroll_size:
+            logger.debug("Scroll size of {} changed from {} to {}".format(
+                         anonymize_url(self.elastic.index_url), self.scroll_size, scroll_size))
+            self.scroll_size = scroll_size
+
+    def set_source_fields(self, source_fields):
+        """Set the fields read from the index
+
+        :param source_fields: `_source` filter of the items read (e.g., {"includes": ["data.commit"]}),
+            if None the whole items are read
+        """
+        self.source_fields = source_fields
+
     def set_from_date(self, last_enrich_date):
         """Set the from date
 
@@ -188,75 +600,499 @@ class ElasticItems:
         try:
             res = self.requests.delete(url, data=query_data, headers=headers)
             res.raise_for_status()
-        except Exception:
+        except Exception as ex:
             logger.debug("Error releasing scroll: {}/{}".format(anonymize_url(url), scroll_id))
-            logger.debug("Error releasing scroll: {}".format(res.json()))
+            logger.debug("Error releasing scroll: {}".format(ex))
 
     # Items generator
-    def fetch(self, _filter=None, ignore_incremental=False):
+    def fetch(self, _filter=None, ignore_incremental=False, _source=None):
         """Fetch the items from raw or enriched index. An optional _filter can be
         provided to filter the data collected
 
         :param _filter: optional filter of data collected
         :param ignore_incremental: if True, incremental collection is ignored
+        :param _source: optional `_source` filter of the fields read, by default `source_fields`
         """
 
         logger.debug("Creating a elastic items generator.")
 
+        if self.read_raw_snapshot and self.raw_snapshot:
+            pages = self.fetch_snapshot_pages(_filter=_filter, ignore_incremental=ignore_incremental)
+        elif self.scroll_slices > 1:
+            pages = self.fetch_slices(_filter=_filter, ignore_incremental=ignore_incremental, _source=_source)
+        elif self.reader == SEARCH_AFTER_READER:
+            pages = self.fetch_search_after_pages(_filter=_filter, ignore_incremental=ignore_incremental,
+                                                  _source=_source)
+        elif self.prefetch_pages > 0:
+            pages = self.fetch_scroll_pages(_filter=_filter, ignore_incremental=ignore_incremental, _source=_source)
+        else:
+            pages = self.fetch_scroll_pages(_filter=_filter, ignore_incremental=ignore_incremental, _source=_source,
+                                            stream=self.stream_pages)
+
+        # The slices are already read in background
+        if self.prefetch_pages > 0 and self.scroll_slices <= 1:
+            pages = read_in_background([pages], self.prefetch_pages)
+
+        # Release the scrolls and stop the threads as soon as the generator is closed
+        try:
+            for page in pages:
+                yield from page
+        finally:
+            pages.close()
+
+    def fetch_resumable(self, _filter=None, ignore_incremental=False, search_after=None):
+        """Fetch the items from raw or enriched index in a stable order, so
+        the reading can be resumed after any of them using its position
+        (see `get_item_position`).
+
+        The items are read paging with `search_after`, or from the local
+        snapshot when it is read, whatever the reader configured.
+
+        :param _filter: optional filter of data collected
+        :param ignore_incremental: if True, incremental collection is ignored
+        :param search_after: position of the item after which the items are read
+        """
+        if self.read_raw_snapshot and self.raw_snapshot:
+            pages = self.fetch_snapshot_pages(_filter=_filter, ignore_incremental=ignore_incremental,
+                                              after=search_after[-1] if search_after else None)
+        else:
+            pages = self.fetch_search_after_pages(_filter=_filter, ignore_incremental=ignore_incremental,
+                                                  search_after=search_after)
+
+        if self.prefetch_pages > 0:
+            pages = read_in_background([pages], self.prefetch_pages)
+
+        try:
+            for page in pages:
+                yield from page
+        finally:
+            pages.close()
+
+    def get_item_position(self, item):
+        """Get the position of an item, the sort values of the item as they
+        are used by `search_after`. The dates are sorted as epoch milliseconds.
+
+        :param item: item read from the index
+        :returns: list of sort values or None if the item lacks any of them
+        """
+        position = []
+        for sort in self.get_search_after_sort():
+            field = next(iter(sort))
+            value = item.get(field)
+            if value is None:
+                return None
+            if field == self.get_order_field() and isinstance(value, str):
+                value = (str_to_datetime(value) - EPOCH) // timedelta(milliseconds=1)
+            position.append(value)
+
+        return position
+
+    def fetch_snapshot_pages(self, _filter=None, ignore_incremental=False, after=None):
+        """Fetch the pages of raw items from the local snapshot `raw_snapshot`,
+        with the same filters used to read the index. The whole items are
+        read, the `_source` filters are not applied.
+
+        :param _filter: optional filter of data collected
+        :param ignore_incremental: if True, incremental collection is ignored
+        :param after: if not None, uuid of the item after which the items are read
+        """
+        terms = []
+
+        repository_filter = self.get_repository_filter_raw()
+        if repository_filter:
+            terms.append((repository_filter['name'], [repository_filter['value']]))
+
+        if self.filter_raw:
+            for fltr in self.filter_raw_dict:
+                terms.append((fltr['name'], [fltr['value']]))
+
+        if _filter:
+            terms.append((_filter['name'], _filter['value']))
+
+        from_date = None
+        offset = None
+        if self.from_date and not ignore_incremental:
+            from_date = self.from_date
+        elif self.offset and not ignore_incremental:
+            offset = self.offset
+
+        logger.debug("Fetching from snapshot {}".format(self.raw_snapshot))
+
+        snapshot = RawSnapshot(self.raw_snapshot)
+        yield from snapshot.read_pages(terms, from_date=from_date, offset=offset, page_size=self.scroll_size,
+                                       after=after)
+
+    def fetch_scroll_pages(self, _filter=None, ignore_incremental=False, _slice=None, _source=None, stream=False):
+        """Fetch the pages of items from raw or enriched index with a scroll context.
+
+        The scroll is taken from the scroll budget, if any, and it is freed
+        when the generator is closed or fails.
+
+        :param _filter: optional filter of data collected
+        :param ignore_incremental: if True, incremental collection is ignored
+        :param _slice: optional slice of the scroll to read (e.g., {"id": 0, "max": 2})
+        :param _source: optional `_source` filter of the fields read, by default `source_fields`
+        :param stream: if True, the pages are generators of the items decoded
+            while the page is received. Each page must be read before the next one.
+        """
+        scroll_slot = None
+        budget = self.get_scroll_budget()
+        if budget:
+            scroll_slot = budget.acquire(timeout=self.scroll_wait)
+            if not scroll_slot:
+                msg = "No scroll available for {} after {} seconds".format(
+                    anonymize_url(self.elastic.index_url), self.scroll_wait)
+                logger.error(msg)
+                raise ElasticError(cause=msg)
+
+        def too_many_scrolls(page):
+            return isinstance(page, dict) and 'too_many_scrolls' in page
+
         scroll_id = None
-        page = self.get_elastic_items(scroll_id, _filter=_filter, ignore_incremental=ignore_incremental)
-        if page and 'too_many_scrolls' in page:
-            sec = self.scroll_wait
-            while sec > 0:
-                logger.debug("Too many scrolls open, waiting up to {} seconds".format(sec))
-                time.sleep(1)
-                sec -= 1
-                page = self.get_elastic_items(scroll_id, _filter=_filter, ignore_incremental=ignore_incremental)
+        page = None
+        try:
+            page = self.get_elastic_items(scroll_id, _filter=_filter, ignore_incremental=ignore_incremental,
+                                          _slice=_slice, _source=_source, stream=stream)
+            waited = 0
+            wait = 1
+            while too_many_scrolls(page):
+                # Scrolls opened by other processes, wait for them with a growing delay
+                if waited >= self.scroll_wait:
+                    msg = "Too many scrolls open in {} after {} seconds".format(
+                        anonymize_url(self.elastic.url), waited)
+                    logger.error(msg)
+                    raise ElasticError(cause=msg)
+                wait = min(wait, self.scroll_wait - waited)
+                logger.debug("Too many scrolls open, waiting {} seconds".format(wait))
+                time.sleep(wait)
+                waited += wait
+                wait = min(2 * wait, MAX_SCROLL_WAIT_STEP)
+
+                page = self.get_elastic_items(scroll_id, _filter=_filter, ignore_incremental=ignore_incremental,
+                                              _slice=_slice, _source=_source, stream=stream)
+                if page and not too_many_scrolls(page):
+                    logger.debug("Scroll acquired after {} seconds".format(waited))
+
+            if not page:
+                return
+
+            meta = page.meta if stream else page
+            scroll_id = meta["_scroll_id"]
+            total = meta['hits']['total']
+            scroll_size = total['value'] if isinstance(total, dict) else total
+
+            if scroll_size == 0:
+                logger.debug("No results found from {} and filter {}".format(
+                             anonymize_url(self.elastic.index_url), _filter))
+                return
+
+            while scroll_size > 0:
+
+                if stream:
+                    hits = page.hits()
+                    yield (item['_source'] for item in hits)
+                    # The end of the page must be read before asking for the next one
+                    for _ in hits:
+                        pass
+                    logger.debug("Fetching from {}: {} received".format(
+                                 anonymize_url(self.elastic.index_url), page.num_hits))
+                    if page.num_hits == 0:
+                        break
+                else:
+                    logger.debug("Fetching from {}: {} received".format(
+                                 anonymize_url(self.elastic.index_url), len(page['hits']['hits'])))
+                    yield [item['_source'] for item in page['hits']['hits']]
+
+                if scroll_slot:
+                    scroll_slot.renew(scroll_id)
+                page = self.get_elastic_items(scroll_id, _filter=_filter, ignore_incremental=ignore_incremental,
+                                              stream=stream)
+
                 if not page:
-                    logger.debug("Waiting for scroll terminated")
                     break
-                if 'too_many_scrolls' not in page:
-                    logger.debug("Scroll acquired after {} seconds".format(self.scroll_wait - sec))
-                    break
-
-        if not page:
-            return []
 
-        scroll_id = page["_scroll_id"]
-        total = page['hits']['total']
-        scroll_size = total['value'] if isinstance(total, dict) else total
+                if not stream:
+                    scroll_size = len(page['hits']['hits'])
 
-        if scroll_size == 0:
-            logger.debug("No results found from {} and filter {}".format(
-                         anonymize_url(self.elastic.index_url), _filter))
+            logger.debug("Fetching from {}: done receiving".format(anonymize_url(self.elastic.index_url)))
+        finally:
+            if stream and page and not too_many_scrolls(page):
+                page.close()
             self.free_scroll(scroll_id)
+            if scroll_slot:
+                scroll_slot.release()
+
+    def get_scroll_budget(self):
+        """Get the scroll budget of the process for the cluster, None if
+        the number of scrolls is not limited"""
+
+        if not self.elastic or not (self.max_scrolls or self.max_cluster_scrolls):
+            return None
+
+        key = (self.elastic.url, self.max_scrolls, self.max_cluster_scrolls)
+        with SCROLL_BUDGETS_LOCK:
+            if key not in SCROLL_BUDGETS:
+                cluster_slots = None
+                if self.max_cluster_scrolls:
+                    cluster_slots = ClusterScrollSlots(self.requests, self.elastic.url, self.max_cluster_scrolls,
+                                                       self.elastic.major)
+                SCROLL_BUDGETS[key] = ScrollBudget(self.max_scrolls, cluster_slots)
+
+            return SCROLL_BUDGETS[key]
+
+    def fetch_slices(self, _filter=None, ignore_incremental=False, _source=None):
+        """Fetch the pages of items from raw or enriched index reading
+        `scroll_slices` slices concurrently.
+
+        Each slice is read by its own thread with the same filters, and the
+        pages are merged as they are received, so the items are not sorted
+        across slices. At most two pages per slice are kept in memory
+        waiting to be consumed.
+
+        As the items are not sorted, the date of the last item read is not
+        a safe point to resume a reading stopped half way. The incremental
+        enrichments can't use slices (see `--scroll-slices`).
+
+        :param _filter: optional filter of data collected
+        :param ignore_incremental: if True, incremental collection is ignored
+        :param _source: optional `_source` filter of the fields read, by default `source_fields`
+        """
+        if not self.elastic:
             return
 
-        while scroll_size > 0:
+        slices = self.scroll_slices
+        readers = []
+        for slice_id in range(slices):
+            _slice = {"id": slice_id, "max": slices}
+            if self.reader == SEARCH_AFTER_READER:
+                readers.append(self.fetch_search_after_pages(_filter=_filter, ignore_incremental=ignore_incremental,
+                                                             _slice=_slice, _source=_source))
+            else:
+                readers.append(self.fetch_scroll_pages(_filter=_filter, ignore_incremental=ignore_incremental,
+                                                       _slice=_slice, _source=_source))
 
-            logger.debug("Fetching from {}: {} received".format(
-                         anonymize_url(self.elastic.index_url), len(page['hits']['hits'])))
-            for item in page['hits']['hits']:
-                eitem = item['_source']
-                yield eitem
+        logger.debug("Fetching from {} in {} slices".format(anonymize_url(self.elastic.index_url), slices))
 
-            page = self.get_elastic_items(scroll_id, _filter=_filter, ignore_incremental=ignore_incremental)
+        yield from read_in_background(readers, 2 * slices)
 
-            if not page:
-                break
+    def fetch_search_after(self, _filter=None, ignore_incremental=False, search_after=None):
+        """Fetch the items from raw or enriched index paging with `search_after`.
+
+        The items are sorted by the order field and the unique id field, so
+        the sort values of the last item read (`search_after_position`) are
+        enough to continue reading from it. When the cluster supports it, the
+        pages are read from a point in time of the index.
+
+        :param _filter: optional filter of data collected
+        :param ignore_incremental: if True, incremental collection is ignored
+        :param search_after: sort values of the item after which the items are read
+        """
+        for page in self.fetch_search_after_pages(_filter=_filter, ignore_incremental=ignore_incremental,
+                                                  search_after=search_after):
+            yield from page
+
+    def fetch_search_after_pages(self, _filter=None, ignore_incremental=False, search_after=None, _slice=None,
+                                 _source=None):
+        """Fetch the pages of items from raw or enriched index paging with `search_after`.
+
+        Slices can only be read from a point in time. When it can't be opened,
+        the first slice reads all the items and the rest of slices are empty.
+
+        :param _filter: optional filter of data collected
+        :param ignore_incremental: if True, incremental collection is ignored
+        :param search_after: sort values of the item after which the items are read
+        :param _slice: optional slice of the point in time to read (e.g., {"id": 0, "max": 2})
+        :param _source: optional `_source` filter of the fields read, by default `source_fields`
+        """
+        if not self.elastic:
+            return
+
+        query = self.get_elastic_query(_filter=_filter, ignore_incremental=ignore_incremental, _source=_source)
+        query['sort'] = self.get_search_after_sort()
+
+        pit_id = self.open_point_in_time()
+        if _slice and pit_id:
+            query['slice'] = _slice
+        elif _slice and _slice['id'] > 0:
+            return
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Raw query to {}\n{}".format(anonymize_url(self.elastic.index_url),
+                         json.dumps(query, indent=4)))
+
+        # The position of the sliced reads can't be used to resume them
+        position = search_after
+        if not _slice:
+            self.search_after_position = position
+        try:
+            while True:
+                # The size of each page can change with `adaptive_scroll_size`
+                size = self.scroll_size
+                query['size'] = size
+                page = self.get_search_after_page(query, pit_id, position)
+                if not page:
+                    break
+
+                pit_id = page.get('pit_id', pit_id)
+                hits = page['hits']['hits']
+                if not hits:
+                    break
+
+                logger.debug("Fetching from {}: {} received".format(
+                             anonymize_url(self.elastic.index_url), len(hits)))
+                position = hits[-1]['sort']
+                if not _slice:
+                    self.search_after_position = position
+                yield [item['_source'] for item in hits]
 
-            scroll_size = len(page['hits']['hits'])
+                if len(hits) < size:
+                    break
+        finally:
+            self.close_point_in_time(pit_id)
 
-        self.free_scroll(scroll_id)
         logger.debug("Fetching from {}: done receiving".format(anonymize_url(self.elastic.index_url)))
 
-    def get_elastic_items(self, elastic_scroll_id=None, _filter=None, ignore_incremental=False):
+    def get_search_after_sort(self):
+        """Get the sort of the items read with `search_after`. The unique id
+        field breaks the ties of the order field, so the sort is stable."""
+
+        sort = []
+        order_field = self.get_order_field()
+        if order_field is not None:
+            sort.append(esq.sort(order_field))
+        sort.append(esq.sort(self.get_field_unique_id(), unmapped_type="keyword"))
+
+        return sort
+
+    def get_search_after_page(self, query, pit_id=None, search_after=None):
+        """Get a page of items with `search_after`
+
+        :param query: dict with the query, sort and size of the page
+        :param pit_id: if not None, id of the point in time to search
+        :param search_after: sort values of the item after which the page starts
+        """
+        query = dict(query)
+        if pit_id:
+            # The index is given by the point in time
+            url = self.elastic.url + "/_search"
+            query['pit'] = {"id": pit_id, "keep_alive": self.pit_keep_alive}
+        else:
+            url = self.elastic.index_url + "/_search"
+        if search_after:
+            query['search_after'] = search_after
+
+        res = self.requests.post(url, data=json.dumps(query), headers=HEADER_JSON)
+        if res.status_code == 404 and 'index_not_found_exception' in res.text:
+            # The index could not exists yet
+            logger.debug("No results found from {}".format(anonymize_url(url)))
+            return None
+        res.raise_for_status()
+
+        rjson = codec.loads(res.content)
+        self.update_scroll_size(query['size'], res, len(rjson['hits']['hits']))
+
+        return rjson
+
+    def open_point_in_time(self):
+        """Open a point in time of the index, available since ES 7.10.
+
+        :returns: the id of the point in time or None if it can't be opened
+        """
+        if not self.elastic.major.isdigit() or int(self.elastic.major) < 7:
+            return None
+
+        url = self.elastic.index_url + "/_pit?keep_alive=" + self.pit_keep_alive
+        try:
+            res = self.requests.post(url)
+            res.raise_for_status()
+        except Exception:
+            logger.debug("Point in time not available for {}".format(anonymize_url(self.elastic.index_url)))
+            return None
+
+        return res.json()['id']
+
+    def close_point_in_time(self, pit_id=None):
+        """Close a point in time after use"""
+
+        if not pit_id:
+            return
+
+        url = self.elastic.url + "/_pit"
+        try:
+            res = self.requests.delete(url, data=json.dumps({"id": pit_id}), headers=HEADER_JSON)
+            res.raise_for_status()
+        except Exception:
+            logger.debug("Error closing point in time: {}".format(anonymize_url(url)))
+
+    def get_query_filters(self, _filter=None, ignore_incremental=False):
+        """Get the list of filters applied to the items read from the index
+
+        :param _filter: if not None, it allows to define a terms filter (e.g., "uuid": ["hash1", "hash2, ...]
+        :param ignore_incremental: if True, incremental collection is ignored
+        """
+        filters = []
+
+        # If using a perceval backends always filter by repository
+        # to support multi repository indexes
+        repository_filter = self.get_repository_filter_raw(term=True)
+        if repository_filter:
+            filters.append(repository_filter)
+
+        if self.filter_raw:
+            for fltr in self.filter_raw_dict:
+                filters.append(esq.term(fltr['name'], fltr['value']))
+
+        if _filter:
+            filters.append(esq.terms(_filter['name'], _filter['value']))
+
+        # The code below performs the incremental enrichment based on the last value of `metadata__timestamp`
+        # in the enriched index, which is calculated in the TaskEnrich before enriching the single repos that
+        # belong to a given data source. The old implementation of the incremental enrichment, which consisted in
+        # collecting the last value of `metadata__timestamp` in the enriched index for each repo, didn't work
+        # for global data source (which are collected globally and only partially enriched).
+        if self.from_date and not ignore_incremental:
+            filters.append(esq.range_(self.get_incremental_date(), gte=self.from_date.isoformat()))
+        elif self.offset and not ignore_incremental:
+            filters.append(esq.range_("offset", gte=int(self.offset)))
+
+        return filters
+
+    def get_order_field(self):
+        """Field used to order the items read from the index, if any.
+
+        Order the raw items from the old ones to the new so if the
+        enrich process fails, it could be resume incrementally.
+        """
+        return self.get_incremental_date() if self.perceval_backend else None
+
+    def get_elastic_query(self, _filter=None, ignore_incremental=False, _source=None):
+        """Get the query, as a dict, to read the items from the index
+
+        :param _filter: if not None, it allows to define a terms filter (e.g., "uuid": ["hash1", "hash2, ...]
+        :param ignore_incremental: if True, incremental collection is ignored
+        :param _source: if not None, `_source` filter of the fields read, by default `source_fields`
+        """
+        filters = self.get_query_filters(_filter=_filter, ignore_incremental=ignore_incremental)
+
+        order_field = self.get_order_field()
+        sort = [esq.sort(order_field)] if order_field is not None else None
+
+        _source = _source if _source is not None else self.source_fields
+
+        return esq.search(query=esq.bool_(filter=filters), sort=sort, source=_source)
+
+    def get_elastic_items(self, elastic_scroll_id=None, _filter=None, ignore_incremental=False, _slice=None,
+                          _source=None, stream=False):
         """Get the items from the index related to the backend applying and
         optional _filter if provided
 
         :param elastic_scroll_id: If not None, it allows to continue scrolling the data
         :param _filter: if not None, it allows to define a terms filter (e.g., "uuid": ["hash1", "hash2, ...]
         :param ignore_incremental: if True, incremental collection is ignored
+        :param _slice: if not None, slice of the scroll to read (e.g., {"id": 0, "max": 2})
+        :param _source: if not None, `_source` filter of the fields read, by default `source_fields`
+        :param stream: if True, a `codec.PageDecoder` reading the page while its hits
+            are decoded is returned instead of the decoded page
         """
         headers = {"Content-Type": "application/json"}
 
@@ -267,8 +1103,9 @@ class ElasticItems:
         # In gerrit enrich with 500 items per page we need >1 min
         # In Mozilla ES in Amazon we need 10m
         max_process_items_pack_time = "10m"  # 10 minutes
-        url += "/_search?scroll=%s&size=%i" % (max_process_items_pack_time,
-                                               self.scroll_size)
+        # The size of the pages is set when the scroll is created
+        size = self.scroll_size
+        url += "/_search?scroll=%s&size=%i" % (max_process_items_pack_time, size)
 
         if elastic_scroll_id:
             """ Just continue with the scrolling """
@@ -280,78 +1117,16 @@ class ElasticItems:
             }
             query_data = json.dumps(scroll_data)
         else:
-            # If using a perceval backends always filter by repository
-            # to support multi repository indexes
-            filters_dict = self.get_repository_filter_raw(term=True)
-            if filters_dict:
-                filters = json.dumps(filters_dict)
-            else:
-                filters = ''
-
-            if self.filter_raw:
-                for fltr in self.filter_raw_dict:
-                    filters += '''
-                        , {"term":
-                            { "%s":"%s"  }
-                        }
-                    ''' % (fltr['name'], fltr['value'])
-
-            if _filter:
-                filter_str = '''
-                    , {"terms":
-                        { "%s": %s }
-                    }
-                ''' % (_filter['name'], _filter['value'])
-                # List to string conversion uses ' that are not allowed in JSON
-                filter_str = filter_str.replace("'", "\"")
-                filters += filter_str
-
-            # The code below performs the incremental enrichment based on the last value of `metadata__timestamp`
-            # in the enriched index, which is calculated in the TaskEnrich before enriching the single repos that
-            # belong to a given data source. The old implementation of the incremental enrichment, which consisted in
-            # collecting the last value of `metadata__timestamp` in the enriched index for each repo, didn't work
-            # for global data source (which are collected globally and only partially enriched).
-            if self.from_date and not ignore_incremental:
-                date_field = self.get_incremental_date()
-                from_date = self.from_date.isoformat()
-
-                filters += '''
-                    , {"range":
-                        {"%s": {"gte": "%s"}}
-                    }
-                ''' % (date_field, from_date)
-            elif self.offset and not ignore_incremental:
-                filters += '''
-                    , {"range":
-                        {"offset": {"gte": %i}}
-                    }
-                ''' % self.offset
-
-            # Order the raw items from the old ones to the new so if the
-            # enrich process fails, it could be resume incrementally
-            order_query = ''
-            order_field = None
-            if self.perceval_backend:
-                order_field = self.get_incremental_date()
-            if order_field is not None:
-                order_query = ', "sort": { "%s": { "order": "asc" }} ' % order_field
-
-            # Fix the filters string if it starts with "," (empty first filter)
-            filters = filters.lstrip()[1:] if filters.lstrip().startswith(',') else filters
-
-            query = """
-            {
-                "query": {
-                    "bool": {
-                        "filter": [%s]
-                    }
-                } %s
-            }
-            """ % (filters, order_query)
+            query = self.get_elastic_query(_filter=_filter, ignore_incremental=ignore_incremental, _source=_source)
+            if _slice:
+                query['slice'] = _slice
 
-            logger.debug("Raw query to {}\n{}".format(anonymize_url(url),
-                         json.dumps(json.loads(query), indent=4)))
-            query_data = query
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Raw query to {}\n{}".format(anonymize_url(url), json.dumps(query, indent=4)))
+            query_data = json.dumps(query)
+
+        if stream:
+            return self.get_elastic_page_stream(url, query_data)
 
         rjson = None
         try:
@@ -359,15 +1134,57 @@ class ElasticItems:
             if self.too_many_scrolls(res):
                 return {'too_many_scrolls': True}
             res.raise_for_status()
-            rjson = res.json()
+            rjson = codec.loads(res.content)
+            # The new size is used by the next scrolls
+            if not elastic_scroll_id:
+                self.update_scroll_size(size, res, len(rjson['hits']['hits']))
         except Exception:
             # The index could not exists yet or it could be empty
             logger.debug("No results found from {}".format(anonymize_url(url)))
 
         return rjson
 
+    def get_elastic_page_stream(self, url, query_data):
+        """Get a `codec.PageDecoder` of a search or scroll page, with the
+        fields before the hits already decoded. The connection is released
+        when the page is read or closed.
+
+        The scroll size isn't adapted to the streamed pages, which are not
+        kept in memory.
+
+        :param url: URL of the search or scroll request
+        :param query_data: body of the request
+        """
+        def read_body(res):
+            try:
+                yield from res.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+            finally:
+                res.close()
+
+        res = None
+        try:
+            res = self.requests.post(url, data=query_data, headers=HEADER_JSON, stream=True)
+            if self.too_many_scrolls(res):
+                res.close()
+                return {'too_many_scrolls': True}
+            res.raise_for_status()
+            page = codec.PageDecoder(read_body(res))
+            page.start()
+        except Exception:
+            # The index could not exists yet or it could be empty
+            logger.debug("No results found from {}".format(anonymize_url(url)))
+            if res is not None:
+                res.close()
+            return None
+
+        return page
+
     def too_many_scrolls(self, res):
         """Check if result conatins 'too many scroll contexts' error"""
+        # Avoid decoding twice the pages read successfully
+        if res.status_code != 500:
+            return False
+
         r = res.json()
         return (
             r
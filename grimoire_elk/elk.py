@@ -21,17 +21,25 @@
 
 import inspect
 import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from elasticsearch import Elasticsearch
 
 from perceval.backend import find_signature_parameters, Archive
 from perceval.errors import RateLimitError
+from requests.adapters import DEFAULT_POOLSIZE
 from grimoirelab_toolkit.datetime import (datetime_utcnow, str_to_datetime)
 
+from .elastic import ElasticSearch
 from .elastic_mapping import Mapping as BaseMapping
 from .elastic_items import ElasticItems
 from .enriched.sortinghat_gelk import SortingHat
-from .enriched.utils import get_last_enrich, grimoire_con, get_diff_current_date, anonymize_url
+from .enriched.utils import (get_last_enrich, grimoire_con, get_diff_current_date, anonymize_url,
+                             get_repository_filter)
 from .utils import get_connectors, get_connector_from_name, get_elastic
 
 IDENTITIES_INDEX = "grimoirelab_identities_cache"
@@ -41,20 +49,238 @@ logger = logging.getLogger(__name__)
 
 requests_ses = grimoire_con()
 
+# Backends fed by processes in `feed_backends`, their items are parsed
+# by CPU-heavy code. The rest of backends are fed by threads
+PROCESS_BACKENDS = ['git', 'cocom', 'colic', 'dockerdeps', 'dockersmells']
+
+# ElasticSearch clients shared by the origins fed in this process, by (url, index)
+SHARED_ELASTIC = {}
+SHARED_ELASTIC_LOCK = threading.Lock()
+SHARED_ELASTIC_PID = None  # process of the clients, not inherited by the forked workers
+
+FeedResult = namedtuple('FeedResult', ['origin', 'error', 'seconds'])
+
 
 def feed_backend(url, clean, fetch_archive, backend_name, backend_params,
                  es_index=None, es_index_enrich=None, project=None,
                  es_aliases=None, projects_json_repo=None, repo_labels=None,
-                 anonymize=False):
+                 anonymize=False, replay=False):
     """ Feed Ocean with backend data """
 
+    error_msg, _ = _feed_backend(url, clean, fetch_archive, backend_name, backend_params,
+                                 es_index=es_index, es_index_enrich=es_index_enrich, project=project,
+                                 es_aliases=es_aliases, projects_json_repo=projects_json_repo,
+                                 repo_labels=repo_labels, anonymize=anonymize, replay=replay)
+    return error_msg
+
+
+def feed_backends(url, fetch_archive, backend_name, backends_params,
+                  es_index=None, es_index_enrich=None, project=None,
+                  es_aliases=None, anonymize=False, workers=1, processes=None, replay=False):
+    """Feed Ocean with the data of several origins of a backend concurrently.
+
+    The origins are fed by a pool of workers sharing the ElasticSearch
+    client, and its connection pool, of the index: one client for all the
+    threads or one per worker process. The index is never cleaned.
+
+    :param url: ES url
+    :param fetch_archive: if True, the items are fetched from the archive
+    :param backend_name: name of the backend (e.g., git)
+    :param backends_params: list with the backend params of each origin
+    :param es_index: raw index
+    :param es_index_enrich: enriched index
+    :param project: project of the items
+    :param es_aliases: aliases of the raw index
+    :param anonymize: if True, the identities of the items are anonymized
+    :param workers: number of origins fed at the same time
+    :param processes: if True, the workers are processes, if False threads. By
+        default processes for the backends in `PROCESS_BACKENDS`, threads otherwise
+    :param replay: if True, the archives of the origins are replayed (see
+        `ElasticOcean.replay`) with the index in bulk-load mode until all of them end
+
+    :returns: list of `FeedResult` of the origins, in the order of `backends_params`
+    """
+    if processes is None:
+        processes = backend_name in PROCESS_BACKENDS
+
+    # Workers sharing each ElasticSearch client
+    sharing = 1 if processes else workers
+    tasks = [(url, fetch_archive, backend_name, backend_params, es_index, es_index_enrich,
+              project, es_aliases, anonymize, sharing, replay) for backend_params in backends_params]
+
+    logger.info("[{}] Feeding {} origins with {} {}".format(
+                backend_name, len(tasks), workers, "processes" if processes else "threads"))
+
+    # The index is set up once, before the workers share it
+    elastic = None
+    if tasks:
+        connector = get_connector_from_name(backend_name)
+        if not connector:
+            raise RuntimeError("Unknown backend {}".format(backend_name))
+        elastic = get_elastic(url, es_index, False, connector[1](None), es_aliases)
+        if replay:
+            elastic.start_bulk_load()
+        elif not fetch_archive:
+            # The last items of all the origins are found with one search per field
+            prefetch_last_items(elastic, backend_name, backends_params)
+
+    if processes:
+        # The forked workers inherit the settings of the classes (e.g., bulk sizes) and
+        # the setup of the index, but not the clients of this process
+        executor = ProcessPoolExecutor(max_workers=workers)
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+    try:
+        with executor:
+            results = list(executor.map(_feed_origin, tasks))
+    finally:
+        if elastic is not None:
+            elastic.end_bulk_load()
+        ElasticSearch.clear_last_items_cache()
+        clear_shared_elastic()
+
+    failed = [result for result in results if result.error]
+    for result in results:
+        status = "failed: {}".format(result.error) if result.error else "done"
+        logger.info("[{}] {} {} in {:.2f} s".format(
+                    backend_name, anonymize_url(str(result.origin)), status, result.seconds))
+    logger.info("[{}] Done collection for {} origins, {} failed".format(backend_name, len(results), len(failed)))
+
+    return results
+
+
+def prefetch_last_items(elastic, backend_name, backends_params):
+    """Find the date or offset of the last item of several origins of a
+    backend in the raw index, with one search for all of them. The feeds of
+    the origins get them without querying the index until the cache of
+    the last items is cleared (see `ElasticSearch.clear_last_items_cache`).
+
+    :param elastic: ElasticSearch client of the raw index
+    :param backend_name: name of the backend (e.g., git)
+    :param backends_params: list with the backend params of each origin
+
+    :returns: number of origins prefetched
+    """
+    connector = get_connector_from_name(backend_name)
+    klass = connector[3]  # BackendCmd for the connector
+
+    # Values of the repository filters, by field of the last item and filter
+    values = {}
+    for backend_params in backends_params:
+        try:
+            backend_cmd = klass(*backend_params)
+            init_args = find_signature_parameters(backend_cmd.BACKEND, vars(backend_cmd.parsed_args))
+            init_args['archive'] = None
+            backend = backend_cmd.BACKEND(**init_args)
+        except Exception as ex:
+            # The error is reported when the origin is fed
+            logger.debug("[{}] Last item of {} not prefetched: {}".format(backend_name, backend_params, ex))
+            continue
+
+        ocean_backend = connector[1](backend)
+        filter_ = get_repository_filter(backend, ocean_backend.get_connector_name())
+        if not filter_:
+            continue
+
+        signature = inspect.signature(backend.fetch)
+        if 'from_date' in signature.parameters:
+            key = (ocean_backend.get_field_date(), False, filter_['name'])
+        elif 'offset' in signature.parameters:
+            key = ("offset", True, filter_['name'])
+        else:
+            continue
+        values.setdefault(key, []).append(filter_['value'])
+
+    prefetched = 0
+    for (field, offset, filter_name), filter_values in values.items():
+        prefetched += len(elastic.prefetch_last_items(field, filter_name, filter_values, offset=offset))
+
+    logger.debug("[{}] Last items of {} origins prefetched".format(backend_name, prefetched))
+
+    return prefetched
+
+
+def _feed_origin(task):
+    """Feed an origin in a worker of `feed_backends`"""
+
+    url, fetch_archive, backend_name, backend_params, es_index, es_index_enrich, \
+        project, es_aliases, anonymize, sharing, replay = task
+
+    task_init = time.time()
+    error_msg, origin = _feed_backend(url, False, fetch_archive, backend_name, backend_params,
+                                      es_index=es_index, es_index_enrich=es_index_enrich, project=project,
+                                      es_aliases=es_aliases, anonymize=anonymize, shared_workers=sharing,
+                                      replay=replay)
+
+    return FeedResult(origin if origin else " ".join(backend_params), error_msg, time.time() - task_init)
+
+
+def get_shared_elastic(url, es_index, ocean_backend, es_aliases=None, workers=1):
+    """Get the ElasticSearch client of an index shared by the origins fed
+    in this process, creating it the first time
+
+    :param url: ES url
+    :param es_index: index name
+    :param ocean_backend: ocean backend of the items stored in the index
+    :param es_aliases: aliases of the index
+    :param workers: number of workers sharing the client
+    """
+    global SHARED_ELASTIC_PID
+
+    with SHARED_ELASTIC_LOCK:
+        # The clients inherited by a forked worker process belong to its parent
+        if SHARED_ELASTIC_PID != os.getpid():
+            SHARED_ELASTIC.clear()
+            SHARED_ELASTIC_PID = os.getpid()
+
+        elastic = SHARED_ELASTIC.get((url, es_index))
+        if not elastic:
+            elastic = get_elastic(url, es_index, False, ocean_backend, es_aliases)
+            # Room in the connection pool for the bulk requests of every worker
+            elastic.requests = grimoire_con(pool_maxsize=max(workers * ElasticSearch.bulk_workers, DEFAULT_POOLSIZE))
+            SHARED_ELASTIC[(url, es_index)] = elastic
+        else:
+            ocean_backend.set_elastic_url(url)
+
+    return elastic
+
+
+def clear_shared_elastic():
+    """Close the ElasticSearch clients shared by the origins fed in this
+    process, so the next feeds create their own ones"""
+
+    with SHARED_ELASTIC_LOCK:
+        for elastic in SHARED_ELASTIC.values():
+            elastic.requests.close()
+        SHARED_ELASTIC.clear()
+
+
+def _feed_backend(url, clean, fetch_archive, backend_name, backend_params,
+                  es_index=None, es_index_enrich=None, project=None,
+                  es_aliases=None, projects_json_repo=None, repo_labels=None,
+                  anonymize=False, shared_workers=None, replay=False):
+    """Feed Ocean with backend data
+
+    :param shared_workers: if not None, the ElasticSearch client is shared
+        by this number of workers and the bulk loads are ended by them
+    :param replay: if True, the archive of the backend is replayed as fast as
+        possible (see `ElasticOcean.replay`). Unless the client is shared, the
+        index is in bulk-load mode until the replay ends
+
+    :returns: tuple with the error message, if any, and the origin fed
+    """
     error_msg = None
     backend = None
+    elastic_ocean = None
     repo = {'backend_name': backend_name, 'backend_params': backend_params}  # repository data to be stored in conf
 
     if es_index:
         clean = False  # don't remove index, it could be shared
 
+    if replay:
+        fetch_archive = True
+
     if not get_connector_from_name(backend_name):
         raise RuntimeError("Unknown backend {}".format(backend_name))
     connector = get_connector_from_name(backend_name)
@@ -92,7 +318,11 @@ def feed_backend(url, clean, fetch_archive, backend_name, backend_params,
         backend = backend_cmd.backend
 
         ocean_backend = connector[1](backend, fetch_archive=fetch_archive, project=project, anonymize=anonymize)
-        elastic_ocean = get_elastic(url, es_index, clean, ocean_backend, es_aliases)
+        if shared_workers:
+            elastic_ocean = get_shared_elastic(url, es_index, ocean_backend, es_aliases, workers=shared_workers)
+            ocean_backend.requests = elastic_ocean.requests
+        else:
+            elastic_ocean = get_elastic(url, es_index, clean, ocean_backend, es_aliases)
         ocean_backend.set_elastic(elastic_ocean)
         ocean_backend.set_repo_labels(repo_labels)
         ocean_backend.set_projects_json_repo(projects_json_repo)
@@ -159,7 +389,12 @@ def feed_backend(url, clean, fetch_archive, backend_name, backend_params,
         if offset:
             params['from_offset'] = offset
 
-        ocean_backend.feed(**params)
+        if replay:
+            if not shared_workers:
+                elastic_ocean.start_bulk_load()
+            ocean_backend.replay()
+        else:
+            ocean_backend.feed(**params)
 
     except RateLimitError as ex:
         logger.error("Error feeding raw from {} ({}): rate limit exceeded".format(backend_name, backend.origin))
@@ -171,9 +406,14 @@ def feed_backend(url, clean, fetch_archive, backend_name, backend_params,
         else:
             error_msg = "Error feeding raw from {}".format(ex)
             logger.error(error_msg, exc_info=True)
+    finally:
+        # Only the bulk load of this feed is ended, others could be running in the process
+        if not shared_workers and elastic_ocean is not None:
+            elastic_ocean.end_bulk_load()
 
-    logger.info("[{}] Done collection for {}".format(backend_name, anonymize_url(backend.origin)))
-    return error_msg
+    origin = backend.origin if backend else None
+    logger.info("[{}] Done collection for {}".format(backend_name, anonymize_url(str(origin))))
+    return error_msg, origin
 
 
 def refresh_projects(enrich_backend):
@@ -316,9 +556,11 @@ def enrich_items(ocean_backend, enrich_backend, events=False):
 
     if not events:
         total = enrich_backend.enrich_items(ocean_backend)
+        enrich_backend.elastic.refresh_if_needed(end_of_run=True)
         enrich_backend.update_items(ocean_backend, enrich_backend)
     else:
         total = enrich_backend.enrich_events(ocean_backend)
+        enrich_backend.elastic.refresh_if_needed(end_of_run=True)
     return total
 
 
@@ -367,6 +609,9 @@ def get_ocean_backend(backend_cmd, enrich_backend, no_incremental, filter_raw=No
     if filter_raw:
         ocean_backend.set_filter_raw(filter_raw)
 
+    # Read only the fields of the raw items used by the enricher
+    ocean_backend.set_source_fields(enrich_backend.get_raw_source())
+
     return ocean_backend
 
 
@@ -379,17 +624,24 @@ def do_studies(ocean_backend, enrich_backend, studies_args, retention_time=None)
     :param retention_time: maximum number of minutes wrt the current date to retain the data
     :param studies_args: list of studies to be executed
     """
+    # Studies read the enriched items, they must be visible
+    enrich_backend.elastic.refresh_if_needed()
+
     for study in enrich_backend.studies:
         selected_studies = [(s['name'], s['params']) for s in studies_args if s['type'] == study.__name__]
 
         for (name, params) in selected_studies:
             data_source = enrich_backend.__class__.__name__.split("Enrich")[0].lower()
             logger.info("[{}] Starting study: {}, params {}".format(data_source, name, params))
+            source_fields = ocean_backend.source_fields
+            ocean_backend.set_source_fields(enrich_backend.get_raw_source(study.__name__))
             try:
                 study(ocean_backend, enrich_backend, **params)
             except Exception as e:
                 logger.error("[{}] Problem executing study {}, {}".format(data_source, name, e))
                 raise e
+            finally:
+                ocean_backend.set_source_fields(source_fields)
 
             # identify studies which creates other indexes. If the study is onion,
             # it can be ignored since the index is recreated every week
@@ -402,6 +654,7 @@ def do_studies(ocean_backend, enrich_backend, studies_args, retention_time=None)
                 index_name = params[ip]
                 elastic = get_elastic(enrich_backend.elastic_url, index_name)
 
+                elastic.refresh_if_needed(end_of_run=True)
                 elastic.delete_items(retention_time)
 
 
@@ -424,6 +677,7 @@ def enrich_backend(url, clean, backend_name, backend_params, cfg_section_name,
 
     backend = None
     enrich_index = None
+    elastic_enrich = None
 
     if ocean_index or ocean_index_enrich:
         clean = False  # don't remove index, it could be shared
@@ -464,6 +718,9 @@ def enrich_backend(url, clean, backend_name, backend_params, cfg_section_name,
         else:
             elastic_enrich = get_elastic(url, enrich_index, clean, enrich_backend, es_enrich_aliases)
         enrich_backend.set_elastic(elastic_enrich)
+        if no_incremental and elastic_enrich.bulk_load:
+            # All the items are enriched again
+            elastic_enrich.start_bulk_load()
         if jenkins_rename_file and backend_name == "jenkins":
             enrich_backend.set_jenkins_rename_file(jenkins_rename_file)
         if unaffiliated_group:
@@ -534,6 +791,7 @@ def enrich_backend(url, clean, backend_name, backend_params, cfg_section_name,
                     enrich_count = enrich_items(ocean_backend, enrich_backend, events=True)
                     if enrich_count is not None:
                         logger.debug("Total events enriched {} ".format(enrich_count))
+                enrich_backend.elastic.end_bulk_load()
                 if studies:
                     do_studies(ocean_backend, enrich_backend, studies_args)
 
@@ -543,6 +801,10 @@ def enrich_backend(url, clean, backend_name, backend_params, cfg_section_name,
                          backend_name, anonymize_url(backend.origin), ex), exc_info=True)
         else:
             logger.error("Error enriching raw {}".format(ex), exc_info=True)
+    finally:
+        # Only the bulk load of this enrichment is ended, others could be running in the process
+        if elastic_enrich is not None:
+            elastic_enrich.end_bulk_load()
 
     logger.info("[{}] Done enrichment for {}".format(backend_name, anonymize_url(backend.origin)))
 
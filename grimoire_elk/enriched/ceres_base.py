@@ -20,13 +20,18 @@
 #
 
 import logging
+import time
 from collections import namedtuple
 from grimoirelab_toolkit import datetime
 
 from elasticsearch import helpers
-from elasticsearch.exceptions import NotFoundError
+from elasticsearch.exceptions import NotFoundError, SerializationError
+from elasticsearch.serializer import JSONSerializer
 from elasticsearch_dsl import Search
 
+from .. import codec
+from ..elastic import BULK_LOAD_SETTINGS, ElasticSearch
+
 
 logger = logging.getLogger(__name__)
 
@@ -136,6 +141,32 @@ class CeresBase:
         raise NotImplementedError
 
 
+class CodecSerializer(JSONSerializer):
+    """Serializer for ElasticSearch clients based on `grimoire_elk.codec`.
+
+    Objects not supported by the codec (e.g., dates or decimals) are
+    serialized by the default `JSONSerializer`. The length of the last
+    document decoded is kept in `last_size`.
+    """
+    last_size = None
+
+    def loads(self, s):
+        self.last_size = len(s)
+        try:
+            return codec.loads(s)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(s, e)
+
+    def dumps(self, data):
+        if isinstance(data, str):
+            return data
+
+        try:
+            return codec.dumps(data)
+        except (ValueError, TypeError):
+            return super().dumps(data)
+
+
 class ESConnector(Connector):
     """Connector for ElasticSearch databases.
 
@@ -143,15 +174,21 @@ class ESConnector(Connector):
     :param self._es_index: ElasticSearch index for reading from/writing to.
     :param self._sort_on_field: date field to sort results, important for incremental process.
     :param self._read_only: True to avoid unwanted writes.
+    :param self._page_size: number of items per page when scanning the index.
+    :param self._page_sizer: `PageSizer` to adapt the page size to the pages read, if not None.
     """
 
-    def __init__(self, es_conn, es_index, sort_on_field='metadata__timestamp', repo=None, read_only=True):
+    def __init__(self, es_conn, es_index, sort_on_field='metadata__timestamp', repo=None, read_only=True,
+                 page_size=1000, page_sizer=None):
 
         self._es_conn = es_conn
         self._es_index = es_index
         self._sort_on_field = sort_on_field
         self._repo = repo
         self._read_only = read_only
+        self._page_size = page_size
+        self._page_sizer = page_sizer
+        self._bulk_load_settings = None
         self.__log_prefix = "[" + es_index + "] study "
 
         self._es_major = self._es_conn.info()['version']['number'].split('.')[0]
@@ -168,11 +205,7 @@ class ESConnector(Connector):
         :raises NotFoundError: index not found in ElasticSearch
         """
         search_query = self._build_search_query(from_date)
-        for hit in helpers.scan(self._es_conn,
-                                search_query,
-                                scroll='300m',
-                                index=self._es_index,
-                                preserve_order=True):
+        for hit in self._scan(search_query):
             yield hit
 
     def read_block(self, size, from_date=None):
@@ -186,11 +219,7 @@ class ESConnector(Connector):
         """
         search_query = self._build_search_query(from_date)
         hits_block = []
-        for hit in helpers.scan(self._es_conn,
-                                search_query,
-                                scroll='300m',
-                                index=self._es_index,
-                                preserve_order=True):
+        for hit in self._scan(search_query):
 
             hits_block.append(hit)
 
@@ -203,6 +232,53 @@ class ESConnector(Connector):
         if len(hits_block) > 0:
             yield hits_block
 
+    def _scan(self, search_query):
+        """Scroll the hits of a query keeping its sort. When there is a page
+        sizer, the size of the pages is adapted after each one; the new size
+        is used by the next scans, since the pages of a scroll can't change.
+
+        :param search_query: query to scan.
+        :return: next hit of the query.
+        """
+        size = self._page_size
+        before = time.time()
+        page = self._es_conn.search(index=self._es_index, body=search_query, scroll='300m', size=size)
+        scroll_id = page.get('_scroll_id')
+
+        try:
+            while scroll_id and page['hits']['hits']:
+                hits = page['hits']['hits']
+                self._update_page_size(size, hits, time.time() - before)
+
+                for hit in hits:
+                    yield hit
+
+                before = time.time()
+                page = self._es_conn.scroll(scroll_id=scroll_id, scroll='300m')
+                scroll_id = page.get('_scroll_id')
+        finally:
+            if scroll_id:
+                self._es_conn.clear_scroll(body={'scroll_id': [scroll_id]}, ignore=(404,))
+
+    def _update_page_size(self, size, hits, seconds):
+        """Adapt the page size to a page of hits read, if there is a page sizer.
+
+        :param size: number of hits requested.
+        :param hits: hits of the page.
+        :param seconds: time to read the page.
+        """
+        if not self._page_sizer:
+            return
+
+        num_bytes = getattr(self._es_conn.transport.serializer, 'last_size', None)
+        if num_bytes is None:
+            num_bytes = len(codec.dumpb(hits))
+
+        page_size = self._page_sizer.next_size(size, len(hits), num_bytes, seconds)
+        if page_size != self._page_size:
+            logger.debug("{} Page size changed from {} to {}".format(self.__log_prefix, self._page_size, page_size))
+            self._page_size = page_size
+
     def write(self, items):
         """Upload items to ElasticSearch.
 
@@ -225,11 +301,12 @@ class ESConnector(Connector):
         helpers.bulk(self._es_conn, docs)
         logger.info("{} Written: {}".format(self.__log_prefix, len(docs)))
 
-    def create_index(self, mappings_file, delete=True):
+    def create_index(self, mappings_file, delete=True, bulk_load=False):
         """Create a new index.
 
         :param mappings_file: index mappings to be used.
         :param delete: True to delete current index if exists.
+        :param bulk_load: True to fill the index in bulk-load mode until `end_bulk_load` is called.
         """
 
         if self._read_only:
@@ -244,6 +321,49 @@ class ESConnector(Connector):
             mapping = f.read()
 
         self._es_conn.indices.create(self._es_index, body=mapping)
+        # The ElasticSearch objects using the index must set it up again
+        ElasticSearch.clear_bootstrap_cache(index=self._es_index)
+
+        if bulk_load:
+            self.start_bulk_load()
+
+    def start_bulk_load(self):
+        """Disable the refresh and the replicas of the index while it is filled.
+        The previous settings are restored by `end_bulk_load`.
+        """
+        if self._read_only:
+            raise IOError("Cannot write, Connector created as Read Only")
+
+        settings = self._es_conn.indices.get_settings(index=self._es_index, flat_settings=True)
+        current = list(settings.values())[0]['settings']
+
+        self._es_conn.indices.put_settings(index=self._es_index, body=BULK_LOAD_SETTINGS)
+        self._bulk_load_settings = {setting: current.get(setting) for setting in BULK_LOAD_SETTINGS}
+        logger.info("{} Bulk-load mode set on {}".format(self.__log_prefix, self._es_index))
+
+    def end_bulk_load(self, force_merge=None, timeout='5m'):
+        """Restore the settings of the index changed by `start_bulk_load`, refresh it
+        and wait until it is green. If the index is not in bulk-load mode, nothing is done.
+
+        :param force_merge: max number of segments to merge the index into, if set.
+        :param timeout: max time to wait for the index to be green.
+        """
+        if self._bulk_load_settings is None:
+            return
+
+        settings = self._bulk_load_settings
+        self._bulk_load_settings = None
+
+        self._es_conn.indices.put_settings(index=self._es_index, body=settings)
+        self._es_conn.indices.refresh(index=self._es_index)
+        if force_merge:
+            self._es_conn.indices.forcemerge(index=self._es_index, max_num_segments=force_merge)
+
+        health = self._es_conn.cluster.health(index=self._es_index, wait_for_status='green', timeout=timeout)
+        if health.get('timed_out'):
+            logger.warning("{} Index {} not green after the bulk load".format(self.__log_prefix, self._es_index))
+
+        logger.info("{} Bulk-load mode ended on {}".format(self.__log_prefix, self._es_index))
 
     def latest_date(self):
         """Get date of most recent item available in ElasticSearch.
@@ -33,6 +33,7 @@ from .enrich import (Enrich,
 from .graal_study_evolution import (get_to_date,
                                     get_unique_repository,
                                     get_files_at_time)
+from .ceres_base import CodecSerializer
 from .utils import fix_field_date, anonymize_url
 from ..elastic_mapping import Mapping as BaseMapping
 
@@ -297,7 +298,8 @@ class CocomEnrich(Enrich):
         logger.info("[cocom] study enrich-cocom-analysis start")
 
         es_in = ES([enrich_backend.elastic_url], retry_on_timeout=True, timeout=100,
-                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection)
+                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection,
+                   serializer=CodecSerializer())
         in_index = enrich_backend.elastic.index
         interval_months = list(map(int, interval_months))
 
@@ -311,105 +313,110 @@ class CocomEnrich(Enrich):
         logger.info("[cocom] study enrich-cocom-analysis {} repositories to process".format(
                     len(repositories)))
         es_out = ElasticSearch(enrich_backend.elastic.url, out_index, mappings=Mapping)
-        es_out.add_alias("cocom_study")
+        # The bulk-load mode of the index is ended even if the study fails
+        try:
+            es_out.add_alias("cocom_study")
+
+            num_items = 0
+            ins_items = 0
+
+            for repository_url in repositories:
+                repository_url_anonymized = repository_url
+                if repository_url_anonymized.startswith('http'):
+                    repository_url_anonymized = anonymize_url(repository_url_anonymized)
+
+                logger.info("[cocom] study enrich-cocom-analysis start analysis for {}".format(
+                            repository_url_anonymized))
+                evolution_items = []
+
+                for interval in interval_months:
+
+                    to_month = get_to_date(es_in, in_index, out_index, repository_url, interval)
+                    to_month = to_month.replace(month=int(interval), day=1, hour=0, minute=0, second=0)
+
+                    while to_month < current_month:
+                        files_at_time = es_in.search(
+                            index=in_index,
+                            body=get_files_at_time(repository_url, to_month.isoformat())
+                        )['aggregations']['file_stats'].get("buckets", [])
+
+                        if not len(files_at_time):
+                            to_month = to_month + relativedelta(months=+interval)
+                            continue
+
+                        repository_name = repository_url.split("/")[-1]
+                        total_per_lang = {}
+
+                        for file_ in files_at_time:
+                            file_details = file_["1"]["hits"]["hits"][0]["_source"]
+
+                            if "language" in file_details:
+                                lang = file_details["language"]
+                                total_per_lang[lang] = total_per_lang.get(lang, {})
+
+                                for metric in self.metrics:
+                                    total_per_lang[lang][metric] = total_per_lang[lang].get(metric, 0)
+                                    metric_value = file_details[metric]
+                                    total_per_lang[lang][metric] += metric_value if metric_value is not None else 0
+
+                                total_per_lang[lang]["total_files"] = total_per_lang[lang].get("total_files", 0) + 1
+
+                        for language in total_per_lang:
+                            total = total_per_lang[language]
+                            if total["loc"] > 0:
+                                hash_repo_url = hashlib.md5(repository_url_anonymized.encode('utf-8')).hexdigest()
+                                to_month_iso = to_month.isoformat()
+                                evolution_item = {
+                                    "id": "{}_{}_{}_{}".format(to_month_iso, hash_repo_url, interval, language),
+                                    "repo_url": repository_url_anonymized,
+                                    "origin": repository_url,
+                                    "interval_months": interval,
+                                    "study_creation_date": to_month_iso,
+                                    "language": language,
+                                    "total_files": total["total_files"]
+                                }
+
+                                for metric in self.metrics:
+                                    evolution_item["total_" + metric] = total[metric]
+
+                                evolution_item["total_comments_per_loc"] = round(
+                                    evolution_item["total_comments"] / max(evolution_item["total_loc"], 1), 2)
+                                evolution_item["total_blanks_per_loc"] = round(
+                                    evolution_item["total_blanks"] / max(evolution_item["total_loc"], 1), 2)
+                                evolution_item["total_loc_per_function"] = round(
+                                    evolution_item["total_loc"] / max(evolution_item["total_num_funs"], 1), 2)
+
+                                evolution_item.update(self.get_grimoire_fields(evolution_item["study_creation_date"], "stats"))
+                                evolution_items.append(evolution_item)
+
+                        if len(evolution_items) >= self.elastic.max_items_bulk:
+                            num_items += len(evolution_items)
+                            ins_items += es_out.bulk_upload(evolution_items, self.get_field_unique_id())
+                            evolution_items = []
 
-        num_items = 0
-        ins_items = 0
-
-        for repository_url in repositories:
-            repository_url_anonymized = repository_url
-            if repository_url_anonymized.startswith('http'):
-                repository_url_anonymized = anonymize_url(repository_url_anonymized)
-
-            logger.info("[cocom] study enrich-cocom-analysis start analysis for {}".format(
-                        repository_url_anonymized))
-            evolution_items = []
-
-            for interval in interval_months:
-
-                to_month = get_to_date(es_in, in_index, out_index, repository_url, interval)
-                to_month = to_month.replace(month=int(interval), day=1, hour=0, minute=0, second=0)
-
-                while to_month < current_month:
-                    files_at_time = es_in.search(
-                        index=in_index,
-                        body=get_files_at_time(repository_url, to_month.isoformat())
-                    )['aggregations']['file_stats'].get("buckets", [])
-
-                    if not len(files_at_time):
                         to_month = to_month + relativedelta(months=+interval)
-                        continue
-
-                    repository_name = repository_url.split("/")[-1]
-                    total_per_lang = {}
-
-                    for file_ in files_at_time:
-                        file_details = file_["1"]["hits"]["hits"][0]["_source"]
-
-                        if "language" in file_details:
-                            lang = file_details["language"]
-                            total_per_lang[lang] = total_per_lang.get(lang, {})
-
-                            for metric in self.metrics:
-                                total_per_lang[lang][metric] = total_per_lang[lang].get(metric, 0)
-                                total_per_lang[lang][metric] += file_details[metric] if file_details[metric] is not None else 0
-
-                            total_per_lang[lang]["total_files"] = total_per_lang[lang].get("total_files", 0) + 1
-
-                    for language in total_per_lang:
-                        total = total_per_lang[language]
-                        if total["loc"] > 0:
-                            hash_repo_url = hashlib.md5(repository_url_anonymized.encode('utf-8')).hexdigest()
-                            to_month_iso = to_month.isoformat()
-                            evolution_item = {
-                                "id": "{}_{}_{}_{}".format(to_month_iso, hash_repo_url, interval, language),
-                                "repo_url": repository_url_anonymized,
-                                "origin": repository_url,
-                                "interval_months": interval,
-                                "study_creation_date": to_month_iso,
-                                "language": language,
-                                "total_files": total["total_files"]
-                            }
-
-                            for metric in self.metrics:
-                                evolution_item["total_" + metric] = total[metric]
-
-                            evolution_item["total_comments_per_loc"] = round(
-                                evolution_item["total_comments"] / max(evolution_item["total_loc"], 1), 2)
-                            evolution_item["total_blanks_per_loc"] = round(
-                                evolution_item["total_blanks"] / max(evolution_item["total_loc"], 1), 2)
-                            evolution_item["total_loc_per_function"] = round(
-                                evolution_item["total_loc"] / max(evolution_item["total_num_funs"], 1), 2)
-
-                            evolution_item.update(self.get_grimoire_fields(evolution_item["study_creation_date"], "stats"))
-                            evolution_items.append(evolution_item)
-
-                    if len(evolution_items) >= self.elastic.max_items_bulk:
+
+                    if len(evolution_items) > 0:
                         num_items += len(evolution_items)
                         ins_items += es_out.bulk_upload(evolution_items, self.get_field_unique_id())
-                        evolution_items = []
-
-                    to_month = to_month + relativedelta(months=+interval)
-
-                if len(evolution_items) > 0:
-                    num_items += len(evolution_items)
-                    ins_items += es_out.bulk_upload(evolution_items, self.get_field_unique_id())
-
-                if num_items != ins_items:
-                    missing = num_items - ins_items
-                    logger.error(
-                        "[cocom] study enrich-cocom-analysis {}/{} missing items for Graal CoCom Analysis "
-                        "Study".format(missing, num_items)
-                    )
-                else:
-                    logger.info(
-                        "[cocom] study enrich-cocom-analysis {} items inserted for Graal CoCom Analysis "
-                        "Study".format(num_items)
-                    )
-
-            logger.info(
-                "[cocom] study enrich-cocom-analysis End analysis for {} with month interval".format(
-                    repository_url_anonymized)
-            )
+
+                    if num_items != ins_items:
+                        missing = num_items - ins_items
+                        logger.error(
+                            "[cocom] study enrich-cocom-analysis {}/{} missing items for Graal CoCom Analysis "
+                            "Study".format(missing, num_items)
+                        )
+                    else:
+                        logger.info(
+                            "[cocom] study enrich-cocom-analysis {} items inserted for Graal CoCom Analysis "
+                            "Study".format(num_items)
+                        )
+
+                logger.info(
+                    "[cocom] study enrich-cocom-analysis End analysis for {} with month interval".format(
+                        repository_url_anonymized)
+                )
+        finally:
+            es_out.end_bulk_load()
 
         logger.info("[cocom] study enrich-cocom-analysis End")
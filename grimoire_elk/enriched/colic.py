@@ -27,6 +27,7 @@ from .enrich import (Enrich,
                      metadata)
 from .graal_study_evolution import (get_to_date,
                                     get_unique_repository)
+from .ceres_base import CodecSerializer
 from .utils import fix_field_date, anonymize_url
 from ..elastic_mapping import Mapping as BaseMapping
 
@@ -369,7 +370,8 @@ class ColicEnrich(Enrich):
         logger.info("[colic] study enrich-colic-analysis start")
 
         es_in = ES([enrich_backend.elastic_url], retry_on_timeout=True, timeout=100,
-                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection)
+                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection,
+                   serializer=CodecSerializer())
         in_index = enrich_backend.elastic.index
         interval_months = list(map(int, interval_months))
 
@@ -382,87 +384,91 @@ class ColicEnrich(Enrich):
         logger.info("[colic] study enrich-colic-analysis {} repositories to process".format(
                     len(repositories)))
         es_out = ElasticSearch(enrich_backend.elastic.url, out_index, mappings=Mapping)
-        es_out.add_alias("colic_study")
-
-        current_month = datetime_utcnow().replace(day=1, hour=0, minute=0, second=0)
-        num_items = 0
-        ins_items = 0
-
-        for repository_url in repositories:
-            repository_url_anonymized = repository_url
-            if repository_url_anonymized.startswith('http'):
-                repository_url_anonymized = anonymize_url(repository_url_anonymized)
-
-            logger.info("[colic] study enrich-colic-analysis start analysis for {}".format(
-                        repository_url_anonymized))
-            evolution_items = []
-
-            for interval in interval_months:
-
-                to_month = get_to_date(es_in, in_index, out_index, repository_url, interval)
-                to_month = to_month.replace(month=int(interval), day=1, hour=0, minute=0, second=0)
-
-                while to_month < current_month:
-                    copyrighted_files_at_time = es_in.search(
-                        index=in_index,
-                        body=self.__get_copyrighted_files(repository_url, to_month.isoformat()))
-
-                    licensed_files_at_time = es_in.search(
-                        index=in_index,
-                        body=self.__get_licensed_files(repository_url, to_month.isoformat()))
+        # The bulk-load mode of the index is ended even if the study fails
+        try:
+            es_out.add_alias("colic_study")
+
+            current_month = datetime_utcnow().replace(day=1, hour=0, minute=0, second=0)
+            num_items = 0
+            ins_items = 0
+
+            for repository_url in repositories:
+                repository_url_anonymized = repository_url
+                if repository_url_anonymized.startswith('http'):
+                    repository_url_anonymized = anonymize_url(repository_url_anonymized)
+
+                logger.info("[colic] study enrich-colic-analysis start analysis for {}".format(
+                            repository_url_anonymized))
+                evolution_items = []
+
+                for interval in interval_months:
+
+                    to_month = get_to_date(es_in, in_index, out_index, repository_url, interval)
+                    to_month = to_month.replace(month=int(interval), day=1, hour=0, minute=0, second=0)
+
+                    while to_month < current_month:
+                        copyrighted_files_at_time = es_in.search(
+                            index=in_index,
+                            body=self.__get_copyrighted_files(repository_url, to_month.isoformat()))
+
+                        licensed_files_at_time = es_in.search(
+                            index=in_index,
+                            body=self.__get_licensed_files(repository_url, to_month.isoformat()))
+
+                        files_at_time = es_in.search(
+                            index=in_index,
+                            body=self.__get_total_files(repository_url, to_month.isoformat()))
+
+                        licensed_files = int(licensed_files_at_time["aggregations"]["1"]["value"])
+                        copyrighted_files = int(copyrighted_files_at_time["aggregations"]["1"]["value"])
+                        total_files = int(files_at_time["aggregations"]["1"]["value"])
+
+                        if not total_files:
+                            to_month = to_month + relativedelta(months=+interval)
+                            continue
+
+                        evolution_item = {
+                            "id": "{}_{}_{}".format(to_month.isoformat(), hash(repository_url_anonymized), interval),
+                            "repo_url": repository_url_anonymized,
+                            "origin": repository_url,
+                            "interval_months": interval,
+                            "study_creation_date": to_month.isoformat(),
+                            "licensed_files": licensed_files,
+                            "copyrighted_files": copyrighted_files,
+                            "total_files": total_files
+                        }
 
-                    files_at_time = es_in.search(
-                        index=in_index,
-                        body=self.__get_total_files(repository_url, to_month.isoformat()))
+                        evolution_item.update(self.get_grimoire_fields(evolution_item["study_creation_date"], "stats"))
+                        evolution_items.append(evolution_item)
 
-                    licensed_files = int(licensed_files_at_time["aggregations"]["1"]["value"])
-                    copyrighted_files = int(copyrighted_files_at_time["aggregations"]["1"]["value"])
-                    total_files = int(files_at_time["aggregations"]["1"]["value"])
+                        if len(evolution_items) >= self.elastic.max_items_bulk:
+                            num_items += len(evolution_items)
+                            ins_items += es_out.bulk_upload(evolution_items, self.get_field_unique_id())
+                            evolution_items = []
 
-                    if not total_files:
                         to_month = to_month + relativedelta(months=+interval)
-                        continue
-
-                    evolution_item = {
-                        "id": "{}_{}_{}".format(to_month.isoformat(), hash(repository_url_anonymized), interval),
-                        "repo_url": repository_url_anonymized,
-                        "origin": repository_url,
-                        "interval_months": interval,
-                        "study_creation_date": to_month.isoformat(),
-                        "licensed_files": licensed_files,
-                        "copyrighted_files": copyrighted_files,
-                        "total_files": total_files
-                    }
-
-                    evolution_item.update(self.get_grimoire_fields(evolution_item["study_creation_date"], "stats"))
-                    evolution_items.append(evolution_item)
 
-                    if len(evolution_items) >= self.elastic.max_items_bulk:
+                    if len(evolution_items) > 0:
                         num_items += len(evolution_items)
                         ins_items += es_out.bulk_upload(evolution_items, self.get_field_unique_id())
-                        evolution_items = []
-
-                    to_month = to_month + relativedelta(months=+interval)
-
-                if len(evolution_items) > 0:
-                    num_items += len(evolution_items)
-                    ins_items += es_out.bulk_upload(evolution_items, self.get_field_unique_id())
-
-                if num_items != ins_items:
-                    missing = num_items - ins_items
-                    logger.error(
-                        "[colic] study enrich-colic-analysis {}/{} missing items for Graal CoLic Analysis "
-                        "Study".format(missing, num_items)
-                    )
-                else:
-                    logger.info(
-                        "[colic] study enrich-colic-analysis {} items inserted for Graal CoLic Analysis "
-                        "Study".format(num_items)
-                    )
-
-            logger.info(
-                "[colic] study enrich-colic-analysis end analysis for {} with month interval".format(
-                    repository_url_anonymized)
-            )
+
+                    if num_items != ins_items:
+                        missing = num_items - ins_items
+                        logger.error(
+                            "[colic] study enrich-colic-analysis {}/{} missing items for Graal CoLic Analysis "
+                            "Study".format(missing, num_items)
+                        )
+                    else:
+                        logger.info(
+                            "[colic] study enrich-colic-analysis {} items inserted for Graal CoLic Analysis "
+                            "Study".format(num_items)
+                        )
+
+                logger.info(
+                    "[colic] study enrich-colic-analysis end analysis for {} with month interval".format(
+                        repository_url_anonymized)
+                )
+        finally:
+            es_out.end_bulk_load()
 
         logger.info("[colic] study enrich-colic-analysis end")
@@ -25,7 +25,6 @@ import json
 import functools
 import logging
 import requests
-import sys
 import time
 
 from datetime import timedelta
@@ -43,6 +42,7 @@ from grimoirelab_toolkit.datetime import (datetime_utcnow, str_to_datetime)
 from ..elastic import ElasticSearch
 from ..elastic_items import (ElasticItems,
                              HEADER_JSON)
+from .ceres_base import CodecSerializer
 from .study_ceres_onion import ESOnionConnector, onion_study
 from .sortinghat_gelk import MULTI_ORG_NAMES
 from .graal_study_evolution import (get_to_date,
@@ -51,6 +51,8 @@ from statsmodels.duration.survfunc import SurvfuncRight
 
 from .utils import grimoire_con, METADATA_FILTER_RAW, REPO_LABELS, anonymize_url
 from .. import __version__
+from ..checkpoint import CheckpointTracker, EnrichCheckpoints
+from .. import query as esq
 
 logger = logging.getLogger(__name__)
 
@@ -113,8 +115,17 @@ class Enrich(ElasticItems):
                        "offset", "origin", "tag", "uuid"]
     KEYWORD_MAX_LENGTH = 1000  # this control allows to avoid max_bytes_length_exceeded_exception
 
+    # Fields of the raw items read when enriching them and by each study, as `_source`
+    # filters (e.g., {"excludes": ["data.files"]}). If None, the whole raw items are read
+    RAW_SOURCE = None
+    RAW_SOURCE_STUDIES = {}
+
     ONION_INTERVAL = seconds = 3600 * 24 * 7
 
+    # File where the checkpoints of the enrichment are kept to resume it, if any
+    checkpoint_path = None
+    checkpoint_interval = 60  # min seconds between checkpoints
+
     def __init__(self, db_sortinghat=None, db_projects_map=None, json_projects_map=None,
                  db_user='', db_password='', db_host='', insecure=True):
 
@@ -329,6 +340,17 @@ class Enrich(ElasticItems):
             raise RuntimeError("Can't find projects mapping in {}".format(db_projects_map))
         return ds_repo_to_prj
 
+    def get_raw_source(self, study=None):
+        """Get the `_source` filter of the raw items read by the enricher
+
+        :param study: name of the study reading the raw items, if None the
+            filter used when enriching them is returned
+        """
+        if study:
+            return self.RAW_SOURCE_STUDIES.get(study)
+
+        return self.RAW_SOURCE
+
     def get_field_unique_id(self):
         """ Field in the raw item with the unique id """
         return "uuid"
@@ -360,56 +382,81 @@ class Enrich(ElasticItems):
         :return: total number of enriched items/events uploaded to Elasticsearch
         """
 
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        total = 0
-        bulk_json = ""
-
-        items = ocean_backend.fetch()
+        tracker = self.get_checkpoint_tracker(ocean_backend, events=events)
+        items = self.fetch_items(ocean_backend, tracker)
 
-        url = self.elastic.get_bulk_url()
+        writer = self.elastic.get_bulk_writer()
 
-        logger.debug("Adding items to {} (in {} packs)".format(anonymize_url(url), max_items))
+        logger.debug("Adding items to {} (in packs of {} items, {:.2f} MB)".format(
+                     anonymize_url(writer.url), writer.max_items, writer.max_bytes / (1024 * 1024)))
 
         if events:
             logger.debug("Adding events items")
 
-        for item in items:
-            if current >= max_items:
-                try:
-                    total += self.elastic.safe_put_bulk(url, bulk_json)
-                    json_size = sys.getsizeof(bulk_json) / (1024 * 1024)
-                    logger.debug("Added {} items to {} ({:.2f} MB)".format(total, anonymize_url(url), json_size))
-                except UnicodeEncodeError:
-                    # Why is requests encoding the POST data as ascii?
-                    logger.error("Unicode error in enriched items")
-                    logger.debug(bulk_json)
-                    safe_json = str(bulk_json.encode('ascii', 'ignore'), 'ascii')
-                    total += self.elastic.safe_put_bulk(url, safe_json)
-                bulk_json = ""
-                current = 0
-
-            if not events:
-                rich_item = self.get_rich_item(item)
-                data_json = json.dumps(rich_item)
-                bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                    (item[self.get_field_unique_id()])
-                bulk_json += data_json + "\n"  # Bulk document
-                current += 1
-            else:
-                rich_events = self.get_rich_events(item)
-                for rich_event in rich_events:
-                    data_json = json.dumps(rich_event)
-                    bulk_json += '{"index" : {"_id" : "%s_%s" } }\n' % \
-                        (item[self.get_field_unique_id()],
-                         rich_event[self.get_field_event_unique_id()])
-                    bulk_json += data_json + "\n"  # Bulk document
-                    current += 1
+        try:
+            with writer:
+                for item in items:
+                    if not events:
+                        rich_item = self.get_rich_item(item)
+                        writer.add(item[self.get_field_unique_id()], rich_item)
+                    else:
+                        rich_events = self.get_rich_events(item)
+                        for rich_event in rich_events:
+                            writer.add("%s_%s" % (item[self.get_field_unique_id()],
+                                                  rich_event[self.get_field_event_unique_id()]),
+                                       rich_event)
+                    if tracker:
+                        tracker.item_done(item, writer)
+        except Exception:
+            if tracker:
+                tracker.save(writer)
+            raise
+
+        if tracker:
+            tracker.finish()
+
+        if writer.retried or writer.failed:
+            logger.warning("{} items sent again and {} items dropped when adding items to {}".format(
+                           writer.retried, writer.failed, anonymize_url(writer.url)))
+
+        return writer.total
+
+    def get_checkpoint_tracker(self, ocean_backend, events=False):
+        """Get the tracker of the checkpoints of the enrichment of the items
+        read from `ocean_backend`, if `checkpoint_path` is set.
+
+        The checkpoints are kept by enriched index and raw items read (index,
+        repository and raw filter), so the enrichment of each repository
+        is resumed on its own.
+
+        :param ocean_backend: Ocean backend object to fetch the items from
+        :param events: enrich items or enrich events
+        :returns: a `CheckpointTracker` or None
+        """
+        if not self.checkpoint_path:
+            return None
+
+        origin = ocean_backend.perceval_backend.origin if ocean_backend.perceval_backend else None
+        key = " ".join([anonymize_url(self.elastic.index_url),
+                        anonymize_url(ocean_backend.elastic.index_url),
+                        str(origin), str(ocean_backend.filter_raw),
+                        "events" if events else "items"])
 
-        if current > 0:
-            total += self.elastic.safe_put_bulk(url, bulk_json)
+        return CheckpointTracker(EnrichCheckpoints(self.checkpoint_path), key, self.gelk_version,
+                                 ocean_backend.get_item_position, interval=self.checkpoint_interval)
 
-        return total
+    @staticmethod
+    def fetch_items(ocean_backend, tracker=None):
+        """Fetch the raw items to enrich. When the checkpoints are tracked, the
+        items are read in a stable order after the last checkpoint, if any.
+
+        :param ocean_backend: Ocean backend object to fetch the items from
+        :param tracker: `CheckpointTracker` of the enrichment or None
+        """
+        if not tracker:
+            return ocean_backend.fetch()
+
+        return ocean_backend.fetch_resumable(search_after=tracker.position)
 
     def add_repository_labels(self, eitem):
         """Add labels to the enriched item"""
@@ -1017,7 +1064,8 @@ class Enrich(ElasticItems):
 
         # Creating connections
         es = ES([enrich_backend.elastic.url], retry_on_timeout=True, timeout=100,
-                verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection)
+                verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection,
+                serializer=CodecSerializer())
 
         in_conn = ESOnionConnector(es_conn=es, es_index=in_index,
                                    contribs_field=contribs_field,
@@ -1055,9 +1103,13 @@ class Enrich(ElasticItems):
         else:
             filename = pkg_resources.resource_filename('grimoire_elk', 'enriched/mappings/onion.json')
 
-        out_conn.create_index(filename, delete=out_conn.exists())
+        out_conn.create_index(filename, delete=out_conn.exists(), bulk_load=self.elastic.bulk_load)
 
-        onion_study(in_conn=in_conn, out_conn=out_conn, data_source=data_source)
+        try:
+            onion_study(in_conn=in_conn, out_conn=out_conn, data_source=data_source)
+        finally:
+            out_conn.end_bulk_load(force_merge=self.elastic.bulk_load_force_merge,
+                                   timeout=self.elastic.bulk_load_timeout)
 
         # Create alias if output index exists (index is always created from scratch, so
         # alias need to be created each time)
@@ -1361,7 +1413,8 @@ class Enrich(ElasticItems):
         logger.info("{} starting study {}".format(log_prefix, anonymize_url(self.elastic.index_url)))
 
         es_in = ES([enrich_backend.elastic_url], retry_on_timeout=True, timeout=100,
-                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection)
+                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection,
+                   serializer=CodecSerializer())
         in_index = enrich_backend.elastic.index
 
         query_locations_no_geo_points = """
@@ -1465,7 +1518,8 @@ class Enrich(ElasticItems):
         logger.info("[enrich-forecast-activity] Start study")
 
         es_in = ES([enrich_backend.elastic_url], retry_on_timeout=True, timeout=100,
-                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection)
+                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection,
+                   serializer=CodecSerializer())
         in_index = enrich_backend.elastic.index
 
         unique_repos = es_in.search(
@@ -1477,98 +1531,102 @@ class Enrich(ElasticItems):
 
         logger.info("[enrich-forecast-activity] {} repositories to process".format(len(repositories)))
         es_out = ElasticSearch(enrich_backend.elastic.url, out_index)
-        es_out.add_alias("forecast_activity_study")
-
-        num_items = 0
-        ins_items = 0
-
-        survided_authors = []
-        # iterate over the repositories
-        for repository_url in repositories:
-            logger.debug("[enrich-forecast-activity] Start analysis for {}".format(repository_url))
-            from_month = get_to_date(es_in, in_index, out_index, repository_url, interval_months)
-            to_month = from_month.replace(month=int(interval_months), day=1, hour=0, minute=0, second=0)
-
-            # analyse the repository on a given time frame
-            while to_month < current_month:
-
-                from_month_iso = from_month.isoformat()
-                to_month_iso = to_month.isoformat()
-
-                # get authors
-                authors = es_in.search(
-                    index=in_index,
-                    body=self.authors_between_dates(repository_url, from_month_iso, to_month_iso,
-                                                    date_field=date_field)
-                )['aggregations']['authors'].get("buckets", [])
-
-                # get author activity
-                for author in authors:
-                    author_uuid = author['key']
-                    activities = es_in.search(index=in_index,
-                                              body=self.author_activity(repository_url, from_month_iso, to_month_iso,
-                                                                        author_uuid, date_field=date_field)
-                                              )['hits']['hits']
-
-                    dates = [str_to_datetime(a['_source'][date_field]) for a in activities]
-                    durations = self.dates_to_duration(dates, window_size=observations)
-
-                    if len(durations) < observations:
-                        continue
+        # The bulk-load mode of the index is ended even if the study fails
+        try:
+            es_out.add_alias("forecast_activity_study")
+
+            num_items = 0
+            ins_items = 0
 
-                    repository_name = repository_url.split("/")[-1]
-                    author_name = activities[0]['_source'].get('author_name', None)
-                    author_user_name = activities[0]['_source'].get('author_user_name', None)
-                    author_org_name = activities[0]['_source'].get('author_org_name', None)
-                    author_domain = activities[0]['_source'].get('author_domain', None)
-                    author_bot = activities[0]['_source'].get('author_bot', None)
+            survided_authors = []
+            # iterate over the repositories
+            for repository_url in repositories:
+                logger.debug("[enrich-forecast-activity] Start analysis for {}".format(repository_url))
+                from_month = get_to_date(es_in, in_index, out_index, repository_url, interval_months)
+                to_month = from_month.replace(month=int(interval_months), day=1, hour=0, minute=0, second=0)
+
+                # analyse the repository on a given time frame
+                while to_month < current_month:
+
+                    from_month_iso = from_month.isoformat()
                     to_month_iso = to_month.isoformat()
-                    survided_author = {
-                        "uuid": "{}_{}_{}_{}".format(to_month_iso, repository_name, interval_months, author_uuid),
-                        "origin": repository_url,
-                        "repository": repository_name,
-                        "interval_months": interval_months,
-                        "from_date": from_month_iso,
-                        "to_date": to_month_iso,
-                        "study_creation_date": from_month_iso,
-                        "author_uuid": author_uuid,
-                        "author_name": author_name,
-                        "author_bot": author_bot,
-                        "author_user_name": author_user_name,
-                        "author_org_name": author_org_name,
-                        "author_domain": author_domain,
-                        'metadata__gelk_version': self.gelk_version,
-                        'metadata__gelk_backend_name': self.__class__.__name__,
-                        'metadata__enriched_on': datetime_utcnow().isoformat()
-                    }
 
-                    survided_author.update(self.get_grimoire_fields(survided_author["study_creation_date"], "survived"))
+                    # get authors
+                    authors = es_in.search(
+                        index=in_index,
+                        body=self.authors_between_dates(repository_url, from_month_iso, to_month_iso,
+                                                        date_field=date_field)
+                    )['aggregations']['authors'].get("buckets", [])
+
+                    # get author activity
+                    for author in authors:
+                        author_uuid = author['key']
+                        activities = es_in.search(index=in_index,
+                                                  body=self.author_activity(repository_url, from_month_iso, to_month_iso,
+                                                                            author_uuid, date_field=date_field)
+                                                  )['hits']['hits']
+
+                        dates = [str_to_datetime(a['_source'][date_field]) for a in activities]
+                        durations = self.dates_to_duration(dates, window_size=observations)
+
+                        if len(durations) < observations:
+                            continue
+
+                        repository_name = repository_url.split("/")[-1]
+                        author_name = activities[0]['_source'].get('author_name', None)
+                        author_user_name = activities[0]['_source'].get('author_user_name', None)
+                        author_org_name = activities[0]['_source'].get('author_org_name', None)
+                        author_domain = activities[0]['_source'].get('author_domain', None)
+                        author_bot = activities[0]['_source'].get('author_bot', None)
+                        to_month_iso = to_month.isoformat()
+                        survided_author = {
+                            "uuid": "{}_{}_{}_{}".format(to_month_iso, repository_name, interval_months, author_uuid),
+                            "origin": repository_url,
+                            "repository": repository_name,
+                            "interval_months": interval_months,
+                            "from_date": from_month_iso,
+                            "to_date": to_month_iso,
+                            "study_creation_date": from_month_iso,
+                            "author_uuid": author_uuid,
+                            "author_name": author_name,
+                            "author_bot": author_bot,
+                            "author_user_name": author_user_name,
+                            "author_org_name": author_org_name,
+                            "author_domain": author_domain,
+                            'metadata__gelk_version': self.gelk_version,
+                            'metadata__gelk_backend_name': self.__class__.__name__,
+                            'metadata__enriched_on': datetime_utcnow().isoformat()
+                        }
+
+                        survided_author.update(self.get_grimoire_fields(survided_author["study_creation_date"], "survived"))
 
-                    last_activity = dates[-1]
-                    surv = SurvfuncRight(durations, [1] * len(durations))
-                    for prob in probabilities:
-                        pred = surv.quantile(float(prob))
-                        pred_field = "prediction_{}".format(str(prob).replace('.', ''))
+                        last_activity = dates[-1]
+                        surv = SurvfuncRight(durations, [1] * len(durations))
+                        for prob in probabilities:
+                            pred = surv.quantile(float(prob))
+                            pred_field = "prediction_{}".format(str(prob).replace('.', ''))
 
-                        survided_author[pred_field] = int(pred)
-                        next_activity_field = "next_activity_{}".format(str(prob).replace('.', ''))
-                        survided_author[next_activity_field] = (last_activity + timedelta(days=int(pred))).isoformat()
+                            survided_author[pred_field] = int(pred)
+                            next_activity_field = "next_activity_{}".format(str(prob).replace('.', ''))
+                            survided_author[next_activity_field] = (last_activity + timedelta(days=int(pred))).isoformat()
 
-                    survided_authors.append(survided_author)
+                        survided_authors.append(survided_author)
 
-                    if len(survided_authors) >= self.elastic.max_items_bulk:
-                        num_items += len(survided_authors)
-                        ins_items += es_out.bulk_upload(survided_authors, self.get_field_unique_id())
-                        survided_authors = []
+                        if len(survided_authors) >= self.elastic.max_items_bulk:
+                            num_items += len(survided_authors)
+                            ins_items += es_out.bulk_upload(survided_authors, self.get_field_unique_id())
+                            survided_authors = []
 
-                from_month = to_month
-                to_month = to_month + relativedelta(months=+interval_months)
+                    from_month = to_month
+                    to_month = to_month + relativedelta(months=+interval_months)
 
-                logger.debug("[enrich-forecast-activity] End analysis for {}".format(repository_url))
+                    logger.debug("[enrich-forecast-activity] End analysis for {}".format(repository_url))
 
-        if len(survided_authors) > 0:
-            num_items += len(survided_authors)
-            ins_items += es_out.bulk_upload(survided_authors, self.get_field_unique_id())
+            if len(survided_authors) > 0:
+                num_items += len(survided_authors)
+                ins_items += es_out.bulk_upload(survided_authors, self.get_field_unique_id())
+        finally:
+            es_out.end_bulk_load()
 
         logger.info("[enrich-forecast-activity] End study")
 
@@ -1719,7 +1777,7 @@ class Enrich(ElasticItems):
 
         es_query = Enrich.fetch_contribution_types()
         r = self.requests.post(self.elastic.index_url + "/_search",
-                               data=es_query, headers=HEADER_JSON,
+                               data=json.dumps(es_query), headers=HEADER_JSON,
                                verify=False)
         try:
             r.raise_for_status()
@@ -1787,6 +1845,9 @@ class Enrich(ElasticItems):
         :param contribution_type: name of the contribution type (if any) which the dates are computed for.
             In case there is no specific contribution type, by default all contributions will be considered.
         """
+        # The items just enriched must be visible to compute the authors' dates
+        self.elastic.refresh_if_needed()
+
         # The first step is to find the current min and max date for all the authors
         authors_min_max_data = {}
 
@@ -1794,7 +1855,7 @@ class Enrich(ElasticItems):
                                                 author_field=author_field,
                                                 contribution_type=contribution_type)
         r = self.requests.post(self.elastic.index_url + "/_search",
-                               data=es_query, headers=HEADER_JSON,
+                               data=json.dumps(es_query), headers=HEADER_JSON,
                                verify=False)
         try:
             r.raise_for_status()
@@ -1812,8 +1873,10 @@ class Enrich(ElasticItems):
             author_max_date = authors_min_max_data[author_key]['max']['value_as_string']
 
             field_name = contribution_type if contribution_type else 'demography'
-            es_update = Enrich.update_author_min_max_date(author_min_date, author_max_date,
-                                                          author_key, field_name, author_field=author_field)
+            # Serialized once, the same body is sent again on version conflicts
+            es_update = json.dumps(Enrich.update_author_min_max_date(author_min_date, author_max_date,
+                                                                     author_key, field_name,
+                                                                     author_field=author_field))
 
             try:
                 r = self.requests.post(
@@ -1879,59 +1942,22 @@ class Enrich(ElasticItems):
 
         # Limit aggregations: https://github.com/elastic/elasticsearch/issues/18838
         # 30000 seems to be a sensible number of the number of people in git
-        query_type = ""
+        query = None
         if contribution_type:
-            query_type = """"query": {
-            "bool" : {
-              "must" : {
-                "term" : {
-                  "type" : "%s"
-                }
-              }
-            }
-          },""" % contribution_type
-        es_query = """
-        {
-          "size": 0,
-          %s
-          "aggs": {
-            "author": {
-              "terms": {
-                "field": "%s",
-                "size": 30000
-              },
-              "aggs": {
-                "min": {
-                  "min": {
-                    "field": "%s"
-                  }
-                },
-                "max": {
-                  "max": {
-                    "field": "%s"
-                  }
-                }
-              }
-            }
-          }
+            query = esq.bool_(must=esq.term("type", contribution_type))
+
+        aggs = {
+            "author": esq.terms_agg(author_field, size=30000, aggs={
+                "min": esq.min_(date_field),
+                "max": esq.max_(date_field)
+            })
         }
-        """ % (query_type, author_field, date_field, date_field)
 
-        return es_query
+        return esq.search(query=query, size=0, aggs=aggs)
 
     @staticmethod
     def fetch_contribution_types():
-        query = '''
-        {
-            "size":"0",
-            "aggs" : {
-                "uniq_gender" : {
-                    "terms" : { "field" : "type" }
-                }
-            }
-        }
-        '''
-        return query
+        return esq.search(size=0, aggs={"uniq_gender": esq.terms_agg("type")})
 
     @staticmethod
     def update_author_min_max_date(min_date, max_date, target_author, field, author_field="author_uuid"):
@@ -1946,27 +1972,12 @@ class Enrich(ElasticItems):
 
         :return: the query to be executed to update demography data of an author
         """
+        painless_code = "ctx._source.{0}_min_date = params.min_date;ctx._source.{0}_max_date = params.max_date;"
 
-        es_query = '''
-        {
-          "script": {
-            "source":
-            "ctx._source.%s_min_date = params.min_date;ctx._source.%s_max_date = params.max_date;",
-            "lang": "painless",
-            "params": {
-                "min_date": "%s",
-                "max_date": "%s"
-            }
-          },
-          "query": {
-            "term": {
-              "%s": "%s"
-            }
-          }
+        return {
+            "script": esq.script(painless_code.format(field), params={"min_date": min_date, "max_date": max_date}),
+            "query": esq.term(author_field, target_author)
         }
-        ''' % (field, field, min_date, max_date, author_field, target_author)
-
-        return es_query
 
     def enrich_feelings(self, ocean_backend, enrich_backend, attributes, nlp_rest_url,
                         no_incremental=False, uuid_field='id', date_field="grimoire_creation_date"):
@@ -2026,7 +2037,8 @@ class Enrich(ElasticItems):
         logger.info("[enrich-feelings] Start study on {} with data from {}".format(
             anonymize_url(self.elastic.index_url), nlp_rest_url))
 
-        es = ES([self.elastic_url], timeout=3600, max_retries=50, retry_on_timeout=True, verify_certs=False)
+        es = ES([self.elastic_url], timeout=3600, max_retries=50, retry_on_timeout=True, verify_certs=False,
+                serializer=CodecSerializer())
         search_fields = [attr for attr in attributes]
         search_fields.extend([uuid_field])
         page = es.search(index=enrich_backend.elastic.index,
@@ -24,7 +24,6 @@
 import json
 import logging
 import re
-import sys
 
 import pkg_resources
 import requests
@@ -38,6 +37,7 @@ from perceval.backends.core.git import (GitCommand,
                                         EmptyRepositoryError,
                                         RepositoryError)
 from .enrich import Enrich, metadata
+from .ceres_base import CodecSerializer
 from .study_ceres_aoc import areas_of_code, ESPandasConnector
 from ..elastic_mapping import Mapping as BaseMapping
 from ..elastic_items import HEADER_JSON, MAX_BULK_UPDATE_SIZE
@@ -46,6 +46,8 @@ from .utils import anonymize_url
 GITHUB = 'https://github.com/'
 DEMOGRAPHY_COMMIT_MIN_DATE = '1980-01-01'
 AREAS_OF_CODE_ALIAS = 'git_areas_of_code'
+# Raw fields read when only the hashes of the commits are needed
+COMMIT_SOURCE = {"includes": ["data.commit"]}
 logger = logging.getLogger(__name__)
 
 
@@ -414,107 +416,90 @@ class GitEnrich(Enrich):
             "message": "Enable users to pass flags\n\nCo-authored-by: mariiapunda <mariiapunda@users.noreply.github.com>",
         Co-authored commits like these are not considered as multiauthored commits in ELK.
         """
-        headers = {"Content-Type": "application/json"}
-
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        total = 0
-        bulk_json = ""
-
         total_signed_off = 0
         total_multi_author = 0
 
-        url = self.elastic.get_bulk_url()
-
-        logger.debug("[git] Adding items to {} (in {} packs)".format(anonymize_url(url), max_items))
-        items = ocean_backend.fetch()
-
-        for item in items:
-            if self.pair_programming:
-                # First we need to add the authors field to all commits
-                # Check multi author
-                m = self.AUTHOR_P2P_REGEX.match(item['data']['Author'])
-                n = self.AUTHOR_P2P_NEW_REGEX.match(item['data']['Author'])
-                if m or n:
-                    logger.debug("[git] Multiauthor detected. Creating one commit "
-                                 "per author: {}".format(item['data']['Author']))
-                    item['data']['authors'] = self.__get_authors(item['data']['Author'])
-                    item['data']['Author'] = item['data']['authors'][0]
-                m = self.AUTHOR_P2P_REGEX.match(item['data']['Commit'])
-                n = self.AUTHOR_P2P_NEW_REGEX.match(item['data']['Author'])
-                if m or n:
-                    logger.debug("[git] Multicommitter detected: using just the first committer")
-                    item['data']['committers'] = self.__get_authors(item['data']['Commit'])
-                    item['data']['Commit'] = item['data']['committers'][0]
-                # Add the authors list using the original Author and the Signed-off list
-                if 'Signed-off-by' in item['data']:
-                    authors_all = item['data']['Signed-off-by'] + [item['data']['Author']]
-                    item['data']['authors_signed_off'] = list(set(authors_all))
-
-            if current >= max_items:
-                try:
-                    total += self.elastic.safe_put_bulk(url, bulk_json)
-                    json_size = sys.getsizeof(bulk_json) / (1024 * 1024)
-                    logger.debug("[git] Added {} items to {} ({:.2f} MB)".format(
-                                 total, anonymize_url(url), json_size))
-                except UnicodeEncodeError:
-                    # Why is requests encoding the POST data as ascii?
-                    logger.warning("[git] Unicode error in enriched items, converting to ascii")
-                    safe_json = str(bulk_json.encode('ascii', 'ignore'), 'ascii')
-                    total += self.elastic.safe_put_bulk(url, safe_json)
-                bulk_json = ""
-                current = 0
-
-            rich_item = self.get_rich_item(item)
-            data_json = json.dumps(rich_item)
-            unique_field = self.get_field_unique_id()
-            bulk_json += '{"index" : {"_id" : "%s" } }\n' % (rich_item[unique_field])
-            bulk_json += data_json + "\n"  # Bulk document
-            current += 1
-
-            if self.pair_programming:
-                # Multi author support
-                if 'authors' in item['data']:
-                    # First author already added in the above commit
-                    authors = item['data']['authors']
-                    for i in range(1, len(authors)):
-                        # logger.debug('Adding a new commit for %s', authors[i])
-                        item['data']['Author'] = authors[i]
-                        item['data']['is_git_commit_multi_author'] = 1
-                        rich_item = self.get_rich_item(item)
-                        item['data']['is_git_commit_multi_author'] = 1
-                        data_json = json.dumps(rich_item)
-                        commit_id = item["uuid"] + "_" + str(i - 1)
-                        rich_item['git_uuid'] = commit_id
-                        bulk_json += '{"index" : {"_id" : "%s" } }\n' % rich_item['git_uuid']
-                        bulk_json += data_json + "\n"  # Bulk document
-                        current += 1
-                        total_multi_author += 1
-
-                if rich_item['Signed-off-by_number'] > 0:
-                    nsg = 0
-                    # Remove duplicates and the already added Author if exists
-                    authors = list(set(item['data']['Signed-off-by']))
-                    if item['data']['Author'] in authors:
-                        authors.remove(item['data']['Author'])
-                    for author in authors:
-                        # logger.debug('Adding a new commit for %s', author)
-                        # Change the Author in the original commit and generate
-                        # a new enriched item with it
-                        item['data']['Author'] = author
-                        item['data']['is_git_commit_signed_off'] = 1
-                        rich_item = self.get_rich_item(item)
-                        commit_id = item["uuid"] + "_" + str(nsg)
-                        rich_item['git_uuid'] = commit_id
-                        data_json = json.dumps(rich_item)
-                        bulk_json += '{"index" : {"_id" : "%s" } }\n' % rich_item['git_uuid']
-                        bulk_json += data_json + "\n"  # Bulk document
-                        current += 1
-                        total_signed_off += 1
-                        nsg += 1
-
-        if current > 0:
-            total += self.elastic.safe_put_bulk(url, bulk_json)
+        writer = self.elastic.get_bulk_writer()
+
+        logger.debug("[git] Adding items to {} (in packs of {} items, {:.2f} MB)".format(
+                     anonymize_url(writer.url), writer.max_items, writer.max_bytes / (1024 * 1024)))
+        tracker = self.get_checkpoint_tracker(ocean_backend, events=events)
+        items = self.fetch_items(ocean_backend, tracker)
+
+        try:
+            with writer:
+                for item in items:
+                    if self.pair_programming:
+                        # First we need to add the authors field to all commits
+                        # Check multi author
+                        m = self.AUTHOR_P2P_REGEX.match(item['data']['Author'])
+                        n = self.AUTHOR_P2P_NEW_REGEX.match(item['data']['Author'])
+                        if m or n:
+                            logger.debug("[git] Multiauthor detected. Creating one commit "
+                                         "per author: {}".format(item['data']['Author']))
+                            item['data']['authors'] = self.__get_authors(item['data']['Author'])
+                            item['data']['Author'] = item['data']['authors'][0]
+                        m = self.AUTHOR_P2P_REGEX.match(item['data']['Commit'])
+                        n = self.AUTHOR_P2P_NEW_REGEX.match(item['data']['Author'])
+                        if m or n:
+                            logger.debug("[git] Multicommitter detected: using just the first committer")
+                            item['data']['committers'] = self.__get_authors(item['data']['Commit'])
+                            item['data']['Commit'] = item['data']['committers'][0]
+                        # Add the authors list using the original Author and the Signed-off list
+                        if 'Signed-off-by' in item['data']:
+                            authors_all = item['data']['Signed-off-by'] + [item['data']['Author']]
+                            item['data']['authors_signed_off'] = list(set(authors_all))
+
+                    rich_item = self.get_rich_item(item)
+                    unique_field = self.get_field_unique_id()
+                    writer.add(rich_item[unique_field], rich_item)
+
+                    if self.pair_programming:
+                        # Multi author support
+                        if 'authors' in item['data']:
+                            # First author already added in the above commit
+                            authors = item['data']['authors']
+                            for i in range(1, len(authors)):
+                                # logger.debug('Adding a new commit for %s', authors[i])
+                                item['data']['Author'] = authors[i]
+                                item['data']['is_git_commit_multi_author'] = 1
+                                rich_item = self.get_rich_item(item)
+                                item['data']['is_git_commit_multi_author'] = 1
+                                commit_id = item["uuid"] + "_" + str(i - 1)
+                                writer.add(commit_id, rich_item)
+                                rich_item['git_uuid'] = commit_id
+                                total_multi_author += 1
+
+                        if rich_item['Signed-off-by_number'] > 0:
+                            nsg = 0
+                            # Remove duplicates and the already added Author if exists
+                            authors = list(set(item['data']['Signed-off-by']))
+                            if item['data']['Author'] in authors:
+                                authors.remove(item['data']['Author'])
+                            for author in authors:
+                                # logger.debug('Adding a new commit for %s', author)
+                                # Change the Author in the original commit and generate
+                                # a new enriched item with it
+                                item['data']['Author'] = author
+                                item['data']['is_git_commit_signed_off'] = 1
+                                rich_item = self.get_rich_item(item)
+                                commit_id = item["uuid"] + "_" + str(nsg)
+                                rich_item['git_uuid'] = commit_id
+                                writer.add(rich_item['git_uuid'], rich_item)
+                                total_signed_off += 1
+                                nsg += 1
+
+                    if tracker:
+                        tracker.item_done(item, writer)
+        except Exception:
+            if tracker:
+                tracker.save(writer)
+            raise
+
+        if tracker:
+            tracker.finish()
+
+        total = writer.total
 
         if total == 0:
             # No items enriched, nothing to upload to ES
@@ -543,11 +528,14 @@ class GitEnrich(Enrich):
         # Creating connections
         es_in = Elasticsearch([ocean_backend.elastic.url], retry_on_timeout=True, timeout=100,
                               verify_certs=self.elastic.requests.verify,
-                              connection_class=RequestsHttpConnection)
+                              connection_class=RequestsHttpConnection,
+                              serializer=CodecSerializer())
         es_out = Elasticsearch([enrich_backend.elastic.url], retry_on_timeout=True,
                                timeout=100, verify_certs=self.elastic.requests.verify,
-                               connection_class=RequestsHttpConnection)
-        in_conn = ESPandasConnector(es_conn=es_in, es_index=in_index, sort_on_field=sort_on_field)
+                               connection_class=RequestsHttpConnection,
+                               serializer=CodecSerializer())
+        in_conn = ESPandasConnector(es_conn=es_in, es_index=in_index, sort_on_field=sort_on_field,
+                                    page_sizer=self.get_page_sizer())
         out_conn = ESPandasConnector(es_conn=es_out, es_index=out_index, sort_on_field=sort_on_field, read_only=False)
 
         exists_index = out_conn.exists()
@@ -559,7 +547,7 @@ class GitEnrich(Enrich):
                 filename = pkg_resources.resource_filename('grimoire_elk', 'enriched/mappings/git_aoc_es7.json')
             else:
                 filename = pkg_resources.resource_filename('grimoire_elk', 'enriched/mappings/git_aoc.json')
-            out_conn.create_index(filename, delete=exists_index)
+            out_conn.create_index(filename, delete=exists_index, bulk_load=self.elastic.bulk_load)
 
         repos = []
         for source in self.json_projects.values():
@@ -567,17 +555,21 @@ class GitEnrich(Enrich):
             if items:
                 repos.extend(items)
 
-        for repo in repos:
-            anonymize_repo = anonymize_url(repo)
-            repo_name = anonymize_repo.split()[0]
-            logger.info("{} Processing repo: {}".format(log_prefix, repo_name))
-            in_conn.update_repo(repo_name)
-            out_conn.update_repo(repo_name)
-            areas_of_code(git_enrich=enrich_backend, in_conn=in_conn, out_conn=out_conn)
-
-            # delete the documents in the AOC index which correspond to commits that don't exist in the raw index
-            if out_conn.exists():
-                self.update_items_aoc(ocean_backend, es_out, out_index, repo_name)
+        try:
+            for repo in repos:
+                anonymize_repo = anonymize_url(repo)
+                repo_name = anonymize_repo.split()[0]
+                logger.info("{} Processing repo: {}".format(log_prefix, repo_name))
+                in_conn.update_repo(repo_name)
+                out_conn.update_repo(repo_name)
+                areas_of_code(git_enrich=enrich_backend, in_conn=in_conn, out_conn=out_conn)
+
+                # delete the documents in the AOC index which correspond to commits that don't exist in the raw index
+                if out_conn.exists():
+                    self.update_items_aoc(ocean_backend, es_out, out_index, repo_name)
+        finally:
+            out_conn.end_bulk_load(force_merge=self.elastic.bulk_load_force_merge,
+                                   timeout=self.elastic.bulk_load_timeout)
 
         # Create alias if output index exists and alias does not
         if out_conn.exists():
@@ -686,7 +678,8 @@ class GitEnrich(Enrich):
         }
 
         raw_hashes = set([item['data']['commit']
-                          for item in ocean_backend.fetch(ignore_incremental=True, _filter=fltr)])
+                          for item in ocean_backend.fetch(ignore_incremental=True, _filter=fltr,
+                                                          _source=COMMIT_SOURCE)])
         aoc_hashes = set(self.get_unique_hashes_aoc(es_aoc, index_aoc, repository))
 
         hashes_to_delete = list(aoc_hashes.difference(raw_hashes))
@@ -770,7 +763,8 @@ class GitEnrich(Enrich):
 
         current_hashes = set(current_hashes)
         raw_hashes = set([item['data']['commit']
-                          for item in ocean_backend.fetch(ignore_incremental=True, _filter=fltr)])
+                          for item in ocean_backend.fetch(ignore_incremental=True, _filter=fltr,
+                                                          _source=COMMIT_SOURCE)])
 
         hashes_to_delete = list(raw_hashes.difference(current_hashes))
 
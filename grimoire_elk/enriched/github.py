@@ -21,6 +21,7 @@
 #   Miguel Ángel Fernández <mafesan@bitergia.com>
 #
 
+import json
 import logging
 import re
 import time
@@ -38,8 +39,10 @@ from elasticsearch import Elasticsearch as ES, RequestsHttpConnection
 
 from .utils import get_time_diff_days
 
+from .ceres_base import CodecSerializer
 from .enrich import Enrich, metadata, anonymize_url
 from ..elastic_mapping import Mapping as BaseMapping
+from .. import query as esq
 
 from .github_study_evolution import (get_unique_repository_with_project_name,
                                      get_issues_dates,
@@ -100,6 +103,13 @@ class GitHubEnrich(Enrich):
     pr_roles = ['merged_by_data', 'user_data']
     roles = ['assignee_data', 'merged_by_data', 'user_data']
 
+    # Only the login, name, email, company and location of the users are used
+    RAW_SOURCE = {
+        "excludes": ["data.%s.%s" % (role, field)
+                     for role in roles
+                     for field in ["*_url", "bio", "blog", "organizations"]]
+    }
+
     def __init__(self, db_sortinghat=None, db_projects_map=None, json_projects_map=None,
                  db_user='', db_password='', db_host=''):
         super().__init__(db_sortinghat, db_projects_map, json_projects_map,
@@ -335,6 +345,9 @@ class GitHubEnrich(Enrich):
         error_msg = "Invalid index provided for enrich_pull_requests study. Aborting."
         make_request(issues_index_search_url, error_msg)
 
+        # The pull requests just enriched must be visible to be counted and searched
+        self.elastic.refresh_if_needed()
+
         # get the number of pull requests in the pull_requests index
         # https://www.elastic.co/guide/en/elasticsearch/reference/current/cat-count.html
         # Example:
@@ -351,13 +364,7 @@ class GitHubEnrich(Enrich):
         size = 10000  # Default number of items that can be queried from elasticsearch at a time
         i = 0  # counter
         while num_pull_requests > 0:
-            fetch_id_in_repo_query = """
-            {
-                "_source": ["id_in_repo"],
-                "from": %s,
-                "size": %s
-            }
-            """ % (i, size)
+            fetch_id_in_repo_query = json.dumps(esq.search(size=size, source=["id_in_repo"], **{"from": i}))
 
             error_msg = "Error extracting id_in_repo from {}. Aborting.".format(self.elastic.index_url)
             r = make_request(enrich_index_search_url, error_msg, fetch_id_in_repo_query, "POST")
@@ -368,31 +375,21 @@ class GitHubEnrich(Enrich):
 
         # get pull requests data from the github_issues_raw and pull_requests only
         # index using specific id for each of the item
-        query = """
-        {
-            "query": {
-                "bool": {
-                    "must": [{
-                                "match": {
-                                    %s: %s
-                                }
-                            }]
-                        }
-                    }
-            }
-        """
+        def query(field, value):
+            return json.dumps(esq.search(query=esq.bool_(must=[esq.match(field, value)])))
+
         num_enriched = 0  # counter to count the number of PRs enriched
         pull_requests = []
 
         for pr_id in pull_requests_ids:
             # retrieve the data from the issues index
-            issue_query = query % ('"data.number"', pr_id)
+            issue_query = query("data.number", pr_id)
             error_msg = "Id {} doesnot exists in {}. Aborting.".format(pr_id, github_issues_raw_index)
             r = make_request(issues_index_search_url, error_msg, issue_query, "POST")
             issue = r.json()["hits"]["hits"][0]["_source"]["data"]
 
             # retrieve the data from the pull_requests index
-            pr_query = query % ('"id_in_repo"', pr_id)
+            pr_query = query("id_in_repo", pr_id)
             error_msg = "Id {} doesnot exists in {}. Aborting.".format(pr_id, self.elastic.index_url)
             r = make_request(enrich_index_search_url, error_msg, pr_query, "POST")
             pull_request_data = r.json()["hits"]["hits"][0]
@@ -743,7 +740,8 @@ class GitHubEnrich(Enrich):
 
         # connect to ES
         es_in = ES([enrich_backend.elastic_url], retry_on_timeout=True, timeout=100,
-                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection)
+                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection,
+                   serializer=CodecSerializer())
         in_index = enrich_backend.elastic.index
 
         # get all repositories
@@ -756,77 +754,81 @@ class GitHubEnrich(Enrich):
 
         # create the index
         es_out = ElasticSearch(enrich_backend.elastic.url, out_index, mappings=Mapping)
-        es_out.add_alias("backlog_study")
-
-        # analysis for each repositories
-        num_items = 0
-        ins_items = 0
-        for repository in repositories:
-            repository_url = repository["origin"]
-            project = repository["project"]
-            org_name = repository["organization"]
-            repository_name = repository_url.split("/")[-1]
-
-            logger.debug("[enrich-backlog-analysis] Start analysis for {}".format(repository_url))
-
-            # get each day since repository creation
-            dates = es_in.search(
-                index=in_index,
-                body=get_issues_dates(interval_days, repository_url)
-            )['aggregations']['created_per_interval'].get("buckets", [])
-
-            # for each selected label + others labels
-            for label, other in [("", True)] + [(label, False) for label in reduced_labels]:
-                # compute metrics for each day (ES request for each day)
-                evolution_items = []
-                for date in map(lambda i: i['key_as_string'], dates):
-                    evolution_item = self.__create_backlog_item(
-                        repository_url, repository_name, project, date, org_name, interval_days, label, map_label,
-                        self.__get_opened_issues(es_in, in_index, repository_url, date, interval_days,
-                                                 other, label, reduced_labels)
-                    )
-                    evolution_items.append(evolution_item)
-
-                # complete until today (no ES request needed, just extrapol)
-                today = datetime.now().replace(hour=0, minute=0, second=0, tzinfo=None)
-                last_item = evolution_item
-                last_date = str_to_datetime(
-                    evolution_item['study_creation_date']).replace(tzinfo=None) \
-                    + relativedelta(days=interval_days)
-                average_opened_time = evolution_item['average_opened_time'] \
-                    + float(interval_days)
-                while last_date < today:
-                    date = last_date.strftime('%Y-%m-%dT%H:%M:%S.000Z')
-                    evolution_item = {}
-                    evolution_item.update(last_item)
-                    evolution_item.update({
-                        "average_opened_time": average_opened_time,
-                        "study_creation_date": date,
-                        "uuid": "{}_{}_{}".format(date, repository_name, label),
-                    })
-                    evolution_item.update(self.get_grimoire_fields(date, "stats"))
-                    evolution_items.append(evolution_item)
-                    last_date = last_date + relativedelta(days=interval_days)
-                    average_opened_time = average_opened_time + float(interval_days)
-
-                # upload items to ES
-                if len(evolution_items) > 0:
-                    num_items += len(evolution_items)
-                    ins_items += es_out.bulk_upload(evolution_items, self.get_field_unique_id())
-
-                if num_items != ins_items:
-                    missing = num_items - ins_items
-                    logger.error(
-                        ("[enrich-backlog-analysis] %s/%s missing items",
-                            "for Graal Backlog Analysis Study"),
-                        str(missing),
-                        str(num_items)
-                    )
-                else:
-                    logger.debug(
-                        ("[enrich-backlog-analysis] %s items inserted",
-                            "for Graal Backlog Analysis Study"),
-                        str(num_items)
-                    )
+        # The bulk-load mode of the index is ended even if the study fails
+        try:
+            es_out.add_alias("backlog_study")
+
+            # analysis for each repositories
+            num_items = 0
+            ins_items = 0
+            for repository in repositories:
+                repository_url = repository["origin"]
+                project = repository["project"]
+                org_name = repository["organization"]
+                repository_name = repository_url.split("/")[-1]
+
+                logger.debug("[enrich-backlog-analysis] Start analysis for {}".format(repository_url))
+
+                # get each day since repository creation
+                dates = es_in.search(
+                    index=in_index,
+                    body=get_issues_dates(interval_days, repository_url)
+                )['aggregations']['created_per_interval'].get("buckets", [])
+
+                # for each selected label + others labels
+                for label, other in [("", True)] + [(label, False) for label in reduced_labels]:
+                    # compute metrics for each day (ES request for each day)
+                    evolution_items = []
+                    for date in map(lambda i: i['key_as_string'], dates):
+                        evolution_item = self.__create_backlog_item(
+                            repository_url, repository_name, project, date, org_name, interval_days, label, map_label,
+                            self.__get_opened_issues(es_in, in_index, repository_url, date, interval_days,
+                                                     other, label, reduced_labels)
+                        )
+                        evolution_items.append(evolution_item)
+
+                    # complete until today (no ES request needed, just extrapol)
+                    today = datetime.now().replace(hour=0, minute=0, second=0, tzinfo=None)
+                    last_item = evolution_item
+                    last_date = str_to_datetime(
+                        evolution_item['study_creation_date']).replace(tzinfo=None) \
+                        + relativedelta(days=interval_days)
+                    average_opened_time = evolution_item['average_opened_time'] \
+                        + float(interval_days)
+                    while last_date < today:
+                        date = last_date.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+                        evolution_item = {}
+                        evolution_item.update(last_item)
+                        evolution_item.update({
+                            "average_opened_time": average_opened_time,
+                            "study_creation_date": date,
+                            "uuid": "{}_{}_{}".format(date, repository_name, label),
+                        })
+                        evolution_item.update(self.get_grimoire_fields(date, "stats"))
+                        evolution_items.append(evolution_item)
+                        last_date = last_date + relativedelta(days=interval_days)
+                        average_opened_time = average_opened_time + float(interval_days)
+
+                    # upload items to ES
+                    if len(evolution_items) > 0:
+                        num_items += len(evolution_items)
+                        ins_items += es_out.bulk_upload(evolution_items, self.get_field_unique_id())
+
+                    if num_items != ins_items:
+                        missing = num_items - ins_items
+                        logger.error(
+                            ("[enrich-backlog-analysis] %s/%s missing items",
+                                "for Graal Backlog Analysis Study"),
+                            str(missing),
+                            str(num_items)
+                        )
+                    else:
+                        logger.debug(
+                            ("[enrich-backlog-analysis] %s items inserted",
+                                "for Graal Backlog Analysis Study"),
+                            str(num_items)
+                        )
+        finally:
+            es_out.end_bulk_load()
 
         logger.info("[github] End enrich_backlog_analysis study")
@@ -20,196 +20,87 @@
 # In this file, we have the ES requests used by backlog evolution github study
 #
 
+from .. import query as esq
+
 
 def get_unique_repository_with_project_name():
     """ Retrieve all the repository names from the index. """
 
-    query_unique_repository = """
-    {
-        "size": 0,
-        "aggs": {
-            "unique_repos": {
-              "composite" : {
-                "size": 5000,
-                "sources" : [
-                  {"origin" : {"terms": {
-                      "field": "origin"
-                  }}},
-                  {"project" : {"terms": {
-                      "field": "project"
-                  }}},
-                  {"organization" : {"terms": {
-                      "field": "author_org_name"
-                  }}}
-              ]
-            }
-          }
-        }
-    }
-    """
+    sources = [
+        {"origin": {"terms": {"field": "origin"}}},
+        {"project": {"terms": {"field": "project"}}},
+        {"organization": {"terms": {"field": "author_org_name"}}}
+    ]
 
-    return query_unique_repository
+    return esq.search(size=0, aggs={"unique_repos": {"composite": {"size": 5000, "sources": sources}}})
 
 
 def get_issues_not_closed_by_label(repository_url, to_date, label):
-    issues_not_closed = """
-    {
-      "size": 10000,
-      "query": {
-          "bool": {
-              "must_not": {
-                  "exists": {
-                      "field": "closed_at"
-                  }
-              },
-      "filter": [{
-                  "term": {
-                      "origin": "%s"
-                  }},{
-                  "term": {
-                      "labels": "%s"
-                  }},{
-                  "range" : {
-                     "created_at": {"lt" : "%s"}
-                  }
-              }
-              ]
-          }
-      }
-    }
-    """ % (repository_url, label, to_date)
+    query = esq.bool_(
+        must_not=esq.exists("closed_at"),
+        filter=[
+            esq.term("origin", repository_url),
+            esq.term("labels", label),
+            esq.range_("created_at", lt=to_date)
+        ]
+    )
 
-    return issues_not_closed
+    return esq.search(query=query, size=10000)
 
 
 def get_issues_open_at_by_label(repository_url, to_date, label):
-    issues_open_at = """
-    {
-      "size": 10000,
-      "query": {
-          "bool": {
-              "filter": [{
-                  "term": {
-                      "origin": "%s"
-                  }},{
-                  "term": {
-                      "labels": "%s"
-                  }},{
-                  "range" : {
-                     "closed_at": {"gt" : "%s"}
-                  }},{
-                  "range" : {
-                     "created_at": {"lt" : "%s"}
-                  }
-              }
-              ]
-          }
-      }
-    }
-    """ % (repository_url, label, to_date, to_date)
+    query = esq.bool_(
+        filter=[
+            esq.term("origin", repository_url),
+            esq.term("labels", label),
+            esq.range_("closed_at", gt=to_date),
+            esq.range_("created_at", lt=to_date)
+        ]
+    )
 
-    return issues_open_at
+    return esq.search(query=query, size=10000)
 
 
 def get_issues_not_closed_other_label(repository_url, to_date, exclude_labels):
-    issues_not_closed = """
-    {
-      "size": 10000,
-      "query": {
-          "bool": {
-              "must_not":[{
-                "terms": {
-                  "labels": %s
-                }
-              },{
-                  "exists": {
-                      "field": "closed_at"
-                  }
-              }],
-              "filter": [{
-                  "term": {
-                      "origin":"%s"
-                  }},{
-                  "range" : {
-                     "created_at": {"lt" : "%s"}
-                  }
-              }
-              ]
-          }
-      }
-    }
-    """ % (str(exclude_labels).replace("'", "\""), repository_url, to_date)
+    query = esq.bool_(
+        must_not=[
+            esq.terms("labels", exclude_labels),
+            esq.exists("closed_at")
+        ],
+        filter=[
+            esq.term("origin", repository_url),
+            esq.range_("created_at", lt=to_date)
+        ]
+    )
 
-    return issues_not_closed
+    return esq.search(query=query, size=10000)
 
 
 def get_issues_open_at_other_label(repository_url, to_date, exclude_labels):
-    issues_open_at = """
-    {
-      "size": 10000,
-      "query": {
-          "bool": {
-              "must_not":{
-                "terms": {
-                  "labels": %s
-                }
-              },
-              "filter": [{
-                  "term": {
-                      "origin": "%s"
-                  }},{
-                  "range" : {
-                     "closed_at": {"gt" : "%s"}
-                  }},{
-                  "range" : {
-                     "created_at": {"lt" : "%s"}
-                  }
-              }
-              ]
-          }
-      }
-    }
-    """ % (str(exclude_labels).replace("'", "\""),
-           repository_url, to_date, to_date)
+    query = esq.bool_(
+        must_not=esq.terms("labels", exclude_labels),
+        filter=[
+            esq.term("origin", repository_url),
+            esq.range_("closed_at", gt=to_date),
+            esq.range_("created_at", lt=to_date)
+        ]
+    )
 
-    return issues_open_at
+    return esq.search(query=query, size=10000)
 
 
 def get_issues_dates(interval, repository_url):
-
-    query_issues_dates = """
-{
-    "size": 0,
-    "aggs" : {
-        "created_per_interval" : {
-            "date_histogram" : {
-                "field" : "metadata__updated_on",
-                "interval" : "%dd"
+    aggs = {
+        "created_per_interval": {
+            "date_histogram": {
+                "field": "metadata__updated_on",
+                "interval": "%dd" % interval
             },
             "aggs": {
-                "created": {
-                  "value_count": {
-                        "field": "created_at"
-                    }
-                },
-                "closed": {
-                  "value_count": {
-                        "field": "closed_at"
-                    }
-                }
-            }
-        }
-    },
-        "query": {
-            "bool": {
-                "filter": [{
-                    "term": {
-                        "origin": "%s"
-                    }
-                }]
+                "created": esq.value_count("created_at"),
+                "closed": esq.value_count("closed_at")
             }
         }
     }
-    """ % (interval, repository_url)
 
-    return query_issues_dates
+    return esq.search(query=esq.bool_(filter=[esq.term("origin", repository_url)]), size=0, aggs=aggs)
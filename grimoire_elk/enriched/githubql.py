@@ -27,8 +27,10 @@ import re
 from elasticsearch import Elasticsearch as ES, RequestsHttpConnection
 
 from .enrich import Enrich, metadata
+from .ceres_base import CodecSerializer
 from .utils import anonymize_url, get_time_diff_days
 from ..elastic_mapping import Mapping as BaseMapping
+from .. import query as esq
 
 GITHUB = 'https://github.com/'
 LABEL_EVENTS = ['LabeledEvent', 'UnlabeledEvent']
@@ -336,37 +338,18 @@ class GitHubQLEnrich(Enrich):
         logger.info("{} starting study {}".format(log_prefix, anonymize_url(self.elastic.index_url)))
 
         es_in = ES([enrich_backend.elastic_url], retry_on_timeout=True, timeout=100,
-                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection)
+                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection,
+                   serializer=CodecSerializer())
         in_index = enrich_backend.elastic.index
 
         # get all start events that don't have the attribute `duration_from_previous_event`
-        query_start_event_type = {
-            "query": {
-                "bool": {
-                    "filter": {
-                        "term": {
-                            "event_type": start_event_type
-                        }
-                    },
-                    "must_not": {
-                        "exists": {
-                            "field": "duration_from_previous_event"
-                        }
-                    }
-                }
-            },
-            "_source": [
-                "uuid", "issue_url_id", "grimoire_creation_date", target_attr
-            ],
-            "sort": [
-                {
-                    "grimoire_creation_date": {
-                        "order": "asc"
-                    }
-                }
-            ],
-            "size": page_size
-        }
+        query_start_event_type = esq.search(
+            query=esq.bool_(filter=esq.term("event_type", start_event_type),
+                            must_not=esq.exists("duration_from_previous_event")),
+            source=["uuid", "issue_url_id", "grimoire_creation_date", target_attr],
+            sort=[esq.sort("grimoire_creation_date")],
+            size=page_size
+        )
 
         if fltr_attr:
             query_start_event_type['_source'].append(fltr_attr)
@@ -385,50 +368,19 @@ class GitHubQLEnrich(Enrich):
                 start_issue_url_id = start_event['issue_url_id']
                 start_date_event = start_event['grimoire_creation_date']
 
-                query_previous_events = {
-                    "size": 1,
-                    "query": {
-                        "bool": {
-                            "filter": [
-                                {
-                                    "term": {
-                                        "issue_url_id": start_issue_url_id
-                                    }
-                                },
-                                {
-                                    "terms": {
-                                        "event_type": fltr_event_types
-                                    }
-                                },
-                                {
-                                    "range": {
-                                        "grimoire_creation_date": {
-                                            "lt": start_date_event
-                                        }
-                                    }
-                                }
-                            ]
-                        }
-                    },
-                    "_source": [
-                        "uuid", "grimoire_creation_date", target_attr
-                    ],
-                    "sort": [
-                        {
-                            "grimoire_creation_date": {
-                                "order": "desc"
-                            }
-                        }
-                    ]
-                }
+                query_previous_events = esq.search(
+                    size=1,
+                    query=esq.bool_(filter=[
+                        esq.term("issue_url_id", start_issue_url_id),
+                        esq.terms("event_type", fltr_event_types),
+                        esq.range_("grimoire_creation_date", lt=start_date_event)
+                    ]),
+                    source=["uuid", "grimoire_creation_date", target_attr],
+                    sort=[esq.sort("grimoire_creation_date", order="desc")]
+                )
 
                 if fltr_attr:
-                    _fltr = {
-                        "term": {
-                            fltr_attr: start_event[fltr_attr]
-                        }
-                    }
-
+                    _fltr = esq.term(fltr_attr, start_event[fltr_attr])
                     query_previous_events['query']['bool']['filter'].append(_fltr)
                     query_start_event_type['_source'].append(fltr_attr)
 
@@ -445,23 +397,8 @@ class GitHubQLEnrich(Enrich):
                                 "ctx._source.previous_event_uuid=params.uuid"
 
                 add_previous_event_query = {
-                    "script": {
-                        "source": painless_code,
-                        "lang": "painless",
-                        "params": {
-                            "duration": duration,
-                            "uuid": previous_event_uuid
-                        }
-                    },
-                    "query": {
-                        "bool": {
-                            "filter": {
-                                "term": {
-                                    "uuid": start_uuid
-                                }
-                            }
-                        }
-                    }
+                    "script": esq.script(painless_code, params={"duration": duration, "uuid": previous_event_uuid}),
+                    "query": esq.bool_(filter=esq.term("uuid", start_uuid))
                 }
                 r = es_in.update_by_query(index=in_index, body=add_previous_event_query, conflicts='proceed')
                 if r['failures']:
@@ -542,32 +479,12 @@ class GitHubQLEnrich(Enrich):
             """Return a list of merged Pull Requests based on MergedEvent items"""
 
             # Ask for the URL from `MergedEvent` items, filtering by merged PRs
-            es_query = {
-                "size": 0,
-                "query": {
-                    "bool": {
-                        "must": [
-                            {
-                                "term": {"event_type": "MergedEvent"}
-                            },
-                            {
-                                "term": {"pull_request": True}
-                            },
-                            {
-                                "term": {"merge_merged": True}
-                            }
-                        ]
-                    }
-                },
-                "aggs": {
-                    "merge_url": {
-                        "terms": {
-                            "field": "merge_url",
-                            "size": 30000
-                        }
-                    }
-                }
-            }
+            query = esq.bool_(must=[
+                esq.term("event_type", "MergedEvent"),
+                esq.term("pull_request", True),
+                esq.term("merge_merged", True)
+            ])
+            es_query = esq.search(query=query, size=0, aggs={"merge_url": esq.terms_agg("merge_url", size=30000)})
 
             merged_prs = es_input.search(index=in_index, body=es_query)
             buckets = merged_prs['aggregations']['merge_url']['buckets']
@@ -581,7 +498,8 @@ class GitHubQLEnrich(Enrich):
         logger.info("{} starting study {}".format(log_prefix, anonymize_url(self.elastic.index_url)))
 
         es_in = ES([enrich_backend.elastic_url], retry_on_timeout=True, timeout=100,
-                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection)
+                   verify_certs=self.elastic.requests.verify, connection_class=RequestsHttpConnection,
+                   serializer=CodecSerializer())
         in_index = enrich_backend.elastic.index
 
         # Get all the merged pull requests from MergedEvents
@@ -589,31 +507,12 @@ class GitHubQLEnrich(Enrich):
         merged_prs = _get_merged_prs(es_in)
 
         # Get all CrossReferencedEvent items and their referenced issues and pull requests
-        es_query = {
-            "size": 0,
-            "query": {
-                "bool": {
-                    "must": {
-                        "term": {
-                            "event_type": "CrossReferencedEvent"
-                        }
-                    }
-                }
-            },
-            "aggs": {
-                "issue_url": {
-                    "terms": {
-                        "field": "issue_url",
-                        "size": 30000
-                    },
-                    "aggs": {
-                        "uniq_gender": {
-                            "terms": {"field": "reference_source_url"}
-                        }
-                    }
-                }
-            }
+        aggs = {
+            "issue_url": esq.terms_agg("issue_url", size=30000, aggs={
+                "uniq_gender": esq.terms_agg("reference_source_url")
+            })
         }
+        es_query = esq.search(query=esq.bool_(must=esq.term("event_type", "CrossReferencedEvent")), size=0, aggs=aggs)
 
         cross_references = es_in.search(index=in_index, body=es_query)
         buckets = cross_references['aggregations']['issue_url']['buckets']
@@ -689,24 +588,17 @@ class GitHubQLEnrich(Enrich):
                         ref_issues_ext.append(ref)
 
             # Update items with the corresponding fields
+            params = {
+                "referenced_by_issues": ref_issues_repo,
+                "referenced_by_prs": ref_prs_repo,
+                "referenced_by_merged_prs": ref_prs_merged_repo,
+                "referenced_by_external_issues": ref_issues_ext,
+                "referenced_by_external_prs": ref_prs_ext,
+                "referenced_by_external_merged_prs": ref_prs_merged_ext,
+            }
             update_query = {
-                "script": {
-                    "source": painless_code,
-                    "lang": "painless",
-                    "params": {
-                        "referenced_by_issues": ref_issues_repo,
-                        "referenced_by_prs": ref_prs_repo,
-                        "referenced_by_merged_prs": ref_prs_merged_repo,
-                        "referenced_by_external_issues": ref_issues_ext,
-                        "referenced_by_external_prs": ref_prs_ext,
-                        "referenced_by_external_merged_prs": ref_prs_merged_ext,
-                    }
-                },
-                "query": {
-                    "term": {
-                        "issue_url": issue_url
-                    }
-                }
+                "script": esq.script(painless_code, params=params),
+                "query": esq.term("issue_url", issue_url)
             }
 
             update_indexes = [in_index]
@@ -22,151 +22,53 @@
 
 from grimoirelab_toolkit.datetime import str_to_datetime, unixtime_to_datetime
 
+from .. import query as esq
+
 
 def get_unique_repository():
     """ Retrieve all the repository names from the index. """
 
-    query_unique_repository = """
-    {
-        "size": 0,
-        "aggs": {
-            "unique_repos": {
-                "terms": {
-                    "field": "origin",
-                    "size": 5000
-                }
-            }
-        }
-    }
-    """
-
-    return query_unique_repository
+    return esq.search(size=0, aggs={"unique_repos": esq.terms_agg("origin", size=5000)})
 
 
 def get_last_study_date(repository_url, interval):
     """ Retrieve the last study_creation_date of the item corresponding
     to given repository from the study index.
     """
+    query = esq.bool_(filter=[
+        esq.term("origin.keyword", repository_url),
+        esq.term("interval_months", str(interval))
+    ])
 
-    query_last_study_date = """
-    {
-        "size": 0,
-        "aggs": {
-            "1": {
-                "max": {
-                    "field": "study_creation_date"
-                }
-            }
-        },
-        "query": {
-            "bool": {
-                "filter": [{
-                    "term": {
-                        "origin.keyword": "%s"
-                    }
-                },{
-                    "term":{
-                        "interval_months": "%s"
-                    }
-                }]
-            }
-        }
-    }
-    """ % (repository_url, interval)
-
-    return query_last_study_date
+    return esq.search(query=query, size=0, aggs={"1": esq.max_("study_creation_date")})
 
 
 def get_first_enriched_date(repository_url):
     """ Retrieve the first/oldest metadata__updated_on of the item
     corresponding to given repository.
     """
+    first_item = esq.top_hits(size=1, sort=[esq.sort("commit_date")],
+                              docvalue_fields=["metadata__updated_on"], _source="metadata__updated_on")
+    query = esq.bool_(filter=[esq.term("origin", repository_url)])
 
-    query_first_enriched_date = """
-    {
-        "size": 0,
-        "aggs": {
-            "1": {
-                "top_hits": {
-                    "docvalue_fields": [
-                        "metadata__updated_on"
-                    ],
-                    "_source": "metadata__updated_on",
-                    "size": 1,
-                    "sort": [{
-                        "commit_date": {
-                            "order": "asc"
-                        }
-                    }]
-                }
-            }
-        },
-        "query": {
-            "bool": {
-                "filter": [{
-                    "term": {
-                        "origin": "%s"
-                    }
-                }]
-            }
-        }
-    }
-    """ % (repository_url)
-
-    return query_first_enriched_date
+    return esq.search(query=query, size=0, aggs={"1": first_item})
 
 
 def get_files_at_time(repository_url, to_date):
     """ Retrieve all the latest changes wrt files until the to_date,
     corresponding to the given repository.
     """
-
-    query_files_at_time = """
-    {
-        "size": 0,
-        "aggs": {
-            "file_stats": {
-                "terms": {
-                    "field": "file_path",
-                    "size": 2147483647,
-                    "order": {
-                        "_key": "desc"
-                    }
-                },
-                "aggs": {
-                    "1": {
-                        "top_hits": {
-                            "size": 1,
-                            "sort": [{
-                                "metadata__updated_on": {
-                                    "order": "desc"
-                                }
-                            }]
-                        }
-                    }
-                }
-            }
-        },
-        "query": {
-            "bool": {
-                "filter": [{
-                    "term": {
-                        "origin": "%s"
-                    }
-                },
-                {
-                    "range": {
-                        "metadata__updated_on": {
-                            "lte": "%s"
-                        }
-                    }
-                }]
-            }
-        }
+    last_change = esq.top_hits(size=1, sort=[esq.sort("metadata__updated_on", order="desc")])
+    aggs = {
+        "file_stats": esq.terms_agg("file_path", size=2147483647, order={"_key": "desc"},
+                                    aggs={"1": last_change})
     }
-    """ % (repository_url, to_date)
+    query = esq.bool_(filter=[
+        esq.term("origin", repository_url),
+        esq.range_("metadata__updated_on", lte=to_date)
+    ])
 
-    return query_files_at_time
+    return esq.search(query=query, size=0, aggs=aggs)
 
 
 def get_to_date(es_in, in_index, out_index, repository_url, interval):
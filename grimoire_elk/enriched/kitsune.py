@@ -19,7 +19,6 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
-import json
 import logging
 
 from .enrich import Enrich, metadata
@@ -212,45 +211,41 @@ class KitsuneEnrich(Enrich):
         return eitem
 
     def enrich_items(self, ocean_backend):
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        bulk_json = ""
-        total = 0
-
-        url = self.elastic.get_bulk_url()
-
-        logger.debug("[kitsune] Adding items to {} (in {} packs)".format(anonymize_url(url), max_items))
-
-        items = ocean_backend.fetch()
-        for item in items:
-            if current >= max_items:
-                total += self.elastic.safe_put_bulk(url, bulk_json)
-                bulk_json = ""
-                current = 0
-
-            rich_item = self.get_rich_item(item)
-            data_json = json.dumps(rich_item)
-            bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                (item[self.get_field_unique_id()])
-            bulk_json += data_json + "\n"  # Bulk document
-            current += 1
-            # Time to enrich also de answers
-            if 'answers_data' in item['data']:
-                for answer in item['data']['answers_data']:
-                    # Add question title in answers
-                    answer['title'] = item['data']['title']
-                    answer['solution'] = 0
-                    if answer['id'] == item['data']['solution']:
-                        answer['solution'] = 1
-                    rich_answer = self.get_rich_item(answer, kind='answer')
-                    data_json = json.dumps(rich_answer)
-                    bulk_json += '{"index" : {"_id" : "%s_%i" } }\n' % \
-                        (item[self.get_field_unique_id()],
-                         rich_answer['answer_id'])
-                    bulk_json += data_json + "\n"  # Bulk document
-                    current += 1
-
-        if current > 0:
-            total += self.elastic.safe_put_bulk(url, bulk_json)
+        writer = self.elastic.get_bulk_writer()
+
+        logger.debug("[kitsune] Adding items to {} (in packs of {} items, {:.2f} MB)".format(
+                     anonymize_url(writer.url), writer.max_items, writer.max_bytes / (1024 * 1024)))
+
+        tracker = self.get_checkpoint_tracker(ocean_backend)
+        items = self.fetch_items(ocean_backend, tracker)
+
+        try:
+            with writer:
+                for item in items:
+                    rich_item = self.get_rich_item(item)
+                    writer.add(item[self.get_field_unique_id()], rich_item)
+                    # Time to enrich also de answers
+                    if 'answers_data' in item['data']:
+                        for answer in item['data']['answers_data']:
+                            # Add question title in answers
+                            answer['title'] = item['data']['title']
+                            answer['solution'] = 0
+                            if answer['id'] == item['data']['solution']:
+                                answer['solution'] = 1
+                            rich_answer = self.get_rich_item(answer, kind='answer')
+                            writer.add("%s_%i" % (item[self.get_field_unique_id()],
+                                                  rich_answer['answer_id']),
+                                       rich_answer)
+                    if tracker:
+                        tracker.item_done(item, writer)
+        except Exception:
+            if tracker:
+                tracker.save(writer)
+            raise
+
+        if tracker:
+            tracker.finish()
+
+        total = writer.total
 
         return total
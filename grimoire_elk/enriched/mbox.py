@@ -19,7 +19,6 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
-import json
 import logging
 
 from requests.structures import CaseInsensitiveDict
@@ -198,46 +197,36 @@ class MBoxEnrich(Enrich):
         try:
             total = super(MBoxEnrich, self).enrich_items(ocean_backend)
         except UnicodeEncodeError:
-            total = self.enrich_items_old(ocean_backend.fetch())
+            total = self.enrich_items_old(ocean_backend)
 
         return total
 
-    def enrich_items_old(self, items):
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        total = 0
-        bulk_json = ""
-
-        url = self.elastic.get_bulk_url()
-
-        logger.debug("[mbox] Adding items to {} (in {} packs)".format(anonymize_url(url), max_items))
-
-        for item in items:
-            if current >= max_items:
-                total += self.elastic.safe_put_bulk(url, bulk_json)
-                bulk_json = ""
-                current = 0
+    def enrich_items_old(self, ocean_backend):
+        writer = self.elastic.get_bulk_writer()
 
-            rich_item = self.get_rich_item(item)
-            data_json = json.dumps(rich_item)
-            bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                (rich_item[self.get_field_unique_id()])
-            bulk_json += data_json + "\n"  # Bulk document
-            current += 1
+        logger.debug("[mbox] Adding items to {} (in packs of {} items, {:.2f} MB)".format(
+                     anonymize_url(writer.url), writer.max_items, writer.max_bytes / (1024 * 1024)))
 
-        if current == 0:
-            return total
+        # Resumed from the checkpoint saved when the standard method failed, if any
+        tracker = self.get_checkpoint_tracker(ocean_backend)
+        items = self.fetch_items(ocean_backend, tracker)
 
         try:
-            total += self.elastic.safe_put_bulk(url, bulk_json)
-        except UnicodeEncodeError:
-            # Related to body.encode('iso-8859-1'). mbox data
-            logger.error("[mbox] Encoding error ... converting bulk to iso-8859-1")
-            bulk_json = bulk_json.encode('iso-8859-1', 'ignore')
+            with writer:
+                for item in items:
+                    rich_item = self.get_rich_item(item)
+                    writer.add(rich_item[self.get_field_unique_id()], rich_item)
+                    if tracker:
+                        tracker.item_done(item, writer)
+        except Exception:
+            if tracker:
+                tracker.save(writer)
+            raise
 
-            total += self.elastic.safe_put_bulk(url, bulk_json)
+        if tracker:
+            tracker.finish()
 
-        return total
+        return writer.total
 
     def kafka_kip(self, ocean_backend, enrich_backend, no_incremental=False):
         # KIP study is not incremental
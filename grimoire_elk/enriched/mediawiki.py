@@ -19,7 +19,6 @@
 #   Alvaro del Castillo San Felix <acs@bitergia.com>
 #
 
-import json
 import logging
 
 from grimoirelab_toolkit.datetime import str_to_datetime
@@ -236,30 +235,30 @@ class MediaWikiEnrich(Enrich):
         return self.enrich_events(items)
 
     def enrich_events(self, ocean_backend):
-        max_items = self.elastic.max_items_bulk
-        current = 0
-        bulk_json = ""
-        total = 0
-
-        url = self.elastic.get_bulk_url()
-
-        logger.debug("[mediawiki] Adding items to {} (in {} packs)".format(anonymize_url(url), max_items))
-
-        items = ocean_backend.fetch()
-        for item in items:
-            rich_item_reviews = self.get_rich_item_reviews(item)
-            for enrich_review in rich_item_reviews:
-                if current >= max_items:
-                    total += self.elastic.safe_put_bulk(url, bulk_json)
-                    bulk_json = ""
-                    current = 0
-                data_json = json.dumps(enrich_review)
-                bulk_json += '{"index" : {"_id" : "%s" } }\n' % \
-                    (enrich_review[self.get_field_unique_id()])
-                bulk_json += data_json + "\n"  # Bulk document
-                current += 1
-
-        if current > 0:
-            total += self.elastic.safe_put_bulk(url, bulk_json)
+        writer = self.elastic.get_bulk_writer()
+
+        logger.debug("[mediawiki] Adding items to {} (in packs of {} items, {:.2f} MB)".format(
+                     anonymize_url(writer.url), writer.max_items, writer.max_bytes / (1024 * 1024)))
+
+        tracker = self.get_checkpoint_tracker(ocean_backend, events=True)
+        items = self.fetch_items(ocean_backend, tracker)
+
+        try:
+            with writer:
+                for item in items:
+                    rich_item_reviews = self.get_rich_item_reviews(item)
+                    for enrich_review in rich_item_reviews:
+                        writer.add(enrich_review[self.get_field_unique_id()], enrich_review)
+                    if tracker:
+                        tracker.item_done(item, writer)
+        except Exception:
+            if tracker:
+                tracker.save(writer)
+            raise
+
+        if tracker:
+            tracker.finish()
+
+        total = writer.total
 
         return total
@@ -43,10 +43,11 @@ class ESPandasConnector(ESConnector):
     Writing is also ready to work directly with Pandas dataframes.
     """
 
-    def __init__(self, es_conn, es_index, sort_on_field='metadata__timestamp', repo=None, read_only=True):
+    def __init__(self, es_conn, es_index, sort_on_field='metadata__timestamp', repo=None, read_only=True,
+                 page_size=500, page_sizer=None):
 
         super().__init__(es_conn=es_conn, es_index=es_index, sort_on_field=sort_on_field, repo=repo,
-                         read_only=read_only)
+                         read_only=read_only, page_size=page_size, page_sizer=page_sizer)
         self.__log_prefix = "[" + es_index + "] study areas_of_code "
 
     @staticmethod
@@ -72,11 +73,7 @@ class ESPandasConnector(ESConnector):
         """
 
         search_query = self._build_search_query(from_date)
-        for hit in helpers.scan(self._es_conn,
-                                search_query,
-                                scroll='300m',
-                                index=self._es_index,
-                                preserve_order=True):
+        for hit in self._scan(search_query):
             yield hit["_source"]
 
     def read_block(self, size, from_date=None):
@@ -91,12 +88,7 @@ class ESPandasConnector(ESConnector):
         search_query = self._build_search_query(from_date)
         logger.debug(self.__log_prefix + str(search_query))
         hits_block = []
-        for hit in helpers.scan(self._es_conn,
-                                search_query,
-                                scroll='300m',
-                                size=500,
-                                index=self._es_index,
-                                preserve_order=True):
+        for hit in self._scan(search_query):
 
             hits_block.append(hit["_source"])
 
@@ -20,10 +20,11 @@
 #
 
 import datetime
+import gzip
 import inspect
-import json
 import logging
 import re
+from urllib.parse import urlparse
 
 import requests
 import urllib3
@@ -31,6 +32,8 @@ import urllib3
 from grimoirelab_toolkit.datetime import (datetime_utcnow,
                                           str_to_datetime)
 
+from .. import query as esq
+
 
 BACKOFF_FACTOR = 0.2
 MAX_RETRIES = 21
@@ -40,6 +43,8 @@ MAX_RETRIES_ON_CONNECT = 21
 STATUS_FORCE_LIST = [408, 409, 429, 502, 503, 504]
 METADATA_FILTER_RAW = 'metadata__filter_raw'
 REPO_LABELS = 'repository_labels'
+# ElasticSearch endpoints whose request bodies can be compressed
+GZIP_ENDPOINTS = ['_bulk', '_search', '_msearch', '_update_by_query']
 
 logger = logging.getLogger(__name__)
 
@@ -70,13 +75,7 @@ def get_repository_filter(perceval_backend, perceval_backend_name, term=False):
             filter_ = {"name": field,
                        "value": value}
         else:
-            filter_ = '''
-                {"term":
-                    { "%s" : "%s"  }
-                }
-            ''' % (field, value)
-            # Filters are always a dict
-            filter_ = json.loads(filter_)
+            filter_ = esq.term(field, value)
 
     if value in ['', GITHUB + '/', 'https://meetup.com/']:
         # Support for getting all items from a multiorigin index
@@ -115,7 +114,52 @@ def get_time_diff_days(start, end):
     return diff_days
 
 
-def grimoire_con(insecure=True, conn_retries=MAX_RETRIES_ON_CONNECT, total=MAX_RETRIES):
+class GzipHTTPAdapter(requests.adapters.HTTPAdapter):
+    """HTTP adapter which compresses with gzip the bodies of the requests sent
+    to the bulk, search and update by query endpoints of ElasticSearch.
+
+    Compression is disabled when `compress_level` is None. Bodies smaller than
+    `compress_min_size` bytes are sent as they are, since the gain wouldn't pay
+    the CPU cost.
+
+    :param compress_level: gzip compression level (1-9), by default the class attribute
+    :param compress_min_size: min size (bytes) of the bodies to compress, by default the class attribute
+    """
+    compress_level = None
+    compress_min_size = 1024
+
+    def __init__(self, *args, compress_level=None, compress_min_size=None, **kwargs):
+        if compress_level is not None:
+            self.compress_level = compress_level
+        if compress_min_size is not None:
+            self.compress_min_size = compress_min_size
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if self.compress_level is not None and self.is_compressible(request):
+            body = request.body
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            request.body = gzip.compress(body, compresslevel=self.compress_level)
+            request.headers['Content-Encoding'] = 'gzip'
+            request.headers['Content-Length'] = str(len(request.body))
+
+        return super().send(request, **kwargs)
+
+    def is_compressible(self, request):
+        """Check whether the body of a request must be compressed"""
+
+        if not request.body or 'Content-Encoding' in request.headers:
+            return False
+        if not isinstance(request.body, (str, bytes)) or len(request.body) < self.compress_min_size:
+            return False
+
+        endpoint = urlparse(request.url).path.rstrip('/').split('/')[-1]
+        return endpoint in GZIP_ENDPOINTS
+
+
+def grimoire_con(insecure=True, conn_retries=MAX_RETRIES_ON_CONNECT, total=MAX_RETRIES,
+                 pool_maxsize=requests.adapters.DEFAULT_POOLSIZE):
     conn = requests.Session()
     # {backoff factor} * (2 ^ ({number of total retries} - 1))
     # conn_retries = 21  # 209715.2 = 2.4d
@@ -124,7 +168,7 @@ def grimoire_con(insecure=True, conn_retries=MAX_RETRIES_ON_CONNECT, total=MAX_R
     retries = urllib3.util.Retry(total=total, connect=conn_retries, read=MAX_RETRIES_ON_READ,
                                  redirect=MAX_RETRIES_ON_REDIRECT, backoff_factor=BACKOFF_FACTOR,
                                  method_whitelist=False, status_forcelist=STATUS_FORCE_LIST)
-    adapter = requests.adapters.HTTPAdapter(max_retries=retries)
+    adapter = GzipHTTPAdapter(max_retries=retries, pool_maxsize=pool_maxsize)
     conn.mount('http://', adapter)
     conn.mount('https://', adapter)
 
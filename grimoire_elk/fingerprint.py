@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2020 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Fingerprints of the raw items stored in the indexes.
+
+The fingerprint of an item is a hash of its normalized data. The ones of
+the items uploaded are kept in a SQLite database, by index and origin, so
+the items fetched again without changes (e.g., in the overlapping windows
+of incremental collections) are not uploaded again. The indexes are
+identified by their UUID, so the fingerprints of an index deleted and
+created again are not used.
+"""
+
+import hashlib
+import logging
+import sqlite3
+
+from . import codec
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS fingerprints (
+        idx TEXT NOT NULL,
+        origin TEXT NOT NULL,
+        uuid TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        PRIMARY KEY (idx, origin, uuid)
+    ) WITHOUT ROWID"""
+]
+LOCK_TIMEOUT = 60  # seconds waiting for the writes of other processes
+# Fields of the raw items, besides `data`, which change their documents in the index
+FINGERPRINT_FIELDS = ['project']
+
+
+def fingerprint(item):
+    """Fingerprint of a raw item, a hash of its normalized `data` and the
+    fields added to it when it is fed (e.g., `project`)
+
+    :param item: raw item
+    """
+    fields = [item.get('data')] + [item.get(field) for field in FINGERPRINT_FIELDS]
+
+    return hashlib.blake2b(codec.dumpb_canonical(fields), digest_size=16).hexdigest()
+
+
+class FingerprintStore:
+    """Fingerprints of the raw items uploaded, in a SQLite database.
+
+    :param path: path of the database, created if it doesn't exist
+    """
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+
+    def load(self, index, origin):
+        """Load the fingerprints of the items of an origin in an index
+
+        :param index: UUID of the index
+        :param origin: origin of the items
+
+        :returns: dict with the fingerprints by uuid
+        """
+        rows = self._connect().execute("SELECT uuid, fingerprint FROM fingerprints WHERE idx = ? AND origin = ?",
+                                       (index, origin))
+
+        return dict(rows.fetchall())
+
+    def save(self, index, origin, fingerprints):
+        """Save the fingerprints of the items of an origin in an index
+
+        :param index: UUID of the index
+        :param origin: origin of the items
+        :param fingerprints: dict with the fingerprints by uuid
+        """
+        if not fingerprints:
+            return
+
+        rows = [(index, origin, uuid, value) for uuid, value in fingerprints.items()]
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)", rows)
+
+    def remove(self, index, origin=None):
+        """Remove the fingerprints of an index or, if given, of an origin in the index"""
+
+        conn = self._connect()
+        with conn:
+            if origin is None:
+                conn.execute("DELETE FROM fingerprints WHERE idx = ?", (index,))
+            else:
+                conn.execute("DELETE FROM fingerprints WHERE idx = ? AND origin = ?", (index, origin))
+
+    def close(self):
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def _connect(self):
+        if not self._conn:
+            self._conn = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            with self._conn:
+                for statement in SCHEMA:
+                    self._conn.execute(statement)
+
+        return self._conn
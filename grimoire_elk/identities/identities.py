@@ -20,6 +20,10 @@
 #
 
 import hashlib
+from functools import lru_cache
+
+# Max pseudonyms remembered by the process, the least recently used are discarded
+HASH_CACHE_SIZE = 65536
 
 
 class Identities:
@@ -30,10 +34,19 @@ class Identities:
     """
 
     @staticmethod
+    @lru_cache(maxsize=HASH_CACHE_SIZE)
     def _hash(name):
+        # The same identities appear in many items, so their pseudonyms are
+        # memoized and shared by the identities of all the backends
         sha1 = hashlib.sha1(name.encode('UTF-8', errors="surrogateescape"))
         return sha1.hexdigest()
 
+    @staticmethod
+    def hash_cache_info():
+        """Hits, misses and size of the memo of the pseudonyms"""
+
+        return Identities._hash.cache_info()
+
     @classmethod
     def anonymize_item(cls, item):
         """Remove or hash the fields that contain personal information"""
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2020 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Pipelines of stages running in their own threads.
+
+The items read from a source (e.g., the items fetched by Perceval) go
+through a chain of stages connected by bounded queues, so each stage works
+while the others wait for the network. The queue after the source never
+blocks it: when it is full, the items are spooled to a temporary file until
+the next stage catches up, so the source keeps reading at its own pace.
+"""
+
+import collections
+import logging
+import tempfile
+import threading
+import time
+
+from . import codec
+
+SOURCE_JOIN_TIMEOUT = 1  # seconds
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineStopped(Exception):
+    """The consumer of a queue stopped before the producer finished"""
+
+
+class StageQueue:
+    """FIFO queue between two stages of a pipeline.
+
+    The producer puts the items and calls `finish` when it is done, the
+    consumer iterates the queue until it is finished and drained. Up to
+    `maxsize` items are kept in memory. When the queue is full, `put` blocks
+    or, with `spool`, writes the items to a temporary file read afterwards.
+
+    :param maxsize: max number of items in memory
+    :param spool: if True, the items exceeding `maxsize` are spooled to disk
+        instead of blocking the producer. They must be JSON serializable
+    :param spool_dir: directory of the spool file, by default the temporary one
+    """
+    def __init__(self, maxsize, spool=False, spool_dir=None):
+        self.maxsize = maxsize
+        self.spool = spool
+        self.spool_dir = spool_dir
+
+        self.items = 0  # items taken by the consumer
+        self.spooled = 0  # items written to the spool file
+        self.put_wait = 0.0  # seconds the producer waited for room
+        self.get_wait = 0.0  # seconds the consumer waited for items
+
+        self._memory = collections.deque()
+        self._spool_file = None
+        self._spool_pending = 0  # items in the spool file not read yet
+        self._spool_offset = 0  # offset of the next item to read from the spool file
+        self._finished = False
+        self._stopped = False
+        self._error = None
+        self._cond = threading.Condition()
+
+    def put(self, item):
+        """Add an item, waiting for room unless it can be spooled
+
+        :raises PipelineStopped: when the consumer stopped
+        """
+        with self._cond:
+            if not self.spool and len(self._memory) >= self.maxsize and not self._stopped:
+                before = time.time()
+                while len(self._memory) >= self.maxsize and not self._stopped:
+                    self._cond.wait()
+                self.put_wait += time.time() - before
+
+            if self._stopped:
+                raise PipelineStopped()
+
+            # Once spooling, the items go to the spool until it is read to keep their order
+            if self._spool_pending or len(self._memory) >= self.maxsize:
+                self._write_spool(item)
+            else:
+                self._memory.append(item)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        """Mark the end of the items. The error, if any, is raised to the consumer"""
+
+        with self._cond:
+            self._finished = True
+            self._error = error
+            self._cond.notify_all()
+
+    def stop(self):
+        """Stop the producer and discard the items left"""
+
+        with self._cond:
+            self._stopped = True
+            self._memory.clear()
+            self._close_spool()
+            self._cond.notify_all()
+
+    def __iter__(self):
+        while True:
+            with self._cond:
+                if not self._memory and not self._spool_pending and not self._finished:
+                    before = time.time()
+                    while not self._memory and not self._spool_pending and not self._finished \
+                            and not self._stopped:
+                        self._cond.wait()
+                    self.get_wait += time.time() - before
+
+                if self._stopped:
+                    raise PipelineStopped()
+                elif self._memory:
+                    item = self._memory.popleft()
+                elif self._spool_pending:
+                    item = self._read_spool()
+                elif self._error:
+                    raise self._error
+                else:
+                    self._close_spool()
+                    return
+
+                self.items += 1
+                self._cond.notify_all()
+
+            yield item
+
+    def _write_spool(self, item):
+        if not self._spool_file:
+            self._spool_file = tempfile.TemporaryFile(prefix='pipeline_', dir=self.spool_dir)
+
+        self._spool_file.seek(0, 2)
+        self._spool_file.write(codec.dumpb(item) + b"\n")
+        self._spool_pending += 1
+        self.spooled += 1
+
+    def _read_spool(self):
+        self._spool_file.seek(self._spool_offset)
+        line = self._spool_file.readline()
+        self._spool_offset += len(line)
+        self._spool_pending -= 1
+
+        # The file is emptied once it is read, so it doesn't grow forever
+        if not self._spool_pending:
+            self._spool_file.seek(0)
+            self._spool_file.truncate()
+            self._spool_offset = 0
+
+        return codec.loads(line)
+
+    def _close_spool(self):
+        if self._spool_file:
+            self._spool_file.close()
+            self._spool_file = None
+            self._spool_pending = 0
+            self._spool_offset = 0
+
+
+class StageStats:
+    """Items processed by a stage and the time it was busy, without
+    waiting for the stages around it"""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.seconds = 0.0  # seconds running
+        self.waiting = 0.0  # seconds waiting for the stages around it
+
+    @property
+    def busy(self):
+        return max(self.seconds - self.waiting, 0.0)
+
+    @property
+    def throughput(self):
+        """Items per second while the stage is busy"""
+
+        return self.items / self.busy if self.busy else 0.0
+
+    def __str__(self):
+        return "{}: {} items, {:.2f} items/s, {:.2f}s busy, {:.2f}s waiting".format(
+               self.name, self.items, self.throughput, self.busy, self.waiting)
+
+
+def run_pipeline(source, stages, sink, queue_size, spool_dir=None):
+    """Run a pipeline of stages, each one in its own thread, connected
+    by queues of `queue_size` items.
+
+    The source is read in a thread which is never blocked, the items which
+    don't fit in its queue are spooled to disk. Each stage is a function
+    receiving the iterator of the items of the previous stage and returning
+    an iterator of the items for the next one (e.g., a generator). The sink
+    is a function consuming the items of the last stage, run in the calling
+    thread. The first error raised by any of them stops the rest of them
+    and it is raised again. The source is not waited for more than
+    `SOURCE_JOIN_TIMEOUT` seconds, as it could be blocked in a read (e.g.,
+    waiting for a rate limit); it ends by itself with its next item.
+
+    :param source: tuple (name, iterable of items)
+    :param stages: list of tuples (name, function)
+    :param sink: tuple (name, function)
+    :param queue_size: max number of items in memory between two stages
+    :param spool_dir: directory of the files where the items of the source are spooled
+
+    :returns: list with the `StageStats` of the source, the stages and the sink
+    """
+    names = [source[0]] + [name for name, _ in stages] + [sink[0]]
+    stats = [StageStats(name) for name in names]
+    queues = [StageQueue(queue_size, spool=True, spool_dir=spool_dir)]
+    queues += [StageQueue(queue_size) for _ in stages]
+
+    def read_source(items, stage_stats, out_queue):
+        init = time.time()
+        error = None
+        try:
+            for item in items:
+                out_queue.put(item)
+                stage_stats.items += 1
+        except PipelineStopped:
+            pass
+        except Exception as ex:
+            error = ex
+        finally:
+            close = getattr(items, 'close', None)
+            if close:
+                close()
+            out_queue.finish(error)
+            stage_stats.seconds = time.time() - init
+            stage_stats.waiting = out_queue.put_wait
+
+    def run_stage(function, stage_stats, in_queue, out_queue):
+        init = time.time()
+        error = None
+        items = None
+        try:
+            items = function(iter(in_queue))
+            for item in items:
+                out_queue.put(item)
+        except PipelineStopped:
+            in_queue.stop()
+        except Exception as ex:
+            error = ex
+            in_queue.stop()
+        finally:
+            close = getattr(items, 'close', None)
+            if close:
+                close()
+            out_queue.finish(error)
+            stage_stats.items = in_queue.items
+            stage_stats.seconds = time.time() - init
+            stage_stats.waiting = in_queue.get_wait + out_queue.put_wait
+
+    threads = [threading.Thread(target=read_source, args=(source[1], stats[0], queues[0]), daemon=True)]
+    for i, (_, function) in enumerate(stages):
+        threads.append(threading.Thread(target=run_stage, args=(function, stats[i + 1], queues[i], queues[i + 1]),
+                                        daemon=True))
+
+    for thread in threads:
+        thread.start()
+
+    init = time.time()
+    try:
+        sink[1](iter(queues[-1]))
+    finally:
+        # The stages are stopped when the sink doesn't read all the items
+        for stage_queue in queues:
+            stage_queue.stop()
+        for thread in threads[1:]:
+            thread.join()
+        threads[0].join(SOURCE_JOIN_TIMEOUT)
+
+        stats[-1].items = queues[-1].items
+        stats[-1].seconds = time.time() - init
+        stats[-1].waiting = queues[-1].get_wait
+
+    if queues[0].spooled:
+        logger.debug("{} items of {} spooled to disk".format(queues[0].spooled, source[0]))
+
+    return stats
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2020 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Builders of the ElasticSearch queries.
+
+The queries are built as dicts and lists, so the values are never quoted
+or escaped by hand, and they are serialized once when they are sent (e.g.,
+`json.dumps(query)` or passing them as the `body` of the ElasticSearch
+client). The optional parts set to `None` are left out of the queries.
+"""
+
+
+def term(field, value):
+    """Query of the items with exactly `value` in `field`"""
+
+    return {"term": {field: value}}
+
+
+def terms(field, values):
+    """Query of the items with any of the `values` in `field`"""
+
+    return {"terms": {field: list(values)}}
+
+
+def match(field, value):
+    """Full text query of the items matching `value` in `field`"""
+
+    return {"match": {field: value}}
+
+
+def exists(field):
+    """Query of the items with any value in `field`"""
+
+    return {"exists": {"field": field}}
+
+
+def range_(field, gt=None, gte=None, lt=None, lte=None):
+    """Query of the items with `field` in a range"""
+
+    bounds = {'gt': gt, 'gte': gte, 'lt': lt, 'lte': lte}
+
+    return {"range": {field: {op: value for op, value in bounds.items() if value is not None}}}
+
+
+def bool_(filter=None, must=None, must_not=None, should=None):
+    """Bool query combining the given clauses, each one a query or a list of them"""
+
+    clauses = {'filter': filter, 'must': must, 'must_not': must_not, 'should': should}
+
+    return {"bool": {name: clause for name, clause in clauses.items() if clause is not None}}
+
+
+def sort(field, order="asc", **params):
+    """Sort by `field`. Extra params (e.g., `unmapped_type`) are added to the order"""
+
+    return {field: dict(order=order, **params)}
+
+
+def search(query=None, size=None, sort=None, aggs=None, source=None, **params):
+    """Body of a search request. Extra params (e.g., `from`, `slice`) are
+    added as they are given.
+
+    :param query: query of the items
+    :param size: number of hits returned
+    :param sort: list of sorts
+    :param aggs: dict with the aggregations by name
+    :param source: `_source` filter of the fields returned
+    """
+    body = {}
+    if size is not None:
+        body['size'] = size
+    if query is not None:
+        body['query'] = query
+    if sort is not None:
+        body['sort'] = sort
+    if aggs is not None:
+        body['aggs'] = aggs
+    if source is not None:
+        body['_source'] = source
+    body.update(params)
+
+    return body
+
+
+def max_(field):
+    """Aggregation of the max value of `field`"""
+
+    return {"max": {"field": field}}
+
+
+def min_(field):
+    """Aggregation of the min value of `field`"""
+
+    return {"min": {"field": field}}
+
+
+def value_count(field):
+    """Aggregation of the number of values of `field`"""
+
+    return {"value_count": {"field": field}}
+
+
+def terms_agg(field, size=None, order=None, aggs=None):
+    """Aggregation of the buckets of the values of `field`
+
+    :param field: field to aggregate
+    :param size: max number of buckets
+    :param order: order of the buckets (e.g., {"_key": "desc"})
+    :param aggs: dict with the sub-aggregations by name
+    """
+    agg = {"terms": {"field": field}}
+    if size is not None:
+        agg['terms']['size'] = size
+    if order is not None:
+        agg['terms']['order'] = order
+    if aggs is not None:
+        agg['aggs'] = aggs
+
+    return agg
+
+
+def top_hits(size=1, sort=None, **params):
+    """Aggregation of the top hits of each bucket"""
+
+    agg = {"size": size}
+    if sort is not None:
+        agg['sort'] = sort
+    agg.update(params)
+
+    return {"top_hits": agg}
+
+
+def script(source, params=None, lang="painless"):
+    """Script of an update request"""
+
+    body = {"source": source, "lang": lang}
+    if params is not None:
+        body['params'] = params
+
+    return body
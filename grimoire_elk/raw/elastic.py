@@ -23,17 +23,22 @@
 """Ocean feeder for Elastic from  Perseval data"""
 
 
+import collections
 import inspect
 import logging
 
 from grimoirelab_toolkit.datetime import unixtime_to_datetime
 
 from datetime import datetime
+from ..elastic import REFRESH_NONE, BulkWriter
 from ..enriched.utils import get_repository_filter, anonymize_url
 from ..elastic_items import ElasticItems
 from ..elastic_mapping import Mapping
 from ..errors import ELKError
+from ..fingerprint import FingerprintStore, fingerprint
 from ..identities.identities import Identities
+from ..pipeline import run_pipeline
+from ..snapshot import RawSnapshot
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +51,17 @@ class ElasticOcean(ElasticItems):
 
     mapping = Mapping
     identities = Identities
+    # Max items between the stages of the feed (fetch, fix and write), which run in
+    # their own threads. If 0, the items are fed in one thread
+    pipeline_queue_size = 0
+    pipeline_spool_dir = None  # directory where the items fetched wait when the writes are behind
+    # Database with the fingerprints of the items uploaded, to skip the ones
+    # fetched again without changes. If None, all the items are uploaded
+    fingerprints_path = None
+    # Replays of Perceval archives (see `replay`): max items between the stages
+    # of the feed and size (in bytes) of the bulk requests, not limited by items
+    replay_queue_size = 10000
+    replay_max_bytes_bulk = 50 * 1024 * 1024
 
     @classmethod
     def add_params(cls, cmdline_parser):
@@ -228,45 +244,180 @@ class ElasticOcean(ElasticItems):
         self.feed_items(items)
         self.update_items()
 
+    def replay(self):
+        """Feed the items of the Perceval archive of the backend as fast as
+        possible, to rebuild the index.
+
+        The last items in the index are not checked, the archive is read in
+        its own thread while the items are fixed and uploaded, and one bulk
+        writer uploads all of them in packs of `replay_max_bytes_bulk` bytes.
+        The index is refreshed once, at the end, instead of on each bulk
+        request. To also disable its periodic refresh and its replicas, the
+        index must be in bulk-load mode (see `ElasticSearch.start_bulk_load`).
+        """
+        items = self.perceval_backend.fetch_from_archive()
+        self.feed_items(items, replay=True)
+
     def update_items(self):
         """Perform update operations over a raw index, just after the collection.
         It must be redefined in the raw connectors."""
 
         return
 
-    def feed_items(self, items):
+    def feed_items(self, items, replay=False):
+        """Fix and upload the items fetched by Perceval
+
+        :param items: iterator of the items
+        :param replay: if True, the items are replayed from an archive (see `replay`)
+        """
         task_init = datetime.now()
 
-        items_pack = []  # to feed item in packs
         drop = 0
         added = 0
-
-        for item in items:
-            # print("%s %s" % (item['url'], item['lastUpdated_date']))
-            # Add date field for incremental analysis if needed
-            self.add_update_date(item)
-            self._fix_item(item)
-            if self.project:
-                item['project'] = self.project
-            if self.anonymize:
-                self.identities.anonymize_item(item)
-            if len(items_pack) >= self.elastic.max_items_bulk:
-                self._items_to_es(items_pack)
-                items_pack = []
-            if not self.drop_item(item):
+        skipped = 0
+
+        # The items are also written to the local snapshot, if any
+        snapshot = RawSnapshot(self.raw_snapshot) if self.raw_snapshot else None
+
+        # Fingerprints of the items of this origin already uploaded, if they are kept.
+        # The replays rebuild the index, so their items are never skipped
+        store = None
+        index_uuid = self.elastic.get_index_uuid() if self.fingerprints_path and not replay else None
+        if index_uuid:
+            store = FingerprintStore(self.fingerprints_path)
+            origin = self.perceval_backend.origin if self.perceval_backend else ''
+            known = store.load(index_uuid, origin)
+
+        # One writer uploads the items of the whole run, so its bulk workers
+        # upload several packs at the same time
+        field_id = self.get_field_unique_id()
+        queue_size = self.pipeline_queue_size
+        if replay:
+            # The refresh policy of the client could be shared with other feeds
+            url = self.elastic.get_bulk_url() + '?refresh=' + REFRESH_NONE
+            writer = BulkWriter(self.elastic, url=url, max_bytes=self.replay_max_bytes_bulk, max_items=0)
+            queue_size = max(queue_size, self.replay_queue_size)
+        else:
+            writer = self.elastic.get_bulk_writer()
+
+        # Fingerprints of the items of the packs sent and not acknowledged yet, and
+        # of the items in the writer. They are saved once their packs are uploaded
+        pending = collections.deque()
+        unsent = {}
+
+        def save_fingerprints():
+            # The items of a pack not fully uploaded will be sent again
+            while pending and pending[0][0] <= writer.acknowledged and not writer.failed:
+                _, pack_fingerprints = pending.popleft()
+                store.save(index_uuid, origin, pack_fingerprints)
+                known.update(pack_fingerprints)
+
+        def write_pack(items_pack, pack_fingerprints):
+            nonlocal unsent
+
+            for item in items_pack:
+                writer.add(item[field_id], item)
+                if store:
+                    unsent[item['uuid']] = pack_fingerprints[item['uuid']]
+                    # The writer is empty when the item is sent with its pack
+                    if not len(writer):
+                        pending.append((writer.packs, unsent))
+                        unsent = {}
+            if snapshot:
+                snapshot.write(items_pack)
+            if store:
+                save_fingerprints()
+
+        def fix_items(items):
+            nonlocal added, drop
+
+            for item in items:
+                # Add date field for incremental analysis if needed
+                self.add_update_date(item)
+                self._fix_item(item)
+                if self.project:
+                    item['project'] = self.project
+                if self.anonymize:
+                    self.identities.anonymize_item(item)
+                if not self.drop_item(item):
+                    added += 1
+                    yield item
+                else:
+                    drop += 1
+
+        def write_items(items):
+            nonlocal skipped
+
+            items_pack = []  # to feed item in packs
+            pack_fingerprints = {}
+            for item in items:
+                if store:
+                    value = fingerprint(item)
+                    if known.get(item['uuid']) == value:
+                        skipped += 1
+                        continue
+                    pack_fingerprints[item['uuid']] = value
                 items_pack.append(item)
-                added += 1
-            else:
-                drop += 1
-        self._items_to_es(items_pack)
+                if len(items_pack) >= self.elastic.max_items_bulk:
+                    write_pack(items_pack, pack_fingerprints)
+                    items_pack = []
+                    pack_fingerprints = {}
+            write_pack(items_pack, pack_fingerprints)
+
+        try:
+            # The writer uploads the rest of items when it is closed
+            with writer:
+                if queue_size > 0:
+                    stats = run_pipeline(('fetch', items), [('fix', fix_items)], ('write', write_items),
+                                         queue_size, spool_dir=self.pipeline_spool_dir)
+                    for stage in stats:
+                        logger.info("[{}] Feed stage {}".format(
+                                    self.perceval_backend.__class__.__name__.lower(), stage))
+                else:
+                    write_items(fix_items(items))
+            if unsent:
+                pending.append((writer.packs, unsent))
+        finally:
+            if snapshot:
+                snapshot.close()
+            if store:
+                save_fingerprints()
+                store.close()
+        if replay:
+            self.elastic.refresh_index()
+        else:
+            self.elastic.refresh_if_needed(end_of_run=True)
+
+        if replay:
+            logger.info("[{}] Replayed {} items in {} bulk requests, {} failed".format(
+                        self.perceval_backend.__class__.__name__.lower(),
+                        writer.total, writer.packs, writer.failed))
+        else:
+            if writer.retried:
+                logger.info("[{}] {} JSON items rejected by ES were sent again".format(
+                            self.perceval_backend.__class__.__name__.lower(), writer.retried))
+            if writer.failed:
+                logger.warning("[{}] {}/{} missing JSON items, origin {}".format(
+                               self.perceval_backend.__class__.__name__.lower(), writer.failed,
+                               writer.total + writer.failed, anonymize_url(self.perceval_backend.origin)))
+
+        if store:
+            logger.info("[{}] Skipped {} unchanged items of {} fetched from {}".format(
+                        self.perceval_backend.__class__.__name__.lower(),
+                        skipped, added, anonymize_url(origin)))
 
         total_time_min = (datetime.now() - task_init).total_seconds() / 60
 
         logger.debug("[{}] Added {} items to index {}".format(
                      self.perceval_backend.__class__.__name__.lower(),
-                     added, self.elastic.index))
+                     added - skipped, self.elastic.index))
         logger.debug("[{}] Dropped {} items using drop_item filter".format(
                      self.perceval_backend.__class__.__name__.lower(), drop))
+        if self.anonymize:
+            cache = self.identities.hash_cache_info()
+            logger.debug("[{}] Pseudonyms memoized: {} hits, {} misses, {} cached".format(
+                         self.perceval_backend.__class__.__name__.lower(),
+                         cache.hits, cache.misses, cache.currsize))
         logger.debug("[{}] Finished in {:.2f} min".format(
                      self.perceval_backend.__class__.__name__.lower(),
                      total_time_min))
@@ -284,7 +435,16 @@ class ElasticOcean(ElasticItems):
 
         field_id = self.get_field_unique_id()
 
-        inserted = self.elastic.bulk_upload(json_items, field_id)
+        writer = self.elastic.get_bulk_writer()
+        with writer:
+            for item in json_items:
+                writer.add(item[field_id], item)
+
+        inserted = writer.total
+
+        if writer.retried:
+            logger.info("[{}] {} JSON items rejected by ES were sent again".format(
+                        self.perceval_backend.__class__.__name__.lower(), writer.retried))
 
         if len(json_items) != inserted:
             missing = len(json_items) - inserted
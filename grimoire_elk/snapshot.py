@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2020 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Local snapshot of the raw items.
+
+The raw items are stored compressed in a SQLite database, keyed by their
+uuid and indexed by origin, tag and update dates. The items collected can
+be enriched again from the snapshot, at local disk speed, without reading
+the raw index. Several processes can write to the same snapshot.
+"""
+
+import logging
+import sqlite3
+import threading
+import zlib
+
+from grimoirelab_toolkit.datetime import datetime_to_utc
+
+from . import codec
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS items (
+        uuid TEXT PRIMARY KEY,
+        origin TEXT,
+        tag TEXT,
+        updated_on REAL,
+        timestamp REAL,
+        item_offset INTEGER,
+        item BLOB NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS items_origin ON items (origin, timestamp, uuid)",
+    "CREATE INDEX IF NOT EXISTS items_tag ON items (tag, timestamp, uuid)",
+    "CREATE INDEX IF NOT EXISTS items_timestamp ON items (timestamp, uuid)",
+    "CREATE INDEX IF NOT EXISTS items_updated_on ON items (updated_on)"
+]
+# Fields of the raw items filtered with the columns of the snapshot
+COLUMNS = {
+    'uuid': 'uuid',
+    'origin': 'origin',
+    'tag': 'tag'
+}
+COMPRESS_LEVEL = 1
+LOCK_TIMEOUT = 60  # seconds waiting for the writes of other processes
+
+
+class RawSnapshot:
+    """Snapshot of the raw items in a SQLite database.
+
+    :param path: path of the database, created if it doesn't exist
+    """
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def write(self, items):
+        """Add the items to the snapshot, replacing the ones with the same uuid
+
+        :param items: list of raw items, with the fields added in the feed
+
+        :returns: number of items written
+        """
+        rows = [self._to_row(item) for item in items]
+        if not rows:
+            return 0
+
+        with self._lock:
+            if not self._conn:
+                self._conn = self._connect()
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+        return len(rows)
+
+    def read_pages(self, terms=None, from_date=None, offset=None, page_size=1000, after=None):
+        """Read the pages of items in the order of their `metadata__timestamp`,
+        as the raw index is read.
+
+        Each page is read with its own query, so the snapshot can be written
+        by other processes meanwhile. The terms on the fields without column
+        (e.g., `data.product`) are checked on the items read.
+
+        :param terms: list of (field, values) filters, each item must have
+            one of the values in each field
+        :param from_date: if not None, read only the items with `metadata__timestamp`
+            equal or after it
+        :param offset: if not None, read only the items with `offset` equal or after it
+        :param page_size: max number of items read at once from the database
+        :param after: if not None, uuid of the item after which the items are read
+        """
+        where = []
+        params = []
+        item_terms = []
+
+        for name, values in terms or []:
+            values = list(values)
+            if name in COLUMNS:
+                where.append("{} IN ({})".format(COLUMNS[name], ", ".join("?" * len(values))))
+                params.extend(values)
+            else:
+                item_terms.append((name, {term_value(value) for value in values}))
+
+        if from_date:
+            where.append("timestamp >= ?")
+            params.append(datetime_to_utc(from_date).timestamp())
+        if offset is not None:
+            where.append("item_offset >= ?")
+            params.append(int(offset))
+
+        query = "SELECT timestamp, uuid, item FROM items WHERE {} AND (timestamp, uuid) > (?, ?) " \
+                "ORDER BY timestamp, uuid LIMIT ?".format(" AND ".join(where) if where else "1")
+
+        conn = self._connect()
+        try:
+            # Keyset pagination, each page starts after the last item read
+            position = (float('-inf'), '')
+            if after:
+                row = conn.execute("SELECT timestamp FROM items WHERE uuid = ?", (after,)).fetchone()
+                if row:
+                    position = (row[0], after)
+            while True:
+                rows = conn.execute(query, params + [position[0], position[1], page_size]).fetchall()
+                if not rows:
+                    break
+
+                position = (rows[-1][0], rows[-1][1])
+                items = [codec.loads(zlib.decompress(row[2])) for row in rows]
+                if item_terms:
+                    items = [item for item in items if match_terms(item, item_terms)]
+                if items:
+                    yield items
+
+                if len(rows) < page_size:
+                    break
+        finally:
+            conn.close()
+
+    def count(self):
+        """Number of items in the snapshot"""
+
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        finally:
+            conn.close()
+
+    def close(self):
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+        return conn
+
+    @staticmethod
+    def _to_row(item):
+        data = zlib.compress(codec.dumpb(item), COMPRESS_LEVEL)
+
+        return (item['uuid'], item.get('origin'), item.get('tag'), item.get('updated_on'),
+                item.get('timestamp'), item.get('offset'), data)
+
+
+def term_value(value):
+    """Value of a field as it is compared in a term filter of ElasticSearch"""
+
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+
+    return str(value)
+
+
+def match_terms(item, terms):
+    """Check whether the item has one of the values of each term
+
+    :param item: raw item
+    :param terms: list of (field, values) with the dotted path of the field
+        (e.g., `data.product`) and the set of values as `term_value` returns them
+    """
+    for name, values in terms:
+        value = item
+        for key in name.split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+
+        field_values = value if isinstance(value, list) else [value]
+        if not any(v is not None and term_value(v) in values for v in field_values):
+            return False
+
+    return True
@@ -22,12 +22,14 @@
 
 import argparse
 import logging
+import shlex
 import sys
 
 import requests
 
 from grimoire_elk.errors import ElasticError
-from grimoire_elk.elastic import ElasticSearch
+from grimoire_elk.elastic import ElasticSearch, REFRESH_POLICIES
+from grimoire_elk.elastic_items import READERS
 # Connectors for Graal
 from graal.backends.core.coqua import CoQua, CoQuaCommand
 from graal.backends.core.cocom import CoCom, CoComCommand
@@ -290,7 +292,8 @@ def get_elastic(url, es_index, clean=None, backend=None, es_aliases=None, mappin
         insecure = True
         elastic = ElasticSearch(url=url, index=es_index, mappings=mapping,
                                 clean=clean, insecure=insecure,
-                                analyzers=analyzers, aliases=es_aliases)
+                                analyzers=analyzers, aliases=es_aliases,
+                                bootstrap_cache=True)
 
     except ElasticError:
         msg = "Can't connect to Elastic Search. Is it running?"
@@ -396,9 +399,89 @@ def get_params_parser():
     parser.add_argument('--only-studies', action='store_true', help="Execute only studies.")
     parser.add_argument('--bulk-size', default=1000, type=int,
                         help="Number of items per bulk request to Elasticsearch.")
+    parser.add_argument('--bulk-bytes', default=10 * 1024 * 1024, type=int,
+                        help="Max size in bytes of a bulk request to Elasticsearch (default 10 MB).")
+    parser.add_argument('--bulk-workers', default=1, type=int,
+                        help="Number of concurrent bulk requests to Elasticsearch (default 1).")
+    parser.add_argument('--gzip-level', type=int, choices=range(1, 10),
+                        help="Compress with gzip, using this level, the bulk and search requests to Elasticsearch.")
+    parser.add_argument('--gzip-min-size', type=int,
+                        help="Min size in bytes of the requests compressed with gzip (default 1024).")
+    parser.add_argument('--dead-letter-file', dest='dead_letter_file',
+                        help="File where the items rejected by Elasticsearch are stored to be replayed later.")
+    parser.add_argument('--refresh-policy', choices=REFRESH_POLICIES,
+                        help="Refresh policy of the bulk requests: never (false), wait for the next refresh "
+                             "(wait_for), on every request (true) or once at the end of the run (end).")
+    parser.add_argument('--bulk-load', action='store_true',
+                        help="Disable the refresh and the replicas of the indexes created from scratch "
+                             "while they are filled.")
+    parser.add_argument('--bulk-load-force-merge', dest='bulk_load_force_merge', type=int,
+                        help="Merge the indexes filled in bulk-load mode into this number of segments.")
     parser.add_argument('--scroll-wait', default=900, type=int, help="Wait for available scroll (default 900s)")
+    parser.add_argument('--max-scrolls', dest='max_scrolls', type=int,
+                        help="Max number of scrolls open at the same time by the process.")
+    parser.add_argument('--max-cluster-scrolls', dest='max_cluster_scrolls', type=int,
+                        help="Max number of scrolls open at the same time by all the processes using "
+                             "this option with the same Elasticsearch.")
     parser.add_argument('--scroll-size', default=100, type=int,
                         help="Number of items to get from Elasticsearch when scrolling.")
+    parser.add_argument('--adaptive-scroll-size', dest='adaptive_scroll_size', action='store_true',
+                        help="Adapt the number of items got from Elasticsearch to the size and latency of the pages.")
+    parser.add_argument('--scroll-size-min', dest='scroll_size_min', type=int,
+                        help="Min number of items got from Elasticsearch with adaptive scroll size (default 10).")
+    parser.add_argument('--scroll-size-max', dest='scroll_size_max', type=int,
+                        help="Max number of items got from Elasticsearch with adaptive scroll size (default 1000).")
+    parser.add_argument('--reader', choices=READERS,
+                        help="Read the items from Elasticsearch with scroll contexts (default) or "
+                             "paging with search_after.")
+    parser.add_argument('--scroll-slices', dest='scroll_slices', type=int,
+                        help="Number of slices of the indexes read concurrently when enriching (default 1). "
+                             "The items of the slices are not sorted by date, so it requires --no_incremental "
+                             "and a run stopped half way must be done again with --no_incremental.")
+    parser.add_argument('--prefetch-pages', dest='prefetch_pages', type=int,
+                        help="Number of pages read from Elasticsearch in background while the previous ones "
+                             "are processed (default 0).")
+    parser.add_argument('--stream-pages', dest='stream_pages', action='store_true',
+                        help="Decode the items of the pages read from Elasticsearch while they are received, "
+                             "without keeping the whole pages in memory.")
+    parser.add_argument('--raw-snapshot', dest='raw_snapshot',
+                        help="Path of a local SQLite snapshot where the raw items collected are also written.")
+    parser.add_argument('--read-raw-snapshot', dest='read_raw_snapshot', action='store_true',
+                        help="Read the raw items to enrich from the snapshot of --raw-snapshot instead of "
+                             "from Elasticsearch.")
+    parser.add_argument('--raw-fingerprints', dest='raw_fingerprints',
+                        help="Path of a local SQLite database with the fingerprints of the raw items uploaded, "
+                             "to skip the items fetched again without changes.")
+    parser.add_argument('--origins-file', dest='origins_file',
+                        help="File with the backend params of an origin per line, which are fed concurrently "
+                             "in this process. The backend params of the command line are added to every origin.")
+    parser.add_argument('--feed-workers', dest='feed_workers', type=int, default=1,
+                        help="Number of origins of --origins-file fed at the same time (default: 1).")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--feed-processes', dest='feed_processes', action='store_true', default=None,
+                       help="Feed the origins with processes (default for git and graal backends).")
+    group.add_argument('--feed-threads', dest='feed_processes', action='store_false',
+                       help="Feed the origins with threads (default for the rest of backends).")
+    parser.add_argument('--feed-pipeline', dest='feed_pipeline', type=int,
+                        help="Feed the raw items with a pipeline of stages (fetch, fix and write), each one "
+                             "in its own thread, keeping at most this number of items between them.")
+    parser.add_argument('--feed-spool-dir', dest='feed_spool_dir',
+                        help="Directory where the items fetched are spooled while the writes to "
+                             "Elasticsearch are behind (default: the temporary one).")
+    parser.add_argument('--replay-archive', dest='replay_archive', action='store_true',
+                        help="Rebuild the raw index replaying the Perceval archive as fast as possible: "
+                             "without incremental checks, in big bulk requests and with the index in "
+                             "bulk-load mode.")
+    parser.add_argument('--replay-bulk-bytes', dest='replay_bulk_bytes', type=int,
+                        help="Size in bytes of the bulk requests of --replay-archive (default 50 MB).")
+    parser.add_argument('--enrich-checkpoints', dest='enrich_checkpoints',
+                        help="Path of a local file with the checkpoints of the enrichment, to resume it "
+                             "from the last items uploaded when it is stopped. The enrichers uploading "
+                             "their items on their own (askbot, cocom, colic, discourse, dockerdeps, "
+                             "dockerhub, dockersmells, gerrit, github2, jira, meetup, pagure and "
+                             "stackexchange) are not resumed.")
+    parser.add_argument('--checkpoint-interval', dest='checkpoint_interval', type=int,
+                        help="Min seconds between the checkpoints of the enrichment (default: 60).")
     parser.add_argument('--pair-programming', action='store_true', help="Do pair programming in git enrich")
     parser.add_argument('--studies-list', nargs='*', help="List of studies to be executed")
     parser.add_argument('backend', help=argparse.SUPPRESS)
@@ -412,6 +495,24 @@ def get_params_parser():
     return parser
 
 
+def read_origins_file(path, backend_args=None):
+    """Read the backend params of the origins in a file, one per line.
+    Empty lines and lines starting with `#` are skipped.
+
+    :param path: path of the file
+    :param backend_args: list of params added to the ones of every origin
+    """
+    origins = []
+    with open(path) as fd:
+        for line in fd:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            origins.append(shlex.split(line) + list(backend_args or []))
+
+    return origins
+
+
 def get_params():
     """ Get params definition from ElasticOcean and from all the backends """
 
@@ -424,4 +525,9 @@ def get_params():
             print("[error] --index <name> param is required when collecting items from raw")
             sys.exit(1)
 
+    if args.scroll_slices and args.scroll_slices > 1 and not args.no_incremental:
+        # The incremental enrichments resume from the date of the last item enriched
+        print("[error] --scroll-slices requires --no_incremental, the items of the slices are not sorted")
+        sys.exit(1)
+
     return args
@@ -62,7 +62,8 @@ setup(name="grimoire-elk",
       python_requires='>=3.4',
       setup_requires=['wheel'],
       extras_require={'sortinghat': ['sortinghat'],
-                      'mysql': ['PyMySQL']},
+                      'mysql': ['PyMySQL'],
+                      'orjson': ['orjson']},
       tests_require=['httpretty==0.8.6'],
       test_suite='tests',
       scripts=["utils/p2o.py", "utils/gelk_mapping.py"],
@@ -32,6 +32,7 @@ from elasticsearch import Elasticsearch
 if '..' not in sys.path:
     sys.path.insert(0, '..')
 
+from grimoire_elk.elastic import ElasticSearch
 from grimoire_elk.elk import load_identities
 from grimoire_elk.utils import get_connectors, get_elastic
 from tests.model import ESMapping
@@ -145,6 +146,7 @@ class TestBaseBackend(unittest.TestCase):
     def tearDown(self):
         delete_test_idx = self.es_con + "/" + 'test*'
         requests.delete(delete_test_idx, verify=False)
+        ElasticSearch.clear_bootstrap_cache()
 
     def _test_items_to_raw(self):
         """Test whether fetched items are properly loaded to ES"""
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2020 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from grimoire_elk.checkpoint import CheckpointTracker, EnrichCheckpoints
+
+
+class MockWriter:
+    """Bulk writer flushing a pack every `max_items` items, acknowledged
+    only when `acknowledge` is called"""
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.items = 0
+        self.packs = 0
+        self.acknowledged = 0
+        self.total = 0
+
+    def __len__(self):
+        return self.items
+
+    def add(self):
+        self.items += 1
+        if self.items == self.max_items:
+            self.flush()
+
+    def flush(self):
+        if self.items:
+            self.packs += 1
+            self.total += self.items
+            self.items = 0
+
+    def acknowledge(self, packs):
+        self.acknowledged = packs
+
+
+def get_position(item):
+    return [item['timestamp'], item['uuid']]
+
+
+def make_items(num):
+    return [{'timestamp': i * 1000, 'uuid': str(i)} for i in range(num)]
+
+
+class TestEnrichCheckpoints(unittest.TestCase):
+    """Tests of the checkpoints stored in a local file"""
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='checkpoints_')
+        self.path = os.path.join(self.tmp_path, 'checkpoints.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_save_get_remove(self):
+        """Test whether the checkpoints are saved, read and removed by key"""
+
+        checkpoints = EnrichCheckpoints(self.path)
+        self.assertIsNone(checkpoints.get('git'))
+
+        checkpoints.save('git', {'position': [1000, 'a'], 'items': 1})
+        checkpoints.save('jira', {'position': [2000, 'b'], 'items': 2})
+        checkpoints.save('git', {'position': [3000, 'c'], 'items': 3})
+
+        checkpoints = EnrichCheckpoints(self.path)
+        self.assertDictEqual(checkpoints.get('git'), {'position': [3000, 'c'], 'items': 3})
+        self.assertDictEqual(checkpoints.get('jira'), {'position': [2000, 'b'], 'items': 2})
+
+        checkpoints.remove('git')
+        checkpoints.remove('unknown')
+        self.assertIsNone(checkpoints.get('git'))
+        self.assertDictEqual(checkpoints.get('jira'), {'position': [2000, 'b'], 'items': 2})
+        self.assertListEqual(sorted(os.listdir(self.tmp_path)), ['checkpoints.json', 'checkpoints.json.lock'])
+
+
+class TestCheckpointTracker(unittest.TestCase):
+    """Tests of the checkpoints of the enrichment"""
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='checkpoints_')
+        self.checkpoints = EnrichCheckpoints(os.path.join(self.tmp_path, 'checkpoints.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_acknowledged_packs(self):
+        """Test whether the position moves only to the items of the packs acknowledged"""
+
+        items = make_items(10)
+        writer = MockWriter(max_items=3)
+        tracker = CheckpointTracker(self.checkpoints, 'git', '0.1', get_position, interval=0)
+        self.assertIsNone(tracker.position)
+
+        for item in items[:7]:
+            writer.add()
+            tracker.item_done(item, writer)
+
+        self.assertEqual(writer.packs, 2)
+        self.assertIsNone(tracker.position)
+        self.assertIsNone(self.checkpoints.get('git'))
+
+        writer.acknowledge(1)
+        tracker.update(writer)
+        self.assertListEqual(tracker.position, [2000, '2'])
+        self.assertEqual(tracker.items, 3)
+
+        writer.acknowledge(2)
+        tracker.update(writer)
+        self.assertListEqual(tracker.position, [5000, '5'])
+        self.assertEqual(tracker.items, 6)
+
+        checkpoint = self.checkpoints.get('git')
+        self.assertListEqual(checkpoint['position'], [5000, '5'])
+        self.assertEqual(checkpoint['items'], 6)
+        self.assertEqual(checkpoint['uploaded'], 6)
+        self.assertEqual(checkpoint['version'], '0.1')
+
+        tracker.finish()
+        self.assertIsNone(self.checkpoints.get('git'))
+
+    def test_rich_items_split(self):
+        """Test whether the checkpoints are not taken in the middle of the rich items of a raw item"""
+
+        items = make_items(4)
+        writer = MockWriter(max_items=3)
+        tracker = CheckpointTracker(self.checkpoints, 'git', '0.1', get_position, interval=0)
+
+        # Each raw item generates two rich items
+        positions = []
+        for item in items:
+            writer.add()
+            writer.add()
+            writer.acknowledge(writer.packs)
+            tracker.item_done(item, writer)
+            positions.append((tracker.position, tracker.items))
+
+        # The 1st pack ends with the 1st rich item of the 2nd raw item
+        self.assertListEqual(positions, [(None, 0), ([0, '0'], 1), ([2000, '2'], 3), ([2000, '2'], 3)])
+        self.assertEqual(writer.packs, 2)
+
+    def test_resume(self):
+        """Test whether the tracking is resumed from the last checkpoint saved"""
+
+        items = make_items(10)
+        writer = MockWriter(max_items=2)
+        tracker = CheckpointTracker(self.checkpoints, 'git', '0.1', get_position, interval=3600)
+
+        for item in items[:5]:
+            writer.add()
+            writer.acknowledge(writer.packs)
+            tracker.item_done(item, writer)
+
+        # The checkpoints are saved after the interval or when the enrichment fails
+        self.assertIsNone(self.checkpoints.get('git'))
+        tracker.save(writer)
+
+        tracker = CheckpointTracker(self.checkpoints, 'git', '0.1', get_position, interval=0)
+        self.assertListEqual(tracker.position, [3000, '3'])
+        self.assertEqual(tracker.items, 4)
+        self.assertEqual(tracker.uploaded, 4)
+
+        writer = MockWriter(max_items=2)
+        for item in items[4:6]:
+            writer.add()
+            writer.acknowledge(writer.packs)
+            tracker.item_done(item, writer)
+
+        checkpoint = self.checkpoints.get('git')
+        self.assertListEqual(checkpoint['position'], [5000, '5'])
+        self.assertEqual(checkpoint['items'], 6)
+        self.assertEqual(checkpoint['uploaded'], 6)
+
+        # Other keys and versions don't resume the enrichment
+        tracker = CheckpointTracker(self.checkpoints, 'jira', '0.1', get_position)
+        self.assertIsNone(tracker.position)
+        tracker = CheckpointTracker(self.checkpoints, 'git', '0.2', get_position)
+        self.assertIsNone(tracker.position)
+        self.assertEqual(tracker.items, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2020 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import datetime
+import json
+import math
+import os
+import unittest
+import unittest.mock
+
+import grimoire_elk.codec as codec
+
+
+def read_file(filename):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), filename), encoding='utf-8') as f:
+        return f.read()
+
+
+UNICODE_VALUES = [
+    "Ñandú, ação, Größe",
+    "emoji \U0001F600 and CJK 中文",
+    "escapes \" \\ / \b \f \n \r \t",
+    "control \x00 \x01 \x1f \x7f",
+    "line separators \u2028 \u2029",
+    "lone surrogate \ud800",
+    "",
+]
+
+
+class TestCodec(unittest.TestCase):
+    """Round trip tests of the JSON codec. The objects decoded from the
+    codec output must be the same than the ones decoded by `json`"""
+
+    def assertRoundTrip(self, obj):
+        expected = json.loads(json.dumps(obj))
+
+        self.assertEqual(codec.loads(codec.dumps(obj)), expected)
+        self.assertEqual(codec.loads(codec.dumpb(obj)), expected)
+        self.assertEqual(json.loads(codec.dumps(obj)), expected)
+        self.assertEqual(json.loads(codec.dumpb(obj).decode('utf-8')), expected)
+        self.assertEqual(codec.loads(json.dumps(obj)), expected)
+
+    def test_mbox_items(self):
+        """Test whether the mbox items are decoded the same"""
+
+        raw = read_file('data/mbox.json')
+        items = json.loads(raw)
+
+        self.assertEqual(codec.loads(raw), items)
+        self.assertEqual(codec.loads(raw.encode('utf-8')), items)
+
+        for item in items:
+            self.assertRoundTrip(item)
+
+    def test_mbox_items_str_dates(self):
+        """Test whether dates stored as str are kept as str"""
+
+        items = codec.loads(read_file('data/mbox.json'))
+
+        for item in items:
+            self.assertIsInstance(item['updated_on'], float)
+            self.assertIsInstance(item['data']['Date'], str)
+            self.assertEqual(codec.loads(codec.dumps(item))['data']['Date'], item['data']['Date'])
+
+    def test_unicode(self):
+        """Test whether non-ASCII and escaped chars are decoded the same"""
+
+        for value in UNICODE_VALUES:
+            self.assertRoundTrip(value)
+            self.assertRoundTrip({value: [value]})
+
+        self.assertEqual(codec.loads('"\\u00d1and\\u00fa \\ud83d\\ude00"'), "Ñandú \U0001F600")
+        self.assertEqual(codec.loads('"\\ud800"'), "\ud800")
+
+    def test_numbers(self):
+        """Test whether numbers are decoded the same"""
+
+        values = [0, -1, 2 ** 63 - 1, 2 ** 64, -2 ** 70, 0.1, 1e-300, 1.7976931348623157e308, True, None]
+        for value in values:
+            self.assertRoundTrip(value)
+
+        self.assertTrue(math.isnan(codec.loads('NaN')))
+        self.assertEqual(codec.loads('[Infinity, -Infinity]'), [float('inf'), float('-inf')])
+
+    def test_non_str_keys(self):
+        """Test whether non-str keys are converted as `json` does"""
+
+        obj = {1: 'a', 1.5: 'b', False: 'c', None: 'd'}
+
+        self.assertEqual(codec.loads(codec.dumps(obj)), json.loads(json.dumps(obj)))
+
+    def test_datetime(self):
+        """Test whether datetimes aren't serialized, as in `json`"""
+
+        dt = datetime.datetime(2016, 12, 1, 10, 30, tzinfo=datetime.timezone.utc)
+
+        with self.assertRaises(TypeError):
+            codec.dumps({'date': dt})
+        with self.assertRaises(TypeError):
+            codec.dumpb([dt.date()])
+
+    def test_invalid_json(self):
+        """Test whether invalid documents raise ValueError"""
+
+        for data in ['', '{', '{"a": }', b'\xff']:
+            with self.assertRaises(ValueError):
+                codec.loads(data)
+
+    @unittest.mock.patch('grimoire_elk.codec.orjson', None)
+    def test_json_backend(self):
+        """Test whether `json` is used when there is no other backend"""
+
+        items = json.loads(read_file('data/mbox.json'))
+
+        self.assertEqual(codec.get_backend(), 'json')
+        for item in items:
+            self.assertEqual(codec.dumps(item), json.dumps(item))
+            self.assertEqual(codec.dumpb(item), json.dumps(item).encode('utf-8'))
+            self.assertRoundTrip(item)
+
+    def test_dumpb_canonical(self):
+        """Test whether the canonical encoding doesn't depend on the keys order nor the backend"""
+
+        items = json.loads(read_file('data/mbox.json'))
+
+        for item in items:
+            reordered = dict(reversed(list(item.items())))
+            encoded = codec.dumpb_canonical(item)
+            self.assertEqual(codec.dumpb_canonical(reordered), encoded)
+            self.assertEqual(encoded, json.dumps(item, sort_keys=True, separators=(',', ':'),
+                                                 ensure_ascii=False).encode('utf-8', 'surrogatepass'))
+
+            with unittest.mock.patch('grimoire_elk.codec.orjson', None):
+                self.assertEqual(codec.dumpb_canonical(reordered), encoded)
+
+
+class TestPageDecoder(unittest.TestCase):
+    """Tests of the incremental decoding of the search pages"""
+
+    def build_page(self, hits, indent=None):
+        page = {
+            "_scroll_id": "scroll-1",
+            "took": 2,
+            "_shards": {"total": 1, "failed": 0},
+            "hits": {"total": {"value": len(hits)}, "max_score": None, "hits": hits},
+            "pit_id": "pit-1"
+        }
+        return json.dumps(page, indent=indent).encode('utf-8')
+
+    def test_hits(self):
+        """Test whether the hits and fields of the page are decoded whatever the chunks read"""
+
+        items = json.loads(read_file('data/mbox.json'))
+        items.append({"text": "quotes \" \\\" and brackets ]}[{", "values": [1, -2.5e3, True, None, {}, []]})
+        items.extend({"unicode": value} for value in UNICODE_VALUES)
+        hits = [{"_id": str(i), "_source": item} for i, item in enumerate(items)]
+
+        for indent in [None, 2]:
+            body = self.build_page(hits, indent)
+            for size in [1, 3, 64, len(body)]:
+                page = codec.PageDecoder(body[i:i + size] for i in range(0, len(body), size))
+                page.start()
+                self.assertEqual(page.meta['_scroll_id'], "scroll-1")
+                self.assertDictEqual(page.meta['hits'], {"total": {"value": len(hits)}, "max_score": None})
+
+                self.assertListEqual(list(page.hits()), json.loads(body)['hits']['hits'])
+                self.assertEqual(page.meta['pit_id'], "pit-1")
+                self.assertEqual(page.num_hits, len(hits))
+                self.assertEqual(page.num_bytes, len(body))
+
+    def test_incremental(self):
+        """Test whether each hit is decoded before the next ones are read"""
+
+        hits = [{"_source": {"uuid": str(i), "data": "x" * 100}} for i in range(10)]
+        body = self.build_page(hits)
+        read = []
+
+        def chunks():
+            for i in range(0, len(body), 10):
+                read.append(i)
+                yield body[i:i + 10]
+
+        page = codec.PageDecoder(chunks())
+        for num, hit in enumerate(page.hits()):
+            self.assertEqual(hit['_source']['uuid'], str(num))
+            # The bytes read end in the next hit at most
+            if num + 2 < len(hits):
+                self.assertLess(read[-1], body.index(b'"uuid": "%d"' % (num + 2)))
+
+    def test_long_strings(self):
+        """Test whether long strings split in the chunks are decoded in linear time"""
+
+        hits = [{"_id": "0", "_source": {"data": "x" * 100000, "escaped": "x\\n" * 50000}}]
+        body = self.build_page(hits)
+
+        page = codec.PageDecoder([body[:50000], body[50000:150000], body[150000:]])
+        self.assertListEqual(list(page.hits()), hits)
+
+    def test_no_hits(self):
+        """Test whether pages without hits are decoded"""
+
+        for body, meta in [(b'{}', {}),
+                           (b' {"hits": {"total": 0, "hits": [ ]}} ', {"hits": {"total": 0}}),
+                           (b'{"error": {"type": "x"}, "status": 404}', {"error": {"type": "x"}, "status": 404})]:
+            page = codec.PageDecoder([body])
+            self.assertListEqual(list(page.hits()), [])
+            self.assertDictEqual(page.meta, meta)
+
+    def test_invalid_page(self):
+        """Test whether truncated or invalid pages raise ValueError"""
+
+        body = self.build_page([{"_source": {"uuid": "1"}}, {"_source": {"uuid": "2"}}])
+
+        for data in [body[:-1], body[:body.index(b'"2"')], b'', b'[]', b'{"hits" 1}']:
+            page = codec.PageDecoder([data])
+            with self.assertRaises(ValueError):
+                list(page.hits())
+
+    def test_close(self):
+        """Test whether the chunks are closed with the page"""
+
+        closed = []
+
+        def chunks():
+            try:
+                yield self.build_page([{"_source": {"uuid": "1"}}, {"_source": {"uuid": "2"}}])
+            finally:
+                closed.append(True)
+
+        page = codec.PageDecoder(chunks())
+        self.assertEqual(next(page.hits())['_source']['uuid'], "1")
+        page.close()
+        self.assertListEqual(closed, [True])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -52,7 +52,7 @@ class TestDockerhub(TestBaseBackend):
 
         result = self._test_raw_to_enrich()
         self.assertEqual(result['raw'], 1)
-        self.assertEqual(result['enrich'], 3)
+        self.assertEqual(result['enrich'], 2)
 
     def test_enrich_repo_labels(self):
         """Test whether the field REPO_LABELS is present in the enriched items"""
@@ -75,14 +75,14 @@ class TestDockerhub(TestBaseBackend):
 
         result = self._test_raw_to_enrich(sortinghat=True)
         self.assertEqual(result['raw'], 1)
-        self.assertEqual(result['enrich'], 3)
+        self.assertEqual(result['enrich'], 2)
 
     def test_raw_to_enrich_projects(self):
         """Test enrich with Projects"""
 
         result = self._test_raw_to_enrich(projects=True)
         self.assertEqual(result['raw'], 1)
-        self.assertEqual(result['enrich'], 3)
+        self.assertEqual(result['enrich'], 2)
 
     def test_copy_raw_fields(self):
         """Test copied raw fields"""
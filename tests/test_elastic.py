@@ -20,19 +20,32 @@
 #
 
 import configparser
+import gzip
 import json
 import os
 import random
+import shutil
 import string
+import tempfile
+import threading
+import time
 import unittest
 import unittest.mock
 
 import httpretty
 import requests
 
-from grimoire_elk.elastic import (ElasticSearch,
+from grimoire_elk.elastic import (BulkResult,
+                                  BulkUploader,
+                                  BulkWriter,
+                                  ElasticSearch,
                                   ElasticError,
+                                  REFRESH_END,
+                                  REFRESH_NONE,
+                                  REFRESH_TRUE,
+                                  REFRESH_WAIT_FOR,
                                   logger)
+from grimoire_elk.enriched.utils import grimoire_con
 from grimoire_elk.raw.git import GitOcean
 from grimoire_elk.raw.kitsune import KitsuneOcean
 from grimoire_elk.elastic_mapping import Mapping
@@ -50,6 +63,7 @@ class MockElasticSearch(ElasticSearch):
         self.major = major
         self.index_url = self.url + "/" + self.index
         self.mock_list_aliases = mock_list_alias
+        self.bulk_load_settings = None
 
     def list_aliases(self):
         if not self.mock_list_aliases:
@@ -79,6 +93,7 @@ class TestElastic(unittest.TestCase):
     def tearDown(self):
         target_index_url = self.es_con + "/" + self.target_index
         requests.delete(target_index_url, verify=False)
+        ElasticSearch.clear_bootstrap_cache()
 
     def test_init(self):
         """Test whether attributes are initialized"""
@@ -288,6 +303,90 @@ class TestElastic(unittest.TestCase):
         with self.assertRaises(ElasticError):
             _ = elastic.create_index()
 
+    @httpretty.activate
+    def test_bootstrap_cache(self):
+        """Test whether the setup of an index is done only when its settings change"""
+
+        es_con = "http://es6.com"
+        index_url = es_con + "/test_bootstrap"
+        http_requests = []
+
+        index_status = [200]
+
+        def request_callback(body):
+            def callback(method, uri, headers):
+                http_requests.append((method.method, method.path))
+                return 200, headers, body
+            return callback
+
+        def head_callback(method, uri, headers):
+            http_requests.append((method.method, method.path))
+            return index_status[0], headers, ''
+
+        httpretty.register_uri(httpretty.GET, es_con + "/",
+                               body=request_callback('{"version": {"number": "6.1.0"}}'))
+        httpretty.register_uri(httpretty.HEAD, index_url, body=head_callback)
+        httpretty.register_uri(httpretty.GET, index_url,
+                               body=request_callback('{}'))
+        httpretty.register_uri(httpretty.PUT, index_url + "/items/_mapping",
+                               body=request_callback('{}'))
+        httpretty.register_uri(httpretty.GET, es_con + "/_alias/A",
+                               body=request_callback('{}'))
+        httpretty.register_uri(httpretty.GET, es_con + "/_alias/B",
+                               body=request_callback('{}'))
+        httpretty.register_uri(httpretty.POST, es_con + "/_aliases",
+                               body=request_callback('{}'))
+        httpretty.register_uri(httpretty.GET, index_url + "/_alias",
+                               body=request_callback('{"test_bootstrap": {"aliases": {}}}'))
+
+        ElasticSearch.clear_bootstrap_cache()
+
+        ElasticSearch(es_con, "test_bootstrap", GitOcean.mapping, aliases=["A"], bootstrap_cache=True)
+        self.assertIn(('GET', '/'), http_requests)
+        self.assertIn(('PUT', '/test_bootstrap/items/_mapping'), http_requests)
+        self.assertIn(('POST', '/_aliases'), http_requests)
+
+        # Same settings, only the index is checked
+        http_requests.clear()
+        elastic = ElasticSearch(es_con, "test_bootstrap", GitOcean.mapping, aliases=["A"], bootstrap_cache=True)
+        self.assertEqual(elastic.major, '6')
+        self.assertEqual(http_requests, [('HEAD', '/test_bootstrap')])
+
+        # The index was deleted, it is set up again
+        http_requests.clear()
+        index_status[0] = 404
+        ElasticSearch(es_con, "test_bootstrap", GitOcean.mapping, aliases=["A"], bootstrap_cache=True)
+        self.assertIn(('PUT', '/test_bootstrap/items/_mapping'), http_requests)
+        index_status[0] = 200
+
+        # New alias, the index is set up again
+        ElasticSearch(es_con, "test_bootstrap", GitOcean.mapping, aliases=["A", "B"], bootstrap_cache=True)
+        self.assertNotIn(('GET', '/'), http_requests)
+        self.assertIn(('PUT', '/test_bootstrap/items/_mapping'), http_requests)
+
+        # The cache is not used by default
+        http_requests.clear()
+        ElasticSearch(es_con, "test_bootstrap", GitOcean.mapping, aliases=["A", "B"])
+        self.assertIn(('GET', '/'), http_requests)
+        self.assertIn(('PUT', '/test_bootstrap/items/_mapping'), http_requests)
+
+        # The index is forgotten
+        http_requests.clear()
+        ElasticSearch.clear_bootstrap_cache(es_con, "test_bootstrap")
+        ElasticSearch(es_con, "test_bootstrap", GitOcean.mapping, aliases=["A", "B"], bootstrap_cache=True)
+        self.assertNotIn(('GET', '/'), http_requests)
+        self.assertIn(('GET', '/test_bootstrap'), http_requests)
+
+        # The index is forgotten for any ES url
+        http_requests.clear()
+        ElasticSearch.clear_bootstrap_cache(index="test_bootstrap")
+        ElasticSearch(es_con, "test_bootstrap", GitOcean.mapping, aliases=["A", "B"], bootstrap_cache=True)
+        self.assertNotIn(('GET', '/'), http_requests)
+        self.assertNotIn(('HEAD', '/test_bootstrap'), http_requests)
+        self.assertIn(('GET', '/test_bootstrap'), http_requests)
+
+        ElasticSearch.clear_bootstrap_cache()
+
     def test_create_mappings(self):
         """Test whether a mapping is correctly created"""
 
@@ -373,6 +472,52 @@ class TestElastic(unittest.TestCase):
             self.assertRegex(cm.output[0],
                              'WARNING:grimoire_elk.elastic:Something went wrong when retrieving aliases*')
 
+    @httpretty.activate
+    def test_alias_in_use(self):
+        """Test whether the aliases are looked up one by one and remembered"""
+
+        es_con = "http://es6.com"
+        http_requests = []
+
+        def request_callback(status, body):
+            def callback(method, uri, headers):
+                http_requests.append((method.method, method.path))
+                return status, headers, body
+            return callback
+
+        httpretty.register_uri(httpretty.GET, es_con + "/_alias/A",
+                               body=request_callback(200, '{"index_a": {"aliases": {"A": {}}}}'))
+        httpretty.register_uri(httpretty.GET, es_con + "/_alias/B",
+                               body=request_callback(404, '{"error": "alias [B] missing", "status": 404}'))
+        httpretty.register_uri(httpretty.GET, es_con + "/index_b/_alias",
+                               body=request_callback(200, '{"index_b": {"aliases": {}}}'))
+        httpretty.register_uri(httpretty.POST, es_con + "/_aliases",
+                               body=request_callback(200, '{"acknowledged": true}'))
+
+        ElasticSearch.clear_alias_cache()
+        elastic_a = MockElasticSearch(es_con, "index_a")
+        elastic_b = MockElasticSearch(es_con, "index_b")
+
+        self.assertTrue(elastic_a.alias_in_use('A'))
+        self.assertTrue(elastic_b.alias_in_use({'alias': 'A'}))
+        self.assertFalse(elastic_b.alias_in_use('B'))
+        self.assertFalse(elastic_a.alias_in_use('B'))
+        self.assertListEqual(http_requests, [('GET', '/_alias/A'), ('GET', '/_alias/B')])
+
+        # The alias is looked up again once it is added
+        http_requests.clear()
+        elastic_b.add_alias('B')
+        elastic_b.alias_in_use('B')
+        self.assertListEqual(http_requests, [('GET', '/index_b/_alias'), ('POST', '/_aliases'), ('GET', '/_alias/B')])
+
+        # Expired aliases are looked up again
+        http_requests.clear()
+        elastic_a.alias_cache_ttl = 0
+        self.assertTrue(elastic_a.alias_in_use('A'))
+        self.assertListEqual(http_requests, [('GET', '/_alias/A')])
+
+        ElasticSearch.clear_alias_cache()
+
     def test_list_aliases(self):
         """Test whether the aliases of a given index are correctly listed"""
 
@@ -491,6 +636,155 @@ class TestElastic(unittest.TestCase):
 
         self.assertEqual(new_items, 0)
 
+    def test_bulk_upload_max_bytes(self):
+        """Test whether items are uploaded in packs limited by size"""
+
+        items = json.loads(read_file('data/git.json'))
+        elastic = ElasticSearch(self.es_con, self.target_index, GitOcean.mapping)
+        elastic.max_bytes_bulk = 1024
+
+        new_items = elastic.bulk_upload(items, field_id="uuid")
+        self.assertEqual(new_items, 11)
+
+    def test_bulk_writer(self):
+        """Test whether the bulk writer flushes the packs by size and number of items"""
+
+        items = json.loads(read_file('data/git.json'))
+        elastic = ElasticSearch(self.es_con, self.target_index, GitOcean.mapping)
+
+        writer = BulkWriter(elastic, max_bytes=10 * 1024 * 1024, max_items=5)
+        self.assertEqual(writer.url, elastic.get_bulk_url())
+
+        with writer:
+            for item in items:
+                writer.add(item['uuid'], item)
+
+        self.assertEqual(writer.total, 11)
+        self.assertEqual(writer.packs, 3)
+        self.assertEqual(writer.acknowledged, 3)
+        self.assertEqual(len(writer), 0)
+
+        writer = BulkWriter(elastic, max_bytes=1, max_items=0)
+        with writer:
+            for item in items:
+                writer.add(item['uuid'], item)
+
+        self.assertEqual(writer.total, 11)
+        self.assertEqual(writer.packs, 11)
+
+    def test_bulk_writer_workers(self):
+        """Test whether the packs are uploaded concurrently when using several workers"""
+
+        items = json.loads(read_file('data/git.json'))
+        elastic = ElasticSearch(self.es_con, self.target_index, GitOcean.mapping)
+
+        writer = BulkWriter(elastic, max_items=2, workers=3)
+        with writer:
+            for item in items:
+                writer.add(item['uuid'], item)
+
+        self.assertEqual(writer.total, 11)
+        self.assertEqual(writer.failed, 0)
+        self.assertEqual(writer.packs, 6)
+
+    @httpretty.activate
+    def test_bulk_writer_workers_failed_items(self):
+        """Test whether the items not inserted are counted when using several workers"""
+
+        es_con = "http://es7.com"
+        bulk_url = es_con + "/" + self.target_index + "/_bulk"
+
+        def request_callback(method, uri, headers):
+            items = [{"index": {"_id": "1", "status": 201}},
+                     {"index": {"_id": "2", "status": 400, "error": {"type": "mapper_parsing_exception"}}}]
+            return 200, headers, json.dumps({"errors": True, "items": items})
+
+        httpretty.register_uri(httpretty.PUT,
+                               bulk_url,
+                               body=request_callback)
+
+        elastic = MockElasticSearch(es_con, self.target_index, major='7')
+        writer = BulkWriter(elastic, max_items=2, workers=2)
+        with writer:
+            for i in range(8):
+                writer.add(str(i), {"uuid": str(i)})
+
+        self.assertEqual(writer.total, 4)
+        self.assertEqual(writer.failed, 4)
+        self.assertEqual(writer.packs, 4)
+        self.assertEqual(writer.acknowledged, 4)
+
+    def test_bulk_uploader_acknowledged(self):
+        """Test whether only the packs uploaded after the previous ones are acknowledged"""
+
+        elastic = MockElasticSearch("http://es7.com", self.target_index, major='7')
+        url = elastic.get_bulk_url()
+        release = threading.Event()
+        uploaded = threading.Semaphore(0)
+
+        def put_bulk_pack(url, bulk_json):
+            if bulk_json == b'slow':
+                release.wait()
+            elif bulk_json == b'error':
+                raise ElasticError(cause="Error uploading pack")
+            uploaded.release()
+            return BulkResult(1, 0, 0)
+
+        with unittest.mock.patch.object(elastic, 'put_bulk_pack', side_effect=put_bulk_pack):
+            uploader = BulkUploader(elastic, workers=3)
+            uploader.submit(url, b'fast', 1)
+            uploader.submit(url, b'slow', 1)
+            uploader.submit(url, b'fast', 1)
+            uploaded.acquire()
+            uploaded.acquire()
+            time.sleep(0.1)
+
+            uploader.submit(url, b'fast', 1)
+            self.assertEqual(uploader.submitted, 4)
+            self.assertEqual(uploader.acknowledged, 1)
+
+            release.set()
+            uploader.wait()
+            self.assertEqual(uploader.acknowledged, 4)
+
+            uploader.submit(url, b'error', 1)
+            with self.assertRaises(ElasticError):
+                uploader.wait()
+            uploader.submit(url, b'fast', 1)
+            uploader.close()
+
+        self.assertEqual(uploader.submitted, 6)
+        self.assertEqual(uploader.acknowledged, 4)
+        self.assertEqual(uploader.inserted, 5)
+        self.assertEqual(uploader.failed, 1)
+
+    def test_bulk_writer_workers_error(self):
+        """Test whether the counters include the packs uploaded when the writer exits with an error"""
+
+        elastic = MockElasticSearch("http://es7.com", self.target_index, major='7')
+
+        with unittest.mock.patch.object(elastic, 'put_bulk_pack', return_value=BulkResult(2, 0, 0)):
+            writer = BulkWriter(elastic, max_items=2, workers=2)
+            with self.assertRaises(ValueError):
+                with writer:
+                    for i in range(6):
+                        writer.add(str(i), {"uuid": str(i)})
+                    raise ValueError("feed failed")
+
+        self.assertEqual(writer.packs, 3)
+        self.assertEqual(writer.total, 6)
+        self.assertEqual(writer.acknowledged, 3)
+
+    def test_bulk_writer_no_items(self):
+        """Test whether nothing is uploaded when no items are added to the bulk writer"""
+
+        elastic = ElasticSearch(self.es_con, self.target_index, GitOcean.mapping)
+        writer = elastic.get_bulk_writer()
+
+        self.assertEqual(writer.flush(), 0)
+        self.assertEqual(writer.total, 0)
+        self.assertEqual(writer.packs, 0)
+
     def test_safe_put_bulk(self):
         """Test whether items are correctly stored to the index"""
 
@@ -523,6 +817,164 @@ class TestElastic(unittest.TestCase):
 
         self.assertEqual(inserted_items, 0)
 
+    @httpretty.activate
+    def test_put_bulk_retries(self):
+        """Test whether the items rejected by an overloaded cluster are sent again"""
+
+        es_con = "http://es7.com"
+        bulk_url = es_con + "/" + self.target_index + "/_bulk"
+        http_requests = []
+
+        def request_callback(method, uri, headers):
+            body = method.body.decode('utf-8')
+            http_requests.append(body)
+            if len(http_requests) == 1:
+                items = [{"index": {"_id": "1", "status": 201}},
+                         {"index": {"_id": "2", "status": 429,
+                                    "error": {"type": "es_rejected_execution_exception"}}},
+                         {"index": {"_id": "3", "status": 400,
+                                    "error": {"type": "mapper_parsing_exception"}}}]
+            else:
+                items = [{"index": {"_id": "2", "status": 201}}]
+            return 200, headers, json.dumps({"errors": len(http_requests) == 1, "items": items})
+
+        httpretty.register_uri(httpretty.PUT,
+                               bulk_url,
+                               body=request_callback)
+
+        elastic = MockElasticSearch(es_con, self.target_index, major='7')
+        elastic.retry_backoff_bulk = 0
+
+        bulk_json = ""
+        for i in range(1, 4):
+            bulk_json += '{{"index" : {{"_id" : "{}" }} }}\n'.format(i)
+            bulk_json += json.dumps({"uuid": str(i)}) + "\n"
+
+        with self.assertLogs(logger, level='WARNING') as cm:
+            result = elastic.put_bulk(elastic.get_bulk_url(), bulk_json)
+            self.assertRegex(cm.output[0], "WARNING:grimoire_elk.elastic:1 items rejected by ES, retrying*")
+            self.assertRegex(cm.output[1], "ERROR:grimoire_elk.elastic:Failed to insert data to ES*")
+
+        self.assertEqual(result.inserted, 2)
+        self.assertEqual(result.retried, 1)
+        self.assertEqual(result.dropped, 1)
+        self.assertEqual(len(http_requests), 2)
+        self.assertEqual(http_requests[1], '{"index" : {"_id" : "2" } }\n{"uuid": "2"}\n')
+
+    @httpretty.activate
+    def test_put_bulk_max_retries(self):
+        """Test whether the rejected items are dropped after the max number of retries"""
+
+        es_con = "http://es7.com"
+        bulk_url = es_con + "/" + self.target_index + "/_bulk"
+        body = {
+            "errors": True,
+            "items": [{"index": {"_id": "1", "status": 503, "error": {"type": "unavailable_shards_exception"}}}]
+        }
+        httpretty.register_uri(httpretty.PUT,
+                               bulk_url,
+                               body=json.dumps(body),
+                               status=200)
+
+        elastic = MockElasticSearch(es_con, self.target_index, major='7')
+        elastic.retry_backoff_bulk = 0
+        elastic.max_retries_bulk = 2
+
+        bulk_json = '{"index" : {"_id" : "1" } }\n{"uuid": "1"}\n'
+        with self.assertLogs(logger, level='ERROR') as cm:
+            result = elastic.put_bulk(elastic.get_bulk_url(), bulk_json)
+            self.assertRegex(cm.output[0], "ERROR:grimoire_elk.elastic:Max retries exceeded*")
+
+        self.assertEqual(result.inserted, 0)
+        self.assertEqual(result.retried, 2)
+        self.assertEqual(result.dropped, 1)
+
+    @httpretty.activate
+    def test_dead_letters(self):
+        """Test whether the items not inserted are stored in the dead letter file and replayed"""
+
+        es_con = "http://es7.com"
+        bulk_url = es_con + "/" + self.target_index + "/_bulk"
+        http_requests = []
+
+        def request_callback(method, uri, headers):
+            http_requests.append(method.body.decode('utf-8'))
+            if len(http_requests) == 1:
+                items = [{"index": {"_id": "1", "status": 201}},
+                         {"index": {"_id": "2", "status": 400,
+                                    "error": {"type": "mapper_parsing_exception"}}}]
+                return 200, headers, json.dumps({"errors": True, "items": items})
+            return 200, headers, json.dumps({"errors": False, "items": [{"index": {"_id": "2", "status": 201}}]})
+
+        httpretty.register_uri(httpretty.PUT,
+                               bulk_url,
+                               body=request_callback)
+
+        dead_letter_dir = tempfile.mkdtemp(prefix='dead_letters_')
+        elastic = MockElasticSearch(es_con, self.target_index, major='7')
+        elastic.dead_letter_path = os.path.join(dead_letter_dir, 'dead_letters.ndjson')
+
+        bulk_json = '{"index" : {"_id" : "1" } }\n{"uuid": "1"}\n'
+        bulk_json += '{"index" : {"_id" : "2" } }\n{"uuid": "2"}\n'
+        inserted = elastic.safe_put_bulk(elastic.get_bulk_url(), bulk_json)
+        self.assertEqual(inserted, 1)
+
+        with open(elastic.dead_letter_path) as fd:
+            lines = fd.read().splitlines()
+
+        self.assertEqual(len(lines), 2)
+        self.assertDictEqual(json.loads(lines[0]), {"index": {"_id": "2", "_index": self.target_index}})
+        self.assertDictEqual(json.loads(lines[1]), {"uuid": "2"})
+
+        replayed = elastic.replay_dead_letters()
+        self.assertEqual(replayed, 1)
+        self.assertEqual(http_requests[1], '{"index" : {"_id" : "2" } }\n{"uuid": "2"}\n')
+
+        shutil.rmtree(dead_letter_dir)
+
+    @httpretty.activate
+    def test_safe_put_bulk_gzip(self):
+        """Test whether the bulk requests are compressed with gzip when enabled"""
+
+        es_con = "http://es7.com"
+        bulk_url = es_con + "/" + self.target_index + "/_bulk"
+        http_requests = []
+
+        def request_callback(method, uri, headers):
+            http_requests.append(method)
+            items = [{"index": {"_id": str(i), "status": 201}} for i in range(11)]
+            return 200, headers, json.dumps({"errors": False, "items": items})
+
+        httpretty.register_uri(httpretty.PUT,
+                               bulk_url,
+                               body=request_callback)
+
+        items = json.loads(read_file('data/git.json'))
+        bulk_json = ""
+        for item in items:
+            bulk_json += '{{"index" : {{"_id" : "{}" }} }}\n'.format(item['uuid'])
+            bulk_json += json.dumps(item) + "\n"
+
+        elastic = MockElasticSearch(es_con, self.target_index, major='7')
+        elastic.requests = grimoire_con()
+        elastic.requests.get_adapter(es_con).compress_level = 6
+
+        inserted_items = elastic.safe_put_bulk(elastic.get_bulk_url(), bulk_json)
+        self.assertEqual(inserted_items, 11)
+
+        request = http_requests[0]
+        self.assertEqual(request.headers['Content-Encoding'], 'gzip')
+        self.assertLess(int(request.headers['Content-Length']), len(bulk_json))
+        self.assertEqual(gzip.decompress(request.body).decode('utf-8'), bulk_json)
+
+        # Small bodies are not compressed
+        elastic.requests.get_adapter(es_con).compress_min_size = len(bulk_json) + 1
+        elastic.safe_put_bulk(elastic.get_bulk_url(), bulk_json)
+
+        request = http_requests[1]
+        self.assertNotIn('Content-Encoding', request.headers)
+        self.assertEqual(request.body.decode('utf-8'), bulk_json)
+
     def test_get_bulk_url(self):
         """Test that the bulk_url is correctly formed"""
 
@@ -535,6 +987,201 @@ class TestElastic(unittest.TestCase):
         expected_url = elastic.url + '/' + elastic.index + '/items/_bulk'
         self.assertEqual(elastic.get_bulk_url(), expected_url)
 
+    def test_get_refresh_param(self):
+        """Test whether the refresh param is set according to the refresh policy"""
+
+        elastic = MockElasticSearch(self.es_con, self.target_index, major='7')
+        self.assertEqual(elastic.refresh_policy, REFRESH_TRUE)
+        self.assertEqual(elastic.get_refresh_param(), '?refresh=true')
+
+        elastic.refresh_policy = REFRESH_WAIT_FOR
+        self.assertEqual(elastic.get_refresh_param(), '?refresh=wait_for')
+
+        elastic.refresh_policy = REFRESH_NONE
+        self.assertEqual(elastic.get_refresh_param(), '')
+
+        elastic.refresh_policy = REFRESH_END
+        self.assertEqual(elastic.get_refresh_param(), '')
+
+    @httpretty.activate
+    def test_refresh_if_needed(self):
+        """Test whether the index is refreshed only when the refresh policy requires it"""
+
+        es_con = "http://es7.com"
+        refresh_url = es_con + "/" + self.target_index + "/_refresh"
+        http_requests = []
+
+        def request_callback(method, uri, headers):
+            http_requests.append(uri)
+            return 200, headers, '{"_shards": {"total": 2, "successful": 1, "failed": 0}}'
+
+        httpretty.register_uri(httpretty.POST,
+                               refresh_url,
+                               body=request_callback)
+
+        elastic = MockElasticSearch(es_con, self.target_index, major='7')
+
+        elastic.refresh_policy = REFRESH_TRUE
+        elastic.refresh_if_needed()
+        elastic.refresh_if_needed(end_of_run=True)
+        self.assertEqual(len(http_requests), 0)
+
+        elastic.refresh_policy = REFRESH_NONE
+        elastic.refresh_if_needed(end_of_run=True)
+        self.assertEqual(len(http_requests), 0)
+        elastic.refresh_if_needed()
+        self.assertEqual(len(http_requests), 1)
+
+        elastic.refresh_policy = REFRESH_END
+        elastic.refresh_if_needed(end_of_run=True)
+        self.assertEqual(http_requests, [refresh_url, refresh_url])
+
+    @httpretty.activate
+    def test_put_bulk_refresh_url(self):
+        """Test whether the refresh param of the bulk URL is kept instead of the one of the policy"""
+
+        es_con = "http://es7.com"
+        bulk_url = es_con + "/" + self.target_index + "/_bulk"
+
+        httpretty.register_uri(httpretty.PUT, bulk_url, body='{"errors": false, "items": []}')
+
+        elastic = MockElasticSearch(es_con, self.target_index, major='7')
+        self.assertEqual(elastic.refresh_policy, REFRESH_TRUE)
+
+        elastic.put_bulk(bulk_url, '{"index" : {"_id" : "1" } }\n{}\n')
+        self.assertDictEqual(httpretty.last_request().querystring, {'refresh': ['true']})
+
+        elastic.put_bulk(bulk_url + '?refresh=false', '{"index" : {"_id" : "1" } }\n{}\n')
+        self.assertDictEqual(httpretty.last_request().querystring, {'refresh': ['false']})
+
+    def test_safe_put_bulk_refresh_end(self):
+        """Test whether items uploaded without refresh are visible once the index is refreshed"""
+
+        items = json.loads(read_file('data/git.json'))
+        elastic = ElasticSearch(self.es_con, self.target_index, GitOcean.mapping)
+        elastic.refresh_policy = REFRESH_END
+
+        new_items = elastic.bulk_upload(items, field_id="uuid")
+        self.assertEqual(new_items, 11)
+
+        elastic.refresh_if_needed(end_of_run=True)
+        r = requests.get(elastic.index_url + "/_count", verify=False)
+        self.assertEqual(r.json()['count'], 11)
+
+    def test_bulk_load(self):
+        """Test whether an index created in bulk-load mode recovers its settings"""
+
+        items = json.loads(read_file('data/git.json'))
+        elastic = ElasticSearch(self.es_con, self.target_index, GitOcean.mapping, bulk_load=True)
+        elastic.bulk_load_timeout = '1s'
+
+        r = requests.get(elastic.index_url + "/_settings?flat_settings=true", verify=False)
+        settings = r.json()[self.target_index]['settings']
+        self.assertEqual(settings['index.refresh_interval'], '-1')
+        self.assertEqual(settings['index.number_of_replicas'], '0')
+
+        new_items = elastic.bulk_upload(items, field_id="uuid")
+        self.assertEqual(new_items, 11)
+
+        elastic.end_bulk_load(force_merge=1)
+        self.assertIsNone(elastic.bulk_load_settings)
+
+        r = requests.get(elastic.index_url + "/_count", verify=False)
+        self.assertEqual(r.json()['count'], 11)
+
+        r = requests.get(elastic.index_url + "/_settings?flat_settings=true", verify=False)
+        settings = r.json()[self.target_index]['settings']
+        self.assertNotIn('index.refresh_interval', settings)
+        self.assertNotEqual(settings['index.number_of_replicas'], '0')
+
+    @httpretty.activate
+    def test_bulk_load_requests(self):
+        """Test whether the bulk-load mode is set and ended with the expected requests"""
+
+        es_con = "http://es6.com"
+        index_url = es_con + "/test_bulk_load"
+        http_requests = []
+
+        def request_callback(status, body):
+            def callback(method, uri, headers):
+                http_requests.append((method.method, uri.replace(es_con, '').split('?')[0],
+                                      method.body.decode('utf-8'), method.querystring))
+                return status, headers, body
+            return callback
+
+        settings = '{"test_bulk_load": {"settings": {"index.number_of_replicas": "1"}}}'
+        httpretty.register_uri(httpretty.GET, es_con + "/",
+                               body=request_callback(200, '{"version": {"number": "6.1.0"}}'))
+        httpretty.register_uri(httpretty.GET, index_url,
+                               body=request_callback(404, '{}'))
+        httpretty.register_uri(httpretty.PUT, index_url,
+                               body=request_callback(200, '{}'))
+        httpretty.register_uri(httpretty.GET, index_url + "/_settings",
+                               body=request_callback(200, settings))
+        httpretty.register_uri(httpretty.PUT, index_url + "/_settings",
+                               body=request_callback(200, '{}'))
+        httpretty.register_uri(httpretty.PUT, index_url + "/items/_bulk",
+                               body=request_callback(200, '{"errors": false, "items": []}'))
+        httpretty.register_uri(httpretty.POST, index_url + "/_refresh",
+                               body=request_callback(200, '{}'))
+        httpretty.register_uri(httpretty.POST, index_url + "/_forcemerge",
+                               body=request_callback(200, '{}'))
+        httpretty.register_uri(httpretty.GET, es_con + "/_cluster/health/test_bulk_load",
+                               body=request_callback(200, '{"status": "green", "timed_out": false}'))
+
+        elastic = ElasticSearch(es_con, "test_bulk_load", bulk_load=True)
+        self.assertDictEqual(elastic.bulk_load_settings,
+                             {'index.refresh_interval': None, 'index.number_of_replicas': '1'})
+        self.assertEqual(http_requests[-1][:3],
+                         ('PUT', '/test_bulk_load/_settings',
+                          '{"index.refresh_interval": "-1", "index.number_of_replicas": 0}'))
+
+        # The bulk requests don't refresh the index
+        self.assertEqual(elastic.get_refresh_param(), '')
+        elastic.safe_put_bulk(elastic.get_bulk_url(), '{"index" : {"_id" : "1" } }\n{}\n')
+        self.assertEqual(http_requests[-1][:2], ('PUT', '/test_bulk_load/items/_bulk'))
+
+        http_requests.clear()
+        elastic.end_bulk_load()
+        self.assertIsNone(elastic.bulk_load_settings)
+        self.assertEqual(elastic.get_refresh_param(), '?refresh=true')
+        self.assertListEqual([r[:2] for r in http_requests],
+                             [('PUT', '/test_bulk_load/_settings'),
+                              ('POST', '/test_bulk_load/_refresh'),
+                              ('GET', '/_cluster/health/test_bulk_load')])
+        self.assertEqual(http_requests[0][2], '{"index.refresh_interval": null, "index.number_of_replicas": "1"}')
+        self.assertDictEqual(http_requests[2][3], {'wait_for_status': ['green'], 'timeout': ['5m']})
+
+        # Nothing else is done once ended
+        http_requests.clear()
+        elastic.end_bulk_load()
+        self.assertListEqual(http_requests, [])
+
+    @httpretty.activate
+    def test_get_index_uuid(self):
+        """Test whether the UUIDs of the indexes are retrieved"""
+
+        es_con = "http://es6.com"
+        settings = {
+            "test_uuid_2": {"settings": {"index": {"uuid": "uuid-b"}}},
+            "test_uuid_1": {"settings": {"index": {"uuid": "uuid-a"}}}
+        }
+        httpretty.register_uri(httpretty.GET, es_con + "/test_uuid/_settings/index.uuid",
+                               body=json.dumps({"test_uuid": settings["test_uuid_1"]}))
+        httpretty.register_uri(httpretty.GET, es_con + "/test_alias/_settings/index.uuid",
+                               body=json.dumps(settings))
+        httpretty.register_uri(httpretty.GET, es_con + "/test_missing/_settings/index.uuid",
+                               body='{}', status=404)
+
+        elastic = MockElasticSearch(es_con, "test_uuid")
+        self.assertEqual(elastic.get_index_uuid(), "uuid-a")
+
+        elastic = MockElasticSearch(es_con, "test_alias")
+        self.assertEqual(elastic.get_index_uuid(), "uuid-a,uuid-b")
+
+        elastic = MockElasticSearch(es_con, "test_missing")
+        self.assertIsNone(elastic.get_index_uuid())
+
     def test_get_mapping_url(self):
         """Test that the mapping_url is correctly formed"""
 
@@ -650,6 +1297,81 @@ class TestElastic(unittest.TestCase):
         last_offset = elastic.get_last_offset('offset', filters_=[fltr])
         self.assertEqual(last_offset, 1)
 
+    def test_get_last_items_field(self):
+        """Test whether the date/offset of the last item of several values are returned at once"""
+
+        items = json.loads(read_file('data/git.json'))
+        elastic = ElasticSearch(self.es_con, self.target_index, GitOcean.mapping)
+        new_items = elastic.bulk_upload(items, field_id="uuid")
+        self.assertEqual(new_items, 11)
+
+        last_dates = elastic.get_last_items_field('updated_on', 'perceval_version', ['0.9.11', '0.9.12', '0.0.0'])
+        self.assertEqual(last_dates['0.9.11'].isoformat(), '2014-02-12T06:09:04+00:00')
+        self.assertIsNone(last_dates['0.0.0'])
+
+        last_dates = elastic.get_last_items_field('updated_on', 'origin', ['/tmp/perceval_mc84igfc/gittest'])
+        self.assertEqual(last_dates['/tmp/perceval_mc84igfc/gittest'].isoformat(), '2014-02-12T06:11:12+00:00')
+
+        items = json.loads(read_file('data/kitsune.json'))
+        elastic = ElasticSearch(self.es_con, self.target_index, KitsuneOcean.mapping, clean=True)
+        new_items = elastic.bulk_upload(items, field_id="uuid")
+        self.assertEqual(new_items, 4)
+
+        last_offsets = elastic.get_last_items_field('offset', 'origin', ['http://example.com'], offset=True)
+        self.assertDictEqual(last_offsets, {'http://example.com': 3})
+
+    @httpretty.activate
+    def test_prefetch_last_items(self):
+        """Test whether the dates of the last items prefetched are returned without querying the index"""
+
+        es_con = "http://es6.com"
+        http_requests = []
+
+        def request_callback(method, uri, headers):
+            query = json.loads(method.body.decode('utf-8'))
+            http_requests.append(query)
+            if 'values' in query['aggs']:
+                body = {"aggregations": {"values": {"buckets": [
+                    {"key": "A", "doc_count": 2, "1": {"value": 1570000000000,
+                                                       "value_as_string": "2019-10-02T07:06:40.000Z"}},
+                    {"key": "B", "doc_count": 1, "1": {"value": 1560000000000,
+                                                       "value_as_string": "2019-06-08T13:20:00.000Z"}}
+                ]}}}
+            else:
+                body = {"aggregations": {"1": {"value": None}}}
+            return 200, headers, json.dumps(body)
+
+        httpretty.register_uri(httpretty.POST, es_con + "/test_last/_search", body=request_callback)
+
+        ElasticSearch.clear_last_items_cache()
+        elastic = MockElasticSearch(es_con, "test_last")
+        last_dates = elastic.prefetch_last_items('metadata__updated_on', 'origin', ['A', 'B', 'C'])
+
+        self.assertEqual(len(http_requests), 1)
+        self.assertListEqual(sorted(http_requests[0]['query']['bool']['filter'][0]['terms']['origin']),
+                             ['A', 'B', 'C'])
+        self.assertEqual(last_dates['A'].isoformat(), '2019-10-02T07:06:40+00:00')
+        self.assertIsNone(last_dates['C'])
+
+        # Prefetched values are answered without requests until the cache is cleared
+        fltr = {'name': 'origin', 'value': 'B'}
+        self.assertEqual(elastic.get_last_date('metadata__updated_on', [fltr]).isoformat(),
+                         '2019-06-08T13:20:00+00:00')
+        self.assertIsNone(elastic.get_last_date('metadata__updated_on', [{'name': 'origin', 'value': 'C'}]))
+        self.assertEqual(elastic.get_last_date('metadata__updated_on', [fltr]).isoformat(),
+                         '2019-06-08T13:20:00+00:00')
+        self.assertEqual(len(http_requests), 1)
+
+        # Other fields or filters are not prefetched
+        fltr = {'name': 'origin', 'value': 'A'}
+        elastic.get_last_date('grimoire_creation_date', [fltr])
+        elastic.get_last_date('metadata__updated_on', [fltr, {'name': 'tag', 'value': 'A'}])
+        self.assertEqual(len(http_requests), 3)
+
+        ElasticSearch.clear_last_items_cache()
+        elastic.get_last_date('metadata__updated_on', [fltr])
+        self.assertEqual(len(http_requests), 4)
+
     def test_get_last_item_field(self):
         """Test whether the date/offset of the last item is correctly returned"""
 
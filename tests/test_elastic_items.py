@@ -23,14 +23,27 @@ import configparser
 import logging
 import json
 import os
+import shutil
+import socketserver
+import tempfile
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
 
+import httpretty
 import requests
 
 from grimoire_elk.elastic import ElasticSearch
-from grimoire_elk.elastic_items import (ElasticItems,
+from grimoire_elk.errors import ElasticError
+from grimoire_elk.elastic_items import (ClusterScrollSlots,
+                                        ElasticItems,
+                                        PageSizer,
+                                        ScrollBudget,
+                                        SEARCH_AFTER_READER,
                                         logger)
-from grimoirelab_toolkit.datetime import str_to_datetime
+from grimoire_elk.snapshot import RawSnapshot
+from grimoirelab_toolkit.datetime import str_to_datetime, unixtime_to_datetime
 from grimoire_elk.raw.kitsune import KitsuneOcean
 from grimoire_elk.raw.git import GitOcean
 from grimoire_elk.raw.meetup import MeetupOcean
@@ -48,6 +61,94 @@ def read_file(filename, mode='r'):
     return content
 
 
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTP server answering each request in its own thread"""
+
+    daemon_threads = True
+
+
+class SliceStandInHandler(BaseHTTPRequestHandler):
+    """Answer the requests of a sliced scroll as ElasticSearch would. The
+    slice `n` has `2 * n` items in the first page and one in the second page"""
+
+    def send_json(self, obj):
+        response = json.dumps(obj).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def do_GET(self):
+        self.send_json({"version": {"number": "6.8.0"}})
+
+    def do_POST(self):
+        query = self.read_json()
+
+        if self.path.startswith('/_search/scroll'):
+            scroll_id = query['scroll_id']
+            hits = [] if scroll_id in self.server.scrolled else [{"_source": {"uuid": scroll_id}}]
+            self.server.scrolled.append(scroll_id)
+            self.send_json({"_scroll_id": scroll_id, "hits": {"hits": hits}})
+        else:
+            self.server.queries.append(query)
+            slice_id = query['slice']['id']
+            hits = [{"_source": {"uuid": "{}-{}".format(slice_id, i)}} for i in range(2 if slice_id else 0)]
+            self.send_json({"_scroll_id": "scroll-{}".format(slice_id),
+                            "hits": {"total": {"value": 3 * slice_id}, "hits": hits}})
+
+    def do_DELETE(self):
+        self.server.released.append(self.read_json()['scroll_id'])
+        self.send_json({})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ScrollStandInHandler(BaseHTTPRequestHandler):
+    """Answer the requests of a scroll as ElasticSearch would, waiting
+    `server.latency` seconds before answering each page. The scroll has
+    `server.num_pages` pages of two items"""
+
+    def send_json(self, obj):
+        response = json.dumps(obj).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def do_GET(self):
+        self.send_json({"version": {"number": "6.8.0"}})
+
+    def do_POST(self):
+        self.read_json()
+        time.sleep(self.server.latency)
+
+        page = self.server.pages_sent
+        self.server.pages_sent += 1
+        hits = []
+        if page < self.server.num_pages:
+            hits = [{"_source": {"uuid": "{}-{}".format(page, i)}} for i in range(2)]
+        self.send_json({"_scroll_id": "scroll-1",
+                        "hits": {"total": {"value": 2 * self.server.num_pages}, "hits": hits}})
+
+    def do_DELETE(self):
+        self.server.released.append(self.read_json()['scroll_id'])
+        self.send_json({})
+
+    def log_message(self, format, *args):
+        pass
+
+
 class TestElasticItems(unittest.TestCase):
     """Unit tests for ElasticItems class"""
 
@@ -333,6 +434,704 @@ class TestElasticItems(unittest.TestCase):
         items = [ei for ei in eitems.fetch()]
         self.assertEqual(len(items), 9)
 
+    def test_feed_items_pipeline(self):
+        """Test whether the items are fed with a pipeline of stages"""
+
+        perceval_backend = Git('/tmp/perceval_mc84igfc/gittest', '/tmp/foo')
+        elastic = ElasticSearch(self.es_con, self.target_index, GitOcean.mapping)
+
+        # Load items
+        items = json.loads(read_file('data/git.json'))
+        ocean = GitOcean(perceval_backend)
+        ocean.elastic = elastic
+        ocean.pipeline_queue_size = 2
+        ocean.feed_items(iter(items))
+
+        eitems = ElasticItems(perceval_backend)
+        eitems.scroll_size = 2
+        eitems.elastic = elastic
+
+        items = [ei for ei in eitems.fetch()]
+        self.assertEqual(len(items), 9)
+        self.assertTrue(all('metadata__timestamp' in item for item in items))
+
+    def test_replay(self):
+        """Test whether the items of an archive are replayed in packs limited by their size"""
+
+        perceval_backend = Git('/tmp/perceval_mc84igfc/gittest', '/tmp/foo')
+        perceval_backend.fetch_from_archive = lambda: iter(json.loads(read_file('data/git.json')))
+        elastic = ElasticSearch(self.es_con, self.target_index, GitOcean.mapping)
+
+        ocean = GitOcean(perceval_backend, fetch_archive=True)
+        ocean.elastic = elastic
+        ocean.replay_max_bytes_bulk = 4096
+        with self.assertLogs('grimoire_elk.raw.elastic', level='INFO') as cm:
+            ocean.replay()
+
+        self.assertIn("INFO:grimoire_elk.raw.elastic:[git] Replayed 11 items in 3 bulk requests, 0 failed", cm.output)
+
+        eitems = ElasticItems(perceval_backend)
+        eitems.elastic = elastic
+
+        items = [ei for ei in eitems.fetch()]
+        self.assertEqual(len(items), 9)
+
+    def test_fetch_search_after(self):
+        """Test whether the fetch method properly works paging with search_after"""
+
+        perceval_backend = Git('/tmp/perceval_mc84igfc/gittest', '/tmp/foo')
+        elastic = ElasticSearch(self.es_con, self.target_index, GitOcean.mapping)
+
+        # Load items
+        items = json.loads(read_file('data/git.json'))
+        ocean = GitOcean(perceval_backend)
+        ocean.elastic = elastic
+        ocean.feed_items(items)
+
+        eitems = ElasticItems(perceval_backend)
+        eitems.scroll_size = 2
+        eitems.reader = SEARCH_AFTER_READER
+        eitems.elastic = elastic
+
+        items = [ei for ei in eitems.fetch()]
+        self.assertEqual(len(items), 9)
+        self.assertEqual(len(set([item['uuid'] for item in items])), 9)
+
+        dates = [item['metadata__timestamp'] for item in items]
+        self.assertListEqual(dates, sorted(dates))
+
+        # Resume after the fifth item
+        position = [items[4]['metadata__timestamp'], items[4]['uuid']]
+        resumed = [ei for ei in eitems.fetch_search_after(search_after=position)]
+        self.assertListEqual([item['uuid'] for item in resumed], [item['uuid'] for item in items[5:]])
+
+    @httpretty.activate
+    def test_fetch_search_after_requests(self):
+        """Test whether the pages are read from a point in time with search_after"""
+
+        es_con = "http://es7.com"
+        index_url = es_con + "/test_search_after"
+        http_requests = []
+
+        def request_callback(responses):
+            def callback(method, uri, headers):
+                body = method.body.decode('utf-8')
+                http_requests.append((method.method, uri.replace(es_con, '').split('?')[0],
+                                      json.loads(body) if body else None))
+                return 200, headers, responses.pop(0)
+            return callback
+
+        def hit(uuid, timestamp):
+            return {"_source": {"uuid": uuid, "metadata__timestamp": timestamp},
+                    "sort": [timestamp, uuid]}
+
+        pages = [
+            {"pit_id": "pit-1", "hits": {"hits": [hit("a", 1), hit("b", 1)]}},
+            {"pit_id": "pit-2", "hits": {"hits": [hit("c", 2)]}}
+        ]
+
+        httpretty.register_uri(httpretty.GET, es_con + "/",
+                               body=request_callback(['{"version": {"number": "7.10.0"}}']))
+        httpretty.register_uri(httpretty.GET, index_url,
+                               body=request_callback(['{}']))
+        httpretty.register_uri(httpretty.POST, index_url + "/_pit",
+                               body=request_callback(['{"id": "pit-0"}']))
+        httpretty.register_uri(httpretty.POST, es_con + "/_search",
+                               body=request_callback([json.dumps(page) for page in pages]))
+        httpretty.register_uri(httpretty.DELETE, es_con + "/_pit",
+                               body=request_callback(['{"succeeded": true}']))
+
+        eitems = ElasticItems(self.perceval_backend)
+        eitems.scroll_size = 2
+        eitems.reader = SEARCH_AFTER_READER
+        eitems.elastic = ElasticSearch(es_con, "test_search_after")
+        http_requests.clear()
+
+        items = [ei for ei in eitems.fetch()]
+        self.assertListEqual([item['uuid'] for item in items], ['a', 'b', 'c'])
+        self.assertListEqual(eitems.search_after_position, [2, 'c'])
+
+        self.assertListEqual([r[:2] for r in http_requests],
+                             [('POST', '/test_search_after/_pit'),
+                              ('POST', '/_search'),
+                              ('POST', '/_search'),
+                              ('DELETE', '/_pit')])
+
+        first, second = http_requests[1][2], http_requests[2][2]
+        self.assertEqual(first['size'], 2)
+        self.assertListEqual(first['sort'],
+                             [{"metadata__timestamp": {"order": "asc"}},
+                              {"uuid": {"order": "asc", "unmapped_type": "keyword"}}])
+        self.assertDictEqual(first['pit'], {"id": "pit-0", "keep_alive": "10m"})
+        self.assertNotIn('search_after', first)
+        self.assertDictEqual(second['pit'], {"id": "pit-1", "keep_alive": "10m"})
+        self.assertListEqual(second['search_after'], [1, 'b'])
+        self.assertDictEqual(http_requests[3][2], {"id": "pit-2"})
+
+    @httpretty.activate
+    def test_fetch_search_after_no_pit(self):
+        """Test whether the pages are read from the index when there are no points in time"""
+
+        es_con = "http://es6.com"
+        index_url = es_con + "/test_search_after"
+        http_requests = []
+
+        def request_callback(responses):
+            def callback(method, uri, headers):
+                body = method.body.decode('utf-8')
+                http_requests.append((method.method, uri.replace(es_con, '').split('?')[0],
+                                      json.loads(body) if body else None))
+                return 200, headers, responses.pop(0)
+            return callback
+
+        page = {"hits": {"hits": [{"_source": {"uuid": "a"}, "sort": [1, "a"]}]}}
+
+        httpretty.register_uri(httpretty.GET, es_con + "/",
+                               body=request_callback(['{"version": {"number": "6.8.0"}}']))
+        httpretty.register_uri(httpretty.GET, index_url,
+                               body=request_callback(['{}']))
+        httpretty.register_uri(httpretty.POST, index_url + "/_search",
+                               body=request_callback([json.dumps(page)]))
+
+        eitems = ElasticItems(self.perceval_backend)
+        eitems.reader = SEARCH_AFTER_READER
+        eitems.elastic = ElasticSearch(es_con, "test_search_after")
+        http_requests.clear()
+
+        items = [ei for ei in eitems.fetch()]
+        self.assertListEqual(items, [{"uuid": "a"}])
+        self.assertListEqual([r[:2] for r in http_requests], [('POST', '/test_search_after/_search')])
+        self.assertNotIn('pit', http_requests[0][2])
+
+    @httpretty.activate
+    def test_fetch_search_after_errors(self):
+        """Test whether the errors reading the pages are raised but a missing index"""
+
+        es_con = "http://es6.com"
+        index_url = es_con + "/test_search_after"
+        not_found = {"error": {"type": "index_not_found_exception"}, "status": 404}
+
+        httpretty.register_uri(httpretty.GET, es_con + "/",
+                               body='{"version": {"number": "6.8.0"}}')
+        httpretty.register_uri(httpretty.GET, index_url, body='{}')
+
+        eitems = ElasticItems(self.perceval_backend)
+        eitems.reader = SEARCH_AFTER_READER
+        eitems.elastic = ElasticSearch(es_con, "test_search_after")
+
+        httpretty.register_uri(httpretty.POST, index_url + "/_search",
+                               body=json.dumps(not_found), status=404)
+        with self.assertLogs(logger, level='DEBUG') as cm:
+            self.assertListEqual([ei for ei in eitems.fetch()], [])
+            self.assertTrue(any('No results found' in line for line in cm.output))
+
+        for status in [404, 500, 503]:
+            httpretty.register_uri(httpretty.POST, index_url + "/_search",
+                                   body='{"error": {"type": "search_phase_execution_exception"}}',
+                                   status=status)
+            with self.assertRaises(requests.exceptions.HTTPError):
+                [ei for ei in eitems.fetch()]
+
+    @httpretty.activate
+    def test_fetch_resumable(self):
+        """Test whether the items are read with search_after from the position of an item"""
+
+        es_con = "http://es6.com"
+        index_url = es_con + "/test_resumable"
+        http_requests = []
+
+        def request_callback(responses):
+            def callback(method, uri, headers):
+                body = method.body.decode('utf-8')
+                http_requests.append((method.method, uri.replace(es_con, '').split('?')[0],
+                                      json.loads(body) if body else None))
+                return 200, headers, responses.pop(0)
+            return callback
+
+        item = {"uuid": "b", "metadata__timestamp": "2016-06-23T13:37:00.123456+00:00"}
+        page = {"hits": {"hits": [{"_source": item, "sort": [1466689020123, "b"]}]}}
+
+        httpretty.register_uri(httpretty.GET, es_con + "/",
+                               body=request_callback(['{"version": {"number": "6.8.0"}}']))
+        httpretty.register_uri(httpretty.GET, index_url,
+                               body=request_callback(['{}']))
+        httpretty.register_uri(httpretty.POST, index_url + "/_search",
+                               body=request_callback([json.dumps(page)]))
+
+        # The reader configured is ignored, the items must be read in a stable order
+        eitems = ElasticItems(self.perceval_backend)
+        eitems.scroll_slices = 2
+        eitems.elastic = ElasticSearch(es_con, "test_resumable")
+        http_requests.clear()
+
+        items = [ei for ei in eitems.fetch_resumable(search_after=[1466689020000, "a"])]
+        self.assertListEqual(items, [item])
+        self.assertListEqual([r[:2] for r in http_requests], [('POST', '/test_resumable/_search')])
+        self.assertListEqual(http_requests[0][2]['search_after'], [1466689020000, "a"])
+
+        self.assertListEqual(eitems.get_item_position(item), [1466689020123, "b"])
+        self.assertIsNone(eitems.get_item_position({"uuid": "c"}))
+
+    def test_fetch_resumable_snapshot(self):
+        """Test whether the items are read from the snapshot after the position of an item"""
+
+        tmp_path = tempfile.mkdtemp(prefix='snapshot_')
+        self.addCleanup(shutil.rmtree, tmp_path)
+        path = os.path.join(tmp_path, 'raw.db')
+
+        items = json.loads(read_file('data/git.json'))
+        for item in items:
+            item['metadata__timestamp'] = unixtime_to_datetime(item['timestamp']).isoformat()
+        snapshot = RawSnapshot(path)
+        snapshot.write(items)
+        snapshot.close()
+
+        origin = '/tmp/perceval_mc84igfc/gittest'
+        eitems = GitOcean(Git(origin, '/tmp/foo'))
+        eitems.raw_snapshot = path
+        eitems.read_raw_snapshot = True
+        expected = sorted([item for item in items if item['origin'] == origin],
+                          key=lambda item: (item['timestamp'], item['uuid']))
+
+        self.assertListEqual(list(eitems.fetch_resumable()), expected)
+
+        position = eitems.get_item_position(expected[2])
+        self.assertListEqual(position, [int(expected[2]['timestamp'] * 1000), expected[2]['uuid']])
+        self.assertListEqual(list(eitems.fetch_resumable(search_after=position)), expected[3:])
+
+    def test_fetch_slices(self):
+        """Test whether the fetch method properly works reading several slices"""
+
+        perceval_backend = Git('/tmp/perceval_mc84igfc/gittest', '/tmp/foo')
+        elastic = ElasticSearch(self.es_con, self.target_index, GitOcean.mapping)
+
+        # Load items
+        items = json.loads(read_file('data/git.json'))
+        ocean = GitOcean(perceval_backend)
+        ocean.elastic = elastic
+        ocean.feed_items(items)
+
+        eitems = ElasticItems(perceval_backend)
+        eitems.scroll_size = 2
+        eitems.scroll_slices = 3
+        eitems.elastic = elastic
+
+        items = [ei for ei in eitems.fetch()]
+        self.assertEqual(len(items), 9)
+        self.assertEqual(len(set([item['uuid'] for item in items])), 9)
+
+        eitems.reader = SEARCH_AFTER_READER
+        items = [ei for ei in eitems.fetch()]
+        self.assertEqual(len(set([item['uuid'] for item in items])), 9)
+
+    def test_fetch_slices_requests(self):
+        """Test whether each slice is read with its own scroll and the same filters"""
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), SliceStandInHandler)
+        server.queries = []
+        server.scrolled = []
+        server.released = []
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        try:
+            es_con = "http://127.0.0.1:{}".format(server.server_port)
+            eitems = ElasticItems(self.perceval_backend, from_date=str_to_datetime('2018-01-01'))
+            eitems.scroll_slices = 3
+            eitems.elastic = ElasticSearch(es_con, "test_slices")
+
+            items = [ei['uuid'] for ei in eitems.fetch()]
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertListEqual(sorted(items), ['1-0', '1-1', '2-0', '2-1', 'scroll-1', 'scroll-2'])
+        self.assertListEqual(sorted(server.released), ['scroll-0', 'scroll-1', 'scroll-2'])
+
+        self.assertListEqual(sorted([query['slice']['id'] for query in server.queries]), [0, 1, 2])
+        for query in server.queries:
+            self.assertEqual(query['slice']['max'], 3)
+            self.assertIn({"range": {"metadata__timestamp": {"gte": "2018-01-01T00:00:00+00:00"}}},
+                          query['query']['bool']['filter'])
+
+    def test_fetch_source_fields(self):
+        """Test whether only the fields in the `_source` filter are fetched"""
+
+        perceval_backend = Git('/tmp/perceval_mc84igfc/gittest', '/tmp/foo')
+        elastic = ElasticSearch(self.es_con, self.target_index, GitOcean.mapping)
+
+        # Load items
+        items = json.loads(read_file('data/git.json'))
+        ocean = GitOcean(perceval_backend)
+        ocean.elastic = elastic
+        ocean.feed_items(items)
+
+        eitems = ElasticItems(perceval_backend)
+        eitems.elastic = elastic
+        eitems.set_source_fields({"includes": ["uuid", "data.commit"]})
+
+        items = [ei for ei in eitems.fetch()]
+        self.assertEqual(len(items), 9)
+        for item in items:
+            self.assertListEqual(sorted(item.keys()), ['data', 'uuid'])
+            self.assertListEqual(list(item['data'].keys()), ['commit'])
+
+        items = [ei for ei in eitems.fetch(_source={"excludes": ["data"]})]
+        self.assertEqual(len(items), 9)
+        for item in items:
+            self.assertNotIn('data', item)
+            self.assertIn('origin', item)
+
+    @httpretty.activate
+    def test_fetch_source_fields_query(self):
+        """Test whether the `_source` filter is included in the queries"""
+
+        es_con = "http://es6.com"
+        index_url = es_con + "/test_source"
+        queries = []
+
+        def search_callback(method, uri, headers):
+            queries.append(json.loads(method.body.decode('utf-8')))
+            page = {"_scroll_id": "scroll-1", "hits": {"total": 0, "hits": []}}
+            return 200, headers, json.dumps(page)
+
+        httpretty.register_uri(httpretty.GET, es_con + "/",
+                               body='{"version": {"number": "6.8.0"}}')
+        httpretty.register_uri(httpretty.GET, index_url, body='{}')
+        httpretty.register_uri(httpretty.POST, index_url + "/_search", body=search_callback)
+        httpretty.register_uri(httpretty.DELETE, es_con + "/_search/scroll", body='{}')
+
+        eitems = ElasticItems(self.perceval_backend)
+        eitems.elastic = ElasticSearch(es_con, "test_source")
+
+        [ei for ei in eitems.fetch()]
+        self.assertNotIn('_source', queries[-1])
+
+        eitems.set_source_fields({"excludes": ["data.files"]})
+        [ei for ei in eitems.fetch()]
+        self.assertDictEqual(queries[-1]['_source'], {"excludes": ["data.files"]})
+
+        [ei for ei in eitems.fetch(_source={"includes": ["data.commit"]})]
+        self.assertDictEqual(queries[-1]['_source'], {"includes": ["data.commit"]})
+
+        eitems.reader = SEARCH_AFTER_READER
+        [ei for ei in eitems.fetch()]
+        self.assertDictEqual(queries[-1]['_source'], {"excludes": ["data.files"]})
+        self.assertEqual(len(queries[-1]['sort']), 2)
+
+    def test_get_elastic_query(self):
+        """Test whether the filters are included in the query without escaping them by hand"""
+
+        eitems = ElasticItems(self.perceval_backend)
+        eitems.set_filter_raw('data.product:Add-on "SDK", data.component:Doc\\s')
+        eitems.from_date = str_to_datetime('2018-01-01')
+        _filter = {"name": "uuid", "value": ["1'2", '3"4']}
+
+        query = eitems.get_elastic_query(_filter=_filter, _source={"includes": ["data"]})
+        self.assertIsInstance(query, dict)
+
+        filters = query['query']['bool']['filter']
+        self.assertIn({"term": {"data.product": "Add-on SDK"}}, filters)
+        self.assertIn({"term": {"data.component": "Doc\\s"}}, filters)
+        self.assertIn({"terms": {"uuid": ["1'2", '3"4']}}, filters)
+        self.assertIn({"range": {"metadata__timestamp": {"gte": "2018-01-01T00:00:00+00:00"}}}, filters)
+        self.assertListEqual(query['sort'], [{"metadata__timestamp": {"order": "asc"}}])
+        self.assertDictEqual(query['_source'], {"includes": ["data"]})
+
+        query = eitems.get_elastic_query(_filter=_filter, ignore_incremental=True)
+        self.assertEqual(len(query['query']['bool']['filter']), len(filters) - 1)
+        self.assertNotIn('_source', query)
+
+        eitems.from_date = None
+        eitems.offset = 10
+        query = eitems.get_elastic_query()
+        self.assertIn({"range": {"offset": {"gte": 10}}}, query['query']['bool']['filter'])
+
+    def start_scroll_server(self, num_pages, latency):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), ScrollStandInHandler)
+        server.num_pages = num_pages
+        server.latency = latency
+        server.pages_sent = 0
+        server.released = []
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        return server
+
+    def test_fetch_prefetch(self):
+        """Test whether the next pages are read while the current one is processed"""
+
+        latency = 0.1
+        elapsed = {}
+
+        for prefetch_pages in [0, 1]:
+            server = self.start_scroll_server(num_pages=6, latency=latency)
+            eitems = ElasticItems(self.perceval_backend)
+            eitems.prefetch_pages = prefetch_pages
+            eitems.elastic = ElasticSearch("http://127.0.0.1:{}".format(server.server_port), "test_prefetch")
+
+            before = time.time()
+            items = []
+            for item in eitems.fetch():
+                # Process each page as long as it takes to read it
+                if item['uuid'].endswith('-0'):
+                    time.sleep(latency)
+                items.append(item['uuid'])
+            elapsed[prefetch_pages] = time.time() - before
+
+            self.assertEqual(len(items), 12)
+            self.assertListEqual(items, sorted(items))
+            self.assertListEqual(server.released, ['scroll-1'])
+
+        # Reading and processing the pages overlap
+        self.assertGreater(elapsed[0], 12 * latency)
+        self.assertLess(elapsed[1], 0.8 * elapsed[0])
+
+    def test_fetch_prefetch_close(self):
+        """Test whether the scroll is released when the generator is closed before the end"""
+
+        server = self.start_scroll_server(num_pages=10, latency=0.01)
+        eitems = ElasticItems(self.perceval_backend)
+        eitems.prefetch_pages = 2
+        eitems.elastic = ElasticSearch("http://127.0.0.1:{}".format(server.server_port), "test_prefetch")
+
+        items = eitems.fetch()
+        self.assertEqual(next(items)['uuid'], '0-0')
+        items.close()
+
+        self.assertListEqual(server.released, ['scroll-1'])
+        self.assertLessEqual(server.pages_sent, 5)
+        self.assertFalse([t for t in threading.enumerate() if t.name.startswith('ThreadPoolExecutor')])
+
+    def test_fetch_stream_pages(self):
+        """Test whether the items of the streamed pages are the ones of the decoded pages"""
+
+        items = {}
+        for stream_pages in [False, True]:
+            server = self.start_scroll_server(num_pages=3, latency=0)
+            eitems = ElasticItems(self.perceval_backend)
+            eitems.stream_pages = stream_pages
+            eitems.elastic = ElasticSearch("http://127.0.0.1:{}".format(server.server_port), "test_stream")
+
+            items[stream_pages] = [item['uuid'] for item in eitems.fetch()]
+            self.assertListEqual(server.released, ['scroll-1'])
+            self.assertEqual(server.pages_sent, 4)
+
+        self.assertListEqual(items[True], ['0-0', '0-1', '1-0', '1-1', '2-0', '2-1'])
+        self.assertListEqual(items[True], items[False])
+
+    def test_fetch_stream_pages_close(self):
+        """Test whether the scroll is released when a streamed page is not read to the end"""
+
+        server = self.start_scroll_server(num_pages=10, latency=0)
+        eitems = ElasticItems(self.perceval_backend)
+        eitems.stream_pages = True
+        eitems.elastic = ElasticSearch("http://127.0.0.1:{}".format(server.server_port), "test_stream")
+
+        items = eitems.fetch()
+        self.assertEqual(next(items)['uuid'], '0-0')
+        items.close()
+
+        self.assertListEqual(server.released, ['scroll-1'])
+        self.assertEqual(server.pages_sent, 1)
+
+    def test_fetch_raw_snapshot(self):
+        """Test whether the raw items are read from the local snapshot with the filters of the index"""
+
+        tmp_path = tempfile.mkdtemp(prefix='snapshot_')
+        self.addCleanup(shutil.rmtree, tmp_path)
+        path = os.path.join(tmp_path, 'raw.db')
+
+        items = json.loads(read_file('data/git.json'))
+        snapshot = RawSnapshot(path)
+        snapshot.write(items)
+        snapshot.close()
+
+        origin = '/tmp/perceval_mc84igfc/gittest'
+        eitems = GitOcean(Git(origin, '/tmp/foo'))
+        eitems.raw_snapshot = path
+        eitems.read_raw_snapshot = True
+        expected = sorted([item for item in items if item['origin'] == origin],
+                          key=lambda item: (item['timestamp'], item['uuid']))
+
+        self.assertListEqual(list(eitems.fetch()), expected)
+
+        _filter = {"name": "uuid", "value": [expected[1]['uuid'], expected[3]['uuid']]}
+        self.assertListEqual(list(eitems.fetch(_filter=_filter)), [expected[1], expected[3]])
+
+        eitems.set_filter_raw('data.Author:' + expected[0]['data']['Author'])
+        fetched = list(eitems.fetch())
+        self.assertTrue(fetched)
+        self.assertTrue(all(item['data']['Author'] == expected[0]['data']['Author'] for item in fetched))
+
+        eitems = GitOcean(Git(origin, '/tmp/foo'), from_date=unixtime_to_datetime(expected[4]['timestamp']))
+        eitems.raw_snapshot = path
+        eitems.read_raw_snapshot = True
+        self.assertListEqual(list(eitems.fetch()), expected[4:])
+        self.assertListEqual(list(eitems.fetch(ignore_incremental=True)), expected)
+
+    @httpretty.activate
+    def test_fetch_adaptive_scroll_size(self):
+        """Test whether the size of the pages is adapted to the pages read"""
+
+        es_con = "http://es6.com"
+        index_url = es_con + "/test_adaptive"
+        sizes = []
+
+        def hit(uuid, padding=''):
+            return {"_source": {"uuid": uuid, "padding": padding}, "sort": [uuid]}
+
+        pages = [
+            [hit("a"), hit("b"), hit("c"), hit("d")],
+            [hit(str(i), 'x' * 1000) for i in range(8)],
+            [hit("e")],
+            []
+        ]
+
+        def search_callback(method, uri, headers):
+            sizes.append(json.loads(method.body.decode('utf-8'))['size'])
+            return 200, headers, json.dumps({"hits": {"hits": pages.pop(0)}})
+
+        httpretty.register_uri(httpretty.GET, es_con + "/",
+                               body='{"version": {"number": "6.8.0"}}')
+        httpretty.register_uri(httpretty.GET, index_url, body='{}')
+        httpretty.register_uri(httpretty.POST, index_url + "/_search", body=search_callback)
+
+        eitems = ElasticItems(self.perceval_backend)
+        eitems.reader = SEARCH_AFTER_READER
+        eitems.adaptive_scroll_size = True
+        eitems.scroll_size = 4
+        eitems.scroll_size_min = 1
+        eitems.scroll_size_max = 8
+        eitems.page_max_bytes = 2000
+        eitems.elastic = ElasticSearch(es_con, "test_adaptive")
+
+        items = [ei for ei in eitems.fetch()]
+        self.assertEqual(len(items), 13)
+
+        # The size doubles after small pages and shrinks after big ones
+        self.assertListEqual(sizes, [4, 8, 1, 2])
+        self.assertEqual(eitems.scroll_size, 2)
+
+    def test_fetch_scroll_budget(self):
+        """Test whether the scrolls are taken from the budget and released when closed"""
+
+        server = self.start_scroll_server(num_pages=3, latency=0)
+        eitems = ElasticItems(self.perceval_backend)
+        eitems.max_scrolls = 1
+        eitems.scroll_wait = 0.1
+        eitems.elastic = ElasticSearch("http://127.0.0.1:{}".format(server.server_port), "test_budget")
+
+        budget = eitems.get_scroll_budget()
+        self.assertIs(eitems.get_scroll_budget(), budget)
+
+        items = eitems.fetch()
+        self.assertEqual(next(items)['uuid'], '0-0')
+        self.assertEqual(budget.open, 1)
+
+        # No more scrolls available
+        with self.assertRaisesRegex(ElasticError, 'No scroll available for .* after 0.1 seconds'):
+            [ei for ei in eitems.fetch()]
+
+        items.close()
+        self.assertEqual(budget.open, 0)
+        self.assertListEqual(server.released, ['scroll-1'])
+
+        # The scroll is released after errors too
+        server.pages_sent = 0
+        items = eitems.fetch()
+        next(items)
+        with self.assertRaises(ValueError):
+            items.throw(ValueError)
+        self.assertEqual(budget.open, 0)
+        self.assertListEqual(server.released, ['scroll-1', 'scroll-1'])
+
+    @httpretty.activate
+    def test_cluster_scroll_slots(self):
+        """Test whether the slots of the cluster are taken, reclaimed, renewed and released"""
+
+        es_con = "http://es.com"
+        slot_url = es_con + "/grimoirelab_scroll_slots/_doc/slot-"
+        http_requests = []
+
+        def request_callback(status, body):
+            def callback(method, uri, headers):
+                body_req = method.body.decode('utf-8')
+                http_requests.append((method.method, uri.replace(es_con, '').split('?')[0],
+                                      method.querystring, json.loads(body_req) if body_req else None))
+                return status, headers, body
+            return callback
+
+        expired = {"_version": 3, "_seq_no": 7, "_primary_term": 1,
+                   "_source": {"owner": "other:1", "expires": time.time() - 1, "scroll_id": "leaked"}}
+        written = json.dumps({"_version": 4, "_seq_no": 8, "_primary_term": 1})
+
+        for es_major, conditions in [('6', [{'version': ['3']}, {'version': ['4']}]),
+                                     ('7', [{'if_seq_no': ['7'], 'if_primary_term': ['1']},
+                                            {'if_seq_no': ['8'], 'if_primary_term': ['1']}])]:
+            httpretty.reset()
+            http_requests.clear()
+            httpretty.register_uri(httpretty.PUT, slot_url + "0",
+                                   responses=[httpretty.Response(body=request_callback(409, '{}')),
+                                              httpretty.Response(body=request_callback(200, written))])
+            httpretty.register_uri(httpretty.GET, slot_url + "0",
+                                   body=request_callback(200, json.dumps(expired)))
+            httpretty.register_uri(httpretty.DELETE, es_con + "/_search/scroll",
+                                   body=request_callback(200, '{}'))
+            httpretty.register_uri(httpretty.DELETE, slot_url + "0",
+                                   body=request_callback(200, '{}'))
+
+            slots = ClusterScrollSlots(requests.Session(), es_con, 1, es_major)
+            self.assertEqual(slots.take(timeout=0), 0)
+
+            self.assertListEqual([r[:2] for r in http_requests],
+                                 [('PUT', '/grimoirelab_scroll_slots/_doc/slot-0'),
+                                  ('GET', '/grimoirelab_scroll_slots/_doc/slot-0'),
+                                  ('DELETE', '/_search/scroll'),
+                                  ('PUT', '/grimoirelab_scroll_slots/_doc/slot-0')])
+            self.assertDictEqual(http_requests[0][2], {'op_type': ['create']})
+            self.assertDictEqual(http_requests[2][3], {"scroll_id": "leaked"})
+            self.assertDictEqual(http_requests[3][2], conditions[0])
+            self.assertEqual(http_requests[3][3]['owner'], slots.owner)
+
+            # The slot is renewed and released only if it wasn't written by others
+            http_requests.clear()
+            slots.renew(0, "scroll-1")
+            slots.release(0)
+            self.assertListEqual([r[:3] for r in http_requests],
+                                 [('PUT', '/grimoirelab_scroll_slots/_doc/slot-0', conditions[1]),
+                                  ('DELETE', '/grimoirelab_scroll_slots/_doc/slot-0', conditions[1])])
+            self.assertEqual(http_requests[0][3]['scroll_id'], "scroll-1")
+
+    @httpretty.activate
+    def test_cluster_scroll_slots_taken(self):
+        """Test whether the slots taken by other processes are not renewed nor released"""
+
+        es_con = "http://es.com"
+        slot_url = es_con + "/grimoirelab_scroll_slots/_doc/slot-0"
+
+        httpretty.register_uri(httpretty.PUT, slot_url,
+                               responses=[httpretty.Response(body='{"_version": 1}'),
+                                          httpretty.Response(body='{}', status=409)])
+        httpretty.register_uri(httpretty.DELETE, slot_url, body='{}', status=409)
+
+        slots = ClusterScrollSlots(requests.Session(), es_con, 1, '6')
+        self.assertEqual(slots.take(timeout=0), 0)
+
+        with self.assertRaisesRegex(ElasticError, 'Scroll slot 0 of .* taken by other process'):
+            slots.renew(0)
+
+        slots.release(0)
+        self.assertEqual(httpretty.last_request().method, 'DELETE')
+        self.assertDictEqual(httpretty.last_request().querystring, {'version': ['1']})
+
+        # The slot is released only once
+        num_requests = len(httpretty.latest_requests())
+        slots.release(0)
+        self.assertEqual(len(httpretty.latest_requests()), num_requests)
+
     def test_fetch_from_date(self):
         """Test whether the fetch method with from_date properly works"""
 
@@ -495,6 +1294,88 @@ class TestElasticItems(unittest.TestCase):
             self.assertRegex(cm.output[-1], 'DEBUG:grimoire_elk.elastic_items:No results found from*')
 
 
+class TestScrollBudget(unittest.TestCase):
+    """Unit tests for ScrollBudget class"""
+
+    def test_acquire_in_order(self):
+        """Test whether the scrolls are given in order of arrival"""
+
+        budget = ScrollBudget(max_scrolls=1)
+        slot = budget.acquire()
+        acquired = []
+
+        def reader(name):
+            reader_slot = budget.acquire()
+            acquired.append(name)
+            reader_slot.release()
+
+        threads = []
+        for name in range(5):
+            thread = threading.Thread(target=reader, args=(name,))
+            thread.start()
+            threads.append(thread)
+            while len(budget._waiters) <= name:
+                time.sleep(0.01)
+
+        self.assertListEqual(acquired, [])
+        slot.release()
+        slot.release()
+        for thread in threads:
+            thread.join()
+
+        self.assertListEqual(acquired, [0, 1, 2, 3, 4])
+        self.assertEqual(budget.open, 0)
+
+    def test_acquire_timeout(self):
+        """Test whether None is returned when no scroll is available in time"""
+
+        budget = ScrollBudget(max_scrolls=2)
+        slots = [budget.acquire(), budget.acquire()]
+
+        self.assertIsNone(budget.acquire(timeout=0.05))
+        self.assertEqual(len(budget._waiters), 0)
+
+        slots[0].release()
+        self.assertIsNotNone(budget.acquire(timeout=0.05))
+        self.assertEqual(budget.open, 2)
+
+    def test_no_limit(self):
+        """Test whether there is no limit when max_scrolls is None"""
+
+        budget = ScrollBudget()
+        slots = [budget.acquire(timeout=0) for _ in range(10)]
+        self.assertNotIn(None, slots)
+        self.assertEqual(budget.open, 10)
+
+
+class TestPageSizer(unittest.TestCase):
+    """Unit tests for PageSizer class"""
+
+    def test_next_size(self):
+        """Test whether the size grows and shrinks within the bounds"""
+
+        sizer = PageSizer(min_size=10, max_size=1000, max_bytes=1000000, max_time=5)
+
+        # Small and fast full pages double the size up to the max
+        self.assertEqual(sizer.next_size(100, 100, 10000, 0.1), 200)
+        self.assertEqual(sizer.next_size(800, 800, 80000, 0.1), 1000)
+
+        # Pages not full don't grow the size
+        self.assertEqual(sizer.next_size(100, 50, 5000, 0.1), 100)
+
+        # Big pages shrink the size to fit in max_bytes
+        self.assertEqual(sizer.next_size(100, 100, 4000000, 0.1), 25)
+
+        # Slow pages shrink the size to fit in max_time
+        self.assertEqual(sizer.next_size(100, 100, 10000, 20), 25)
+
+        # The size is never below the min
+        self.assertEqual(sizer.next_size(100, 100, 100000000, 0.1), 10)
+
+        # Empty pages keep the size
+        self.assertEqual(sizer.next_size(100, 0, 100, 0.1), 100)
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
     unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2020 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from grimoire_elk.fingerprint import FingerprintStore, fingerprint
+
+
+def read_file(filename):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)) as f:
+        return f.read()
+
+
+class TestFingerprint(unittest.TestCase):
+    """Tests of the fingerprints of the raw items"""
+
+    def test_fingerprint(self):
+        """Test whether the fingerprints only change with the data of the items"""
+
+        item = json.loads(read_file('data/git.json'))[0]
+        value = fingerprint(item)
+        self.assertEqual(len(value), 32)
+
+        # Fetched again, with other keys order and metadata
+        fetched = copy.deepcopy(item)
+        fetched['data'] = dict(reversed(list(fetched['data'].items())))
+        fetched['timestamp'] += 3600
+        fetched['perceval_version'] = '1.0.0'
+        self.assertEqual(fingerprint(fetched), value)
+
+        fetched['data']['message'] += ' (amended)'
+        self.assertNotEqual(fingerprint(fetched), value)
+
+        fetched = copy.deepcopy(item)
+        fetched['project'] = 'grimoire'
+        self.assertNotEqual(fingerprint(fetched), value)
+
+
+class TestFingerprintStore(unittest.TestCase):
+    """Tests of the store of the fingerprints"""
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='fingerprints_')
+        self.path = os.path.join(self.tmp_path, 'fingerprints.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_save_load(self):
+        """Test whether the fingerprints are kept by index and origin"""
+
+        store = FingerprintStore(self.path)
+        self.assertDictEqual(store.load('index-1', 'origin-a'), {})
+
+        store.save('index-1', 'origin-a', {'1': 'aa', '2': 'bb'})
+        store.save('index-1', 'origin-b', {'3': 'cc'})
+        store.save('index-2', 'origin-a', {'1': 'dd'})
+        store.save('index-1', 'origin-a', {'2': 'ee'})
+        store.save('index-1', 'origin-a', {})
+        store.close()
+
+        store = FingerprintStore(self.path)
+        self.assertDictEqual(store.load('index-1', 'origin-a'), {'1': 'aa', '2': 'ee'})
+        self.assertDictEqual(store.load('index-1', 'origin-b'), {'3': 'cc'})
+        self.assertDictEqual(store.load('index-2', 'origin-a'), {'1': 'dd'})
+
+        store.remove('index-1', 'origin-a')
+        self.assertDictEqual(store.load('index-1', 'origin-a'), {})
+        self.assertDictEqual(store.load('index-1', 'origin-b'), {'3': 'cc'})
+
+        store.remove('index-1')
+        self.assertDictEqual(store.load('index-1', 'origin-b'), {})
+        self.assertDictEqual(store.load('index-2', 'origin-a'), {'1': 'dd'})
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
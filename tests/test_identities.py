@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2020 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import hashlib
+import unittest
+
+from grimoire_elk.identities.git import GitIdentities
+from grimoire_elk.identities.github import GitHubIdentities
+from grimoire_elk.identities.identities import Identities
+
+
+class TestIdentities(unittest.TestCase):
+    """Tests of the pseudonyms of the identities"""
+
+    def setUp(self):
+        Identities._hash.cache_clear()
+
+    def test_hash(self):
+        """Test whether the pseudonyms are the SHA1 of the names"""
+
+        for name in ['owlbot', 'Ñandú', 'lone surrogate \udcff']:
+            expected = hashlib.sha1(name.encode('UTF-8', errors="surrogateescape")).hexdigest()
+            self.assertEqual(Identities._hash(name), expected)
+
+    def test_hash_memoized(self):
+        """Test whether the pseudonyms are memoized for the identities of all the backends"""
+
+        pseudonym = GitIdentities._hash('owlbot')
+        self.assertEqual(GitHubIdentities._hash('owlbot'), pseudonym)
+        self.assertEqual(Identities._hash('owlbot'), pseudonym)
+        Identities._hash('other')
+
+        cache = Identities.hash_cache_info()
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.currsize, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
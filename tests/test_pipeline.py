@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2020 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import threading
+import time
+import unittest
+
+from grimoire_elk.pipeline import PipelineStopped, StageQueue, run_pipeline
+
+
+class TestStageQueue(unittest.TestCase):
+    """Tests of the queues between the stages of a pipeline"""
+
+    def test_spool(self):
+        """Test whether the items exceeding the size are spooled keeping their order"""
+
+        stage_queue = StageQueue(2, spool=True)
+        for i in range(5):
+            stage_queue.put({"id": i})
+
+        self.assertEqual(stage_queue.spooled, 3)
+
+        items = iter(stage_queue)
+        self.assertDictEqual(next(items), {"id": 0})
+        self.assertDictEqual(next(items), {"id": 1})
+
+        # The room in memory is not used until the spool is read
+        stage_queue.put({"id": 5})
+        self.assertEqual(stage_queue.spooled, 4)
+        self.assertDictEqual(next(items), {"id": 2})
+
+        stage_queue.finish()
+        self.assertListEqual([item["id"] for item in items], [3, 4, 5])
+        self.assertEqual(stage_queue.items, 6)
+
+    def test_put_blocks(self):
+        """Test whether the producer waits for room when the items are not spooled"""
+
+        stage_queue = StageQueue(2)
+        stage_queue.put(0)
+        stage_queue.put(1)
+
+        def consume():
+            time.sleep(0.2)
+            self.assertEqual(next(items), 0)
+
+        items = iter(stage_queue)
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        stage_queue.put(2)
+        consumer.join()
+
+        self.assertGreater(stage_queue.put_wait, 0.1)
+        self.assertEqual(stage_queue.spooled, 0)
+
+        stage_queue.stop()
+        with self.assertRaises(PipelineStopped):
+            stage_queue.put(3)
+        with self.assertRaises(PipelineStopped):
+            next(items)
+
+    def test_error(self):
+        """Test whether the error of the producer is raised to the consumer after the items"""
+
+        stage_queue = StageQueue(2)
+        stage_queue.put(0)
+        stage_queue.finish(ValueError("fetch failed"))
+
+        items = iter(stage_queue)
+        self.assertEqual(next(items), 0)
+        with self.assertRaisesRegex(ValueError, "fetch failed"):
+            next(items)
+
+
+class TestRunPipeline(unittest.TestCase):
+    """Tests of the pipelines of stages"""
+
+    def test_run(self):
+        """Test whether the items go through all the stages in order"""
+
+        written = []
+
+        def double(items):
+            for item in items:
+                yield {"id": item["id"] * 2}
+
+        def skip_odd(items):
+            for item in items:
+                if item["id"] % 4 == 0:
+                    yield item
+
+        def write(items):
+            for item in items:
+                time.sleep(0.001)
+                written.append(item["id"])
+
+        source = ({"id": i} for i in range(100))
+        stats = run_pipeline(('fetch', source), [('double', double), ('skip', skip_odd)], ('write', write), 5)
+
+        self.assertListEqual(written, list(range(0, 200, 4)))
+        self.assertListEqual([stage.name for stage in stats], ['fetch', 'double', 'skip', 'write'])
+        self.assertListEqual([stage.items for stage in stats], [100, 100, 100, 50])
+        self.assertGreater(stats[-1].throughput, 0)
+        self.assertTrue(str(stats[0]).startswith("fetch: 100 items"))
+
+    def test_slow_sink(self):
+        """Test whether the source is never blocked by a slow sink"""
+
+        fetched = threading.Event()
+
+        def fetch():
+            for i in range(20):
+                yield {"id": i}
+            fetched.set()
+
+        def write(items):
+            for item in items:
+                # The last items are written once all of them are fetched
+                if item["id"] == 2:
+                    self.assertTrue(fetched.wait(5))
+
+        stats = run_pipeline(('fetch', fetch()), [('fix', lambda items: items)], ('write', write), 2)
+        self.assertListEqual([stage.items for stage in stats], [20, 20, 20])
+
+    def test_errors(self):
+        """Test whether the errors of any stage stop the pipeline and are raised"""
+
+        closed = threading.Event()
+
+        def fetch():
+            try:
+                for i in range(1000):
+                    yield {"id": i}
+                    time.sleep(0.001)
+            finally:
+                closed.set()
+
+        def fail_fetch():
+            yield {"id": 0}
+            raise ValueError("fetch failed")
+
+        def fail_fix(items):
+            for item in items:
+                if item["id"] == 10:
+                    raise ValueError("fix failed")
+                yield item
+
+        def fail_write(items):
+            for item in items:
+                if item["id"] == 10:
+                    raise ValueError("write failed")
+
+        def identity(items):
+            return items
+
+        with self.assertRaisesRegex(ValueError, "fetch failed"):
+            run_pipeline(('fetch', fail_fetch()), [('fix', identity)], ('write', list), 5)
+
+        with self.assertRaisesRegex(ValueError, "fix failed"):
+            run_pipeline(('fetch', fetch()), [('fix', fail_fix)], ('write', list), 5)
+        self.assertTrue(closed.is_set())
+
+        closed.clear()
+        with self.assertRaisesRegex(ValueError, "write failed"):
+            run_pipeline(('fetch', fetch()), [('fix', identity)], ('write', fail_write), 5)
+        self.assertTrue(closed.is_set())
+
+    def test_errors_blocked_source(self):
+        """Test whether the errors are raised without waiting for a blocked source"""
+
+        resume = threading.Event()
+        closed = threading.Event()
+
+        def fetch():
+            try:
+                yield {"id": 0}
+                # e.g., waiting for a rate limit
+                resume.wait(60)
+                yield {"id": 1}
+            finally:
+                closed.set()
+
+        def fail_write(items):
+            for _ in items:
+                raise ValueError("write failed")
+
+        before = time.time()
+        with self.assertRaisesRegex(ValueError, "write failed"):
+            run_pipeline(('fetch', fetch()), [('fix', lambda items: items)], ('write', fail_write), 5)
+        self.assertLess(time.time() - before, 10)
+        self.assertFalse(closed.is_set())
+
+        # The source ends with its next item
+        resume.set()
+        self.assertTrue(closed.wait(5))
+
+
+if __name__ == "__main__":
+    unittest.main()
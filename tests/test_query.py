@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2020 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import unittest
+
+import grimoire_elk.query as esq
+
+
+class TestQuery(unittest.TestCase):
+    """Tests of the ElasticSearch query builders"""
+
+    def test_clauses(self):
+        """Test whether the query clauses are built"""
+
+        self.assertDictEqual(esq.term("origin", "https://a.b/c"), {"term": {"origin": "https://a.b/c"}})
+        self.assertDictEqual(esq.terms("uuid", ("1", "2")), {"terms": {"uuid": ["1", "2"]}})
+        self.assertDictEqual(esq.match("data.number", 3), {"match": {"data.number": 3}})
+        self.assertDictEqual(esq.exists("closed_at"), {"exists": {"field": "closed_at"}})
+        self.assertDictEqual(esq.range_("offset", gte=0), {"range": {"offset": {"gte": 0}}})
+        self.assertDictEqual(esq.range_("date", gt="2019", lte="2020"),
+                             {"range": {"date": {"gt": "2019", "lte": "2020"}}})
+        self.assertDictEqual(esq.sort("uuid", unmapped_type="keyword"),
+                             {"uuid": {"order": "asc", "unmapped_type": "keyword"}})
+
+    def test_bool(self):
+        """Test whether only the given clauses are included in bool queries"""
+
+        self.assertDictEqual(esq.bool_(), {"bool": {}})
+        self.assertDictEqual(esq.bool_(filter=[]), {"bool": {"filter": []}})
+
+        query = esq.bool_(filter=[esq.term("a", 1)], must_not=esq.exists("b"))
+        self.assertDictEqual(query, {"bool": {"filter": [{"term": {"a": 1}}],
+                                              "must_not": {"exists": {"field": "b"}}}})
+
+    def test_search(self):
+        """Test whether the body of the searches is built"""
+
+        self.assertDictEqual(esq.search(), {})
+
+        aggs = {"author": esq.terms_agg("author_uuid", size=10, aggs={"max": esq.max_("date")})}
+        body = esq.search(query=esq.term("type", "issue"), size=0, sort=[esq.sort("date", order="desc")],
+                          aggs=aggs, source=["uuid"], **{"from": 20})
+        expected = {
+            "size": 0,
+            "query": {"term": {"type": "issue"}},
+            "sort": [{"date": {"order": "desc"}}],
+            "aggs": {
+                "author": {
+                    "terms": {"field": "author_uuid", "size": 10},
+                    "aggs": {"max": {"max": {"field": "date"}}}
+                }
+            },
+            "_source": ["uuid"],
+            "from": 20
+        }
+        self.assertDictEqual(body, expected)
+
+    def test_aggs(self):
+        """Test whether the aggregations are built"""
+
+        self.assertDictEqual(esq.min_("date"), {"min": {"field": "date"}})
+        self.assertDictEqual(esq.value_count("closed_at"), {"value_count": {"field": "closed_at"}})
+        self.assertDictEqual(esq.terms_agg("type"), {"terms": {"field": "type"}})
+        self.assertDictEqual(esq.terms_agg("path", order={"_key": "desc"}),
+                             {"terms": {"field": "path", "order": {"_key": "desc"}}})
+        self.assertDictEqual(esq.top_hits(sort=[esq.sort("date")], _source="date"),
+                             {"top_hits": {"size": 1, "sort": [{"date": {"order": "asc"}}], "_source": "date"}})
+
+    def test_script(self):
+        """Test whether the update scripts are built"""
+
+        self.assertDictEqual(esq.script("ctx._source.a = 1"), {"source": "ctx._source.a = 1", "lang": "painless"})
+        self.assertDictEqual(esq.script("s", params={"a": None}),
+                             {"source": "s", "lang": "painless", "params": {"a": None}})
+
+    def test_escaping(self):
+        """Test whether the values with quotes and backslashes are kept as they are"""
+
+        value = 'name "quoted" \\ \'single\''
+        query = esq.search(query=esq.bool_(filter=[esq.term("name", value), esq.terms("tags", [value])]))
+
+        decoded = json.loads(json.dumps(query))
+        self.assertEqual(decoded['query']['bool']['filter'][0]['term']['name'], value)
+        self.assertListEqual(decoded['query']['bool']['filter'][1]['terms']['tags'], [value])
+
+
+if __name__ == "__main__":
+    unittest.main()
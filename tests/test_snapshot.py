@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2020 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from grimoirelab_toolkit.datetime import unixtime_to_datetime
+
+from grimoire_elk.snapshot import RawSnapshot
+
+
+def read_file(filename):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)) as f:
+        return f.read()
+
+
+class TestRawSnapshot(unittest.TestCase):
+    """Tests of the local snapshot of raw items"""
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='snapshot_')
+        self.path = os.path.join(self.tmp_path, 'raw.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def read(self, snapshot, *args, **kwargs):
+        return [item for page in snapshot.read_pages(*args, **kwargs) for item in page]
+
+    def test_write_read(self):
+        """Test whether the items are read in the order of their timestamp"""
+
+        items = json.loads(read_file('data/git.json'))
+        snapshot = RawSnapshot(self.path)
+
+        self.assertEqual(snapshot.write(items[5:]), 6)
+        self.assertEqual(snapshot.write(items[:5]), 5)
+        self.assertEqual(snapshot.write([]), 0)
+        snapshot.close()
+
+        snapshot = RawSnapshot(self.path)
+        self.assertEqual(snapshot.count(), 11)
+
+        expected = sorted(items, key=lambda item: (item['timestamp'], item['uuid']))
+        self.assertListEqual(self.read(snapshot), expected)
+
+        pages = list(snapshot.read_pages(page_size=4))
+        self.assertListEqual([len(page) for page in pages], [4, 4, 3])
+        self.assertListEqual([item for page in pages for item in page], expected)
+
+        self.assertListEqual(self.read(snapshot, after=expected[3]['uuid']), expected[4:])
+        self.assertListEqual(self.read(snapshot, after='unknown'), expected)
+
+    def test_replace(self):
+        """Test whether the items with the same uuid are replaced"""
+
+        items = json.loads(read_file('data/git.json'))
+        snapshot = RawSnapshot(self.path)
+        snapshot.write(items)
+
+        item = dict(items[0])
+        item['data'] = {'commit': 'new'}
+        snapshot.write([item])
+        snapshot.close()
+
+        self.assertEqual(snapshot.count(), 11)
+        read = self.read(snapshot, [('uuid', [item['uuid']])])
+        self.assertListEqual(read, [item])
+
+    def test_filters(self):
+        """Test whether the items are filtered as the raw index is"""
+
+        items = json.loads(read_file('data/git.json'))
+        snapshot = RawSnapshot(self.path)
+        snapshot.write(items)
+        snapshot.close()
+
+        origin = '/tmp/perceval_mc84igfc/gittest'
+        read = self.read(snapshot, [('origin', [origin])])
+        self.assertEqual(len(read), len([item for item in items if item['origin'] == origin]))
+        self.assertTrue(all(item['origin'] == origin for item in read))
+
+        uuids = [items[2]['uuid'], items[7]['uuid'], 'unknown']
+        read = self.read(snapshot, [('origin', [origin]), ('uuid', uuids)])
+        self.assertListEqual(sorted(item['uuid'] for item in read), sorted(uuids[:2]))
+
+        author = items[0]['data']['Author']
+        read = self.read(snapshot, [('data.Author', [author])])
+        self.assertListEqual(read, [item for item in items if item['data']['Author'] == author])
+
+        read = self.read(snapshot, [('data.unknown', ['value'])])
+        self.assertListEqual(read, [])
+
+        from_date = unixtime_to_datetime(items[6]['timestamp'])
+        read = self.read(snapshot, from_date=from_date)
+        self.assertListEqual(read, [item for item in items if item['timestamp'] >= items[6]['timestamp']])
+
+    def test_offset(self):
+        """Test whether the items are filtered by offset"""
+
+        items = json.loads(read_file('data/kitsune.json'))
+        snapshot = RawSnapshot(self.path)
+        snapshot.write(items)
+        snapshot.close()
+
+        read = self.read(snapshot, [('origin', ['http://example.com'])], offset=2)
+        self.assertListEqual([item['offset'] for item in read], [2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
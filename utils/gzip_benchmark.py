@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2020 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Benchmark of the gzip compression of the bulk requests.
+
+The raw items of the test fixtures are uploaded with the bulk API to a
+local stand-in server, which accepts any bulk request and counts the bytes
+received. For every compression level, the bytes on the wire and the CPU
+time of the client are reported. Note that the copies of the same items
+compress better than distinct items would.
+
+Usage: gzip_benchmark.py [--data-dir tests/data] [--copies 10] [fixture ...]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from grimoire_elk import codec
+from grimoire_elk.elastic import BULK_ACTION_INDEX
+from grimoire_elk.enriched.utils import grimoire_con
+
+DEFAULT_FIXTURES = ['gerrit.json', 'jira.json', 'github.json', 'mbox.json', 'slack.json']
+LEVELS = [None, 1, 6, 9]
+
+
+class BulkStandInHandler(BaseHTTPRequestHandler):
+    """Accept bulk requests as ElasticSearch would, counting the bytes received"""
+
+    def do_PUT(self):
+        length = int(self.headers['Content-Length'])
+        body = self.rfile.read(length)
+        self.server.bytes_received += length
+
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        num_items = body.count(b"\n") // 2
+        response = json.dumps({"took": 1, "errors": False,
+                               "items": [{"index": {"status": 201}}] * num_items}).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    do_POST = do_PUT
+
+    def log_message(self, format, *args):
+        pass
+
+
+def get_params():
+    parser = argparse.ArgumentParser(description="Benchmark the gzip compression of bulk requests")
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(__file__), '..', 'tests', 'data'),
+                        help="Directory with the JSON fixtures")
+    parser.add_argument('--copies', default=10, type=int,
+                        help="Times the items of each fixture are included in the bulk (default 10)")
+    parser.add_argument('fixtures', nargs='*', default=DEFAULT_FIXTURES,
+                        help="JSON fixtures to upload")
+
+    return parser.parse_args()
+
+
+def build_bulk(path, copies):
+    """Build the body of a bulk request as `BulkWriter` does: the documents are
+    serialized to bytes once and the chunks are joined when the body is sent"""
+
+    with open(path) as f:
+        items = json.load(f)
+
+    chunks = []
+    for i in range(copies):
+        for item in items:
+            chunks.append((BULK_ACTION_INDEX % "{}_{}".format(item.get('uuid', ''), i)).encode('utf-8'))
+            chunks.append(codec.dumpb(item))
+            chunks.append(b"\n")
+
+    return b"".join(chunks)
+
+
+def run(server, url, bulk_json, level):
+    conn = grimoire_con()
+    adapter = conn.get_adapter(url)
+    adapter.compress_level = level
+
+    server.bytes_received = 0
+    cpu_init = time.process_time()
+    res = conn.put(url, data=bulk_json, headers={"Content-Type": "application/x-ndjson"})
+    res.raise_for_status()
+    cpu_time = time.process_time() - cpu_init
+
+    return server.bytes_received, cpu_time
+
+
+def main():
+    args = get_params()
+
+    server = HTTPServer(('127.0.0.1', 0), BulkStandInHandler)
+    server.bytes_received = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    url = "http://127.0.0.1:{}/bench/_bulk".format(server.server_port)
+
+    print("{:<14} {:>6} {:>12} {:>12} {:>7} {:>10}".format(
+          "fixture", "level", "body bytes", "wire bytes", "ratio", "cpu ms"))
+
+    for fixture in args.fixtures:
+        bulk_json = build_bulk(os.path.join(args.data_dir, fixture), args.copies)
+        body_size = len(bulk_json)
+
+        for level in LEVELS:
+            wire_size, cpu_time = run(server, url, bulk_json, level)
+            print("{:<14} {:>6} {:>12} {:>12} {:>7.2f} {:>10.1f}".format(
+                  fixture, level if level else '-', body_size, wire_size,
+                  wire_size / body_size, cpu_time * 1000))
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
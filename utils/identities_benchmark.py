@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2020 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Benchmark of the anonymization of the raw items.
+
+The raw items of the test fixtures are anonymized by the identities class
+of their backend, computing every pseudonym (plain) and using the memo of
+the pseudonyms of `Identities._hash` (memoized). The time per item and the
+hits of the memo are reported. The items which can't be anonymized are left
+out. Note that the copies of the same items only have the identities of the
+fixture, so the hits are higher than with the items of real data sources.
+
+Usage: identities_benchmark.py [--data-dir tests/data] [--copies 100] [fixture ...]
+"""
+
+import argparse
+import copy
+import json
+import os
+import time
+
+from grimoire_elk.identities.git import GitIdentities
+from grimoire_elk.identities.github import GitHubIdentities
+from grimoire_elk.identities.gitlab import GitlabIdentities
+from grimoire_elk.identities.identities import Identities
+from grimoire_elk.identities.meetup import MeetupIdentities
+from grimoire_elk.identities.stackexchange import StackExchangeIdentities
+
+FIXTURES = {
+    'git.json': GitIdentities,
+    'github.json': GitHubIdentities,
+    'gitlab.json': GitlabIdentities,
+    'meetup.json': MeetupIdentities,
+    'stackexchange.json': StackExchangeIdentities
+}
+
+
+def get_params():
+    parser = argparse.ArgumentParser(description="Benchmark the anonymization of the raw items")
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(__file__), '..', 'tests', 'data'),
+                        help="Directory with the JSON fixtures")
+    parser.add_argument('--copies', default=100, type=int,
+                        help="Times the items of each fixture are anonymized (default 100)")
+    parser.add_argument('fixtures', nargs='*', default=list(FIXTURES),
+                        help="JSON fixtures to anonymize, among {}".format(", ".join(FIXTURES)))
+
+    return parser.parse_args()
+
+
+def load_items(path, identities, copies):
+    with open(path) as f:
+        items = json.load(f)
+
+    # Some items of the fixtures can't be anonymized (e.g., without the data of their users)
+    valid = []
+    for item in items:
+        try:
+            identities.anonymize_item(copy.deepcopy(item))
+        except (KeyError, TypeError):
+            continue
+        valid.append(item)
+
+    # The items are anonymized in place, so each run needs its own copies
+    return [copy.deepcopy(item) for _ in range(copies) for item in valid]
+
+
+def run(identities, items, memoized):
+    """CPU time anonymizing the items, starting with an empty memo of the
+    pseudonyms or, if not `memoized`, computing every pseudonym"""
+
+    memo = Identities.__dict__['_hash']
+    if memoized:
+        Identities._hash.cache_clear()
+    else:
+        Identities._hash = staticmethod(Identities._hash.__wrapped__)
+
+    try:
+        cpu_init = time.process_time()
+        for item in items:
+            identities.anonymize_item(item)
+        cpu_time = time.process_time() - cpu_init
+    finally:
+        Identities._hash = memo
+
+    return cpu_time
+
+
+def main():
+    args = get_params()
+
+    print("{:<20} {:>8} {:>12} {:>12} {:>8} {:>10}".format(
+          "fixture", "items", "plain us", "memo us", "speedup", "hit ratio"))
+
+    for fixture in args.fixtures:
+        identities = FIXTURES[fixture]
+        path = os.path.join(args.data_dir, fixture)
+
+        plain_time = run(identities, load_items(path, identities, args.copies), memoized=False)
+        items = load_items(path, identities, args.copies)
+        memo_time = run(identities, items, memoized=True)
+        cache = Identities.hash_cache_info()
+
+        lookups = cache.hits + cache.misses
+        print("{:<20} {:>8} {:>12.2f} {:>12.2f} {:>8.2f} {:>10.2f}".format(
+              fixture, len(items), plain_time / len(items) * 1e6, memo_time / len(items) * 1e6,
+              plain_time / memo_time if memo_time else 0.0, cache.hits / lookups if lookups else 0.0))
+
+
+if __name__ == '__main__':
+    main()
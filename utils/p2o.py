@@ -24,10 +24,13 @@ import logging
 from datetime import datetime
 from os import sys
 
-from grimoire_elk.elk import feed_backend, enrich_backend
+from grimoire_elk.elk import feed_backend, feed_backends, enrich_backend
 from grimoire_elk.elastic import ElasticSearch
 from grimoire_elk.elastic_items import ElasticItems
-from grimoire_elk.utils import get_params, config_logging
+from grimoire_elk.enriched.enrich import Enrich
+from grimoire_elk.enriched.utils import GzipHTTPAdapter
+from grimoire_elk.raw.elastic import ElasticOcean
+from grimoire_elk.utils import get_params, config_logging, read_origins_file
 
 
 if __name__ == '__main__':
@@ -42,7 +45,7 @@ if __name__ == '__main__':
     url = args.elastic_url
 
     clean = args.no_incremental
-    if args.fetch_cache:
+    if args.fetch_cache or args.replay_archive:
         clean = True
 
     try:
@@ -50,14 +53,77 @@ if __name__ == '__main__':
             # Configure elastic bulk size and scrolling
             if args.bulk_size:
                 ElasticSearch.max_items_bulk = args.bulk_size
+            if args.bulk_bytes:
+                ElasticSearch.max_bytes_bulk = args.bulk_bytes
+            if args.bulk_workers:
+                ElasticSearch.bulk_workers = args.bulk_workers
+            if args.gzip_level:
+                GzipHTTPAdapter.compress_level = args.gzip_level
+            if args.gzip_min_size is not None:
+                GzipHTTPAdapter.compress_min_size = args.gzip_min_size
+            if args.dead_letter_file:
+                ElasticSearch.dead_letter_path = args.dead_letter_file
+            if args.refresh_policy:
+                ElasticSearch.refresh_policy = args.refresh_policy
+            if args.bulk_load:
+                ElasticSearch.bulk_load = True
+                ElasticSearch.bulk_load_force_merge = args.bulk_load_force_merge
             if args.scroll_size:
                 ElasticItems.scroll_size = args.scroll_size
             if args.scroll_wait:
                 ElasticItems.scroll_wait = args.scroll_wait
-            if not args.enrich_only:
+            if args.max_scrolls:
+                ElasticItems.max_scrolls = args.max_scrolls
+            if args.max_cluster_scrolls:
+                ElasticItems.max_cluster_scrolls = args.max_cluster_scrolls
+            if args.adaptive_scroll_size:
+                ElasticItems.adaptive_scroll_size = True
+            if args.scroll_size_min:
+                ElasticItems.scroll_size_min = args.scroll_size_min
+            if args.scroll_size_max:
+                ElasticItems.scroll_size_max = args.scroll_size_max
+            if args.reader:
+                ElasticItems.reader = args.reader
+            if args.scroll_slices:
+                ElasticItems.scroll_slices = args.scroll_slices
+            if args.prefetch_pages:
+                ElasticItems.prefetch_pages = args.prefetch_pages
+            if args.stream_pages:
+                ElasticItems.stream_pages = True
+            # The snapshot only keeps the raw items
+            if args.raw_snapshot:
+                ElasticOcean.raw_snapshot = args.raw_snapshot
+            if args.read_raw_snapshot:
+                ElasticOcean.read_raw_snapshot = True
+            if args.raw_fingerprints:
+                ElasticOcean.fingerprints_path = args.raw_fingerprints
+            if args.feed_pipeline:
+                ElasticOcean.pipeline_queue_size = args.feed_pipeline
+            if args.feed_spool_dir:
+                ElasticOcean.pipeline_spool_dir = args.feed_spool_dir
+            if args.replay_bulk_bytes:
+                ElasticOcean.replay_max_bytes_bulk = args.replay_bulk_bytes
+            if args.enrich_checkpoints:
+                Enrich.checkpoint_path = args.enrich_checkpoints
+            if args.checkpoint_interval is not None:
+                Enrich.checkpoint_interval = args.checkpoint_interval
+
+            # The params of each origin to feed and enrich
+            origins = [args.backend_args]
+            if args.origins_file:
+                origins = read_origins_file(args.origins_file, args.backend_args)
+
+            if not args.enrich_only and args.origins_file:
+                feed_backends(url, args.fetch_cache, args.backend, origins,
+                              args.index, args.index_enrich, args.project,
+                              workers=args.feed_workers, processes=args.feed_processes,
+                              replay=args.replay_archive)
+                logging.info("Backend feed completed")
+            elif not args.enrich_only:
                 feed_backend(url, clean, args.fetch_cache,
                              args.backend, args.backend_args,
-                             args.index, args.index_enrich, args.project)
+                             args.index, args.index_enrich, args.project,
+                             replay=args.replay_archive)
                 logging.info("Backend feed completed")
 
             studies_args = None
@@ -73,20 +139,22 @@ if __name__ == '__main__':
 
             if args.enrich or args.enrich_only:
                 unaffiliated_group = None
-                enrich_backend(url, clean, args.backend, args.backend_args, None,
-                               args.index, args.index_enrich,
-                               args.db_projects_map, args.json_projects_map,
-                               args.db_sortinghat,
-                               args.no_incremental, args.only_identities,
-                               args.github_token,
-                               args.studies, args.only_studies,
-                               args.elastic_url_enrich, args.events_enrich,
-                               args.db_user, args.db_password, args.db_host,
-                               args.refresh_projects, args.refresh_identities,
-                               args.author_id, args.author_uuid,
-                               args.filter_raw,
-                               args.jenkins_rename_file, unaffiliated_group,
-                               args.pair_programming, studies_args)
+                for num, backend_args in enumerate(origins):
+                    # The enriched index is cleaned only before the first origin
+                    enrich_backend(url, clean and num == 0, args.backend, backend_args, None,
+                                   args.index, args.index_enrich,
+                                   args.db_projects_map, args.json_projects_map,
+                                   args.db_sortinghat,
+                                   args.no_incremental, args.only_identities,
+                                   args.github_token,
+                                   args.studies, args.only_studies,
+                                   args.elastic_url_enrich, args.events_enrich,
+                                   args.db_user, args.db_password, args.db_host,
+                                   args.refresh_projects, args.refresh_identities,
+                                   args.author_id, args.author_uuid,
+                                   args.filter_raw,
+                                   args.jenkins_rename_file, unaffiliated_group,
+                                   args.pair_programming, studies_args)
                 logging.info("Enrich backend completed")
             elif args.events_enrich:
                 logging.info("Enrich option is needed for events_enrich")